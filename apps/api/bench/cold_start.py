@@ -0,0 +1,150 @@
+"""
+Cold-start benchmark: launches the API under uvicorn in a fresh process and
+measures, from process launch,
+
+    first_response_ms   first HTTP response served (GET /ready, whatever its status)
+    ready_ms            /ready returning 200 (all READY_REQUIRED subsystems warm)
+
+plus the app's own view from /ready: import time, first response and each
+subsystem's init time. Repeated --runs times; median per metric.
+
+    python -m bench.cold_start --runs 3
+    python -m bench.cold_start --required "" --save-baseline
+    python -m bench.cold_start --baseline
+
+Run from apps/api. --required "" counts the process as ready as soon as it
+serves, for machines without torch or the CLIP weights.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from bench import report
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "data" / "cold_start_baseline.json"
+POLL_SEC = 0.02
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get_ready(url: str) -> Optional[Dict[str, Any]]:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as r:
+            return {"status": r.status, **json.loads(r.read())}
+    except urllib.error.HTTPError as e:
+        return {"status": e.code, **json.loads(e.read() or b"{}")}
+    except (OSError, ValueError):
+        return None
+
+
+def run_once(*, required: str, timeout_sec: float, env_extra: Dict[str, str]) -> Dict[str, Any]:
+    port = _free_port()
+    env = {**os.environ, "READY_REQUIRED": required, "PYTHONUNBUFFERED": "1", **env_extra}
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    url = f"http://127.0.0.1:{port}/ready"
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    out: Dict[str, Any] = {"first_response_ms": None, "ready_ms": None}
+    last: Optional[Dict[str, Any]] = None
+    try:
+        while time.perf_counter() - started < timeout_sec:
+            if proc.poll() is not None:
+                out["error"] = f"exited with {proc.returncode}"
+                break
+            last = _get_ready(url)
+            if last is not None:
+                elapsed = (time.perf_counter() - started) * 1000
+                if out["first_response_ms"] is None:
+                    out["first_response_ms"] = elapsed
+                if last["status"] == 200:
+                    out["ready_ms"] = elapsed
+                    break
+            time.sleep(POLL_SEC)
+        else:
+            out["error"] = f"not ready after {timeout_sec:.0f}s"
+    finally:
+        proc.terminate()
+        try:
+            log, _ = proc.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            log, _ = proc.communicate()
+    if last is not None:
+        out["app"] = last.get("startup", {})
+        out["subsystems"] = last.get("subsystems", {})
+    if "error" in out:
+        out["log_tail"] = log.strip().splitlines()[-15:]
+    return out
+
+
+def summarize_runs(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def median(values: List[Optional[float]]) -> Optional[float]:
+        values = [v for v in values if v is not None]
+        return statistics.median(values) if values else None
+
+    metrics = {
+        "first_response_ms": median([r["first_response_ms"] for r in runs]),
+        "ready_ms": median([r["ready_ms"] for r in runs]),
+        "app_import_ms": median([(r.get("app") or {}).get("app_import_sec", 0) * 1000 or None for r in runs]),
+    }
+    names = sorted({name for r in runs for name in r.get("subsystems", {})})
+    for name in names:
+        init = [(r["subsystems"].get(name) or {}).get("init_sec") for r in runs]
+        metrics[f"init.{name}_ms"] = median([v * 1000 if v is not None else None for v in init])
+    return {"runs": runs, "metrics": {k: v for k, v in metrics.items() if v is not None}}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--required", default="clip", help="READY_REQUIRED for the launched process")
+    parser.add_argument("--timeout-sec", type=float, default=180.0)
+    parser.add_argument("--no-warmup", action="store_true", help="launch with WARMUP_ON_STARTUP=0")
+    parser.add_argument("--out", type=Path)
+    parser.add_argument("--save-baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=report.DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    env_extra = {"WARMUP_ON_STARTUP": "0"} if args.no_warmup else {}
+    runs = []
+    for i in range(args.runs):
+        r = run_once(required=args.required, timeout_sec=args.timeout_sec, env_extra=env_extra)
+        runs.append(r)
+        states = ", ".join(f"{n}={s.get('state')}" for n, s in r.get("subsystems", {}).items())
+        print(
+            f"[bench] run {i + 1}: first response {r['first_response_ms'] or float('nan'):.0f} ms, "
+            f"ready {r['ready_ms'] or float('nan'):.0f} ms ({states}){'  ' + r['error'] if 'error' in r else ''}"
+        )
+        for line in r.get("log_tail", []):
+            print(f"   | {line}")
+
+    scenario = summarize_runs(runs)
+    for metric, value in scenario["metrics"].items():
+        print(f"   {metric:<24} {value:9.1f}")
+    results = {"meta": report.run_meta(bench="cold_start", required=args.required), "scenarios": {"cold_start": scenario}}
+    if args.out:
+        report.save(args.out, results)
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+    if args.baseline:
+        rows = report.compare(report.load(args.baseline), results, threshold=args.threshold)
+        return 1 if report.print_comparison(rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""
+Offline end-to-end benchmark for the extract stream and the lens flow.
+
+Runs the real request builders against local stand-ins (see bench/stand_ins.py)
+serving a fixture set, at one or more concurrency levels, and reports per-stage
+p50/p95 latency, throughput and peak RSS. Results can be saved as a baseline and
+later runs compared against it.
+
+    python -m bench.fixtures generate
+    python -m bench.e2e --clip fake --concurrency 1,4,8 --requests 24 --save-baseline bench/data/e2e_baseline.json
+    python -m bench.e2e --clip fake --concurrency 1,4,8 --requests 24 --baseline bench/data/e2e_baseline.json
+
+Run from apps/api. Exit status is 1 when a metric regressed past --threshold.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from bench import report
+from bench.fixtures import DEFAULT_DIR, FixtureSet
+from bench.stand_ins import R2_PUBLIC_PREFIX, StandInServer, parse_latency
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "data" / "e2e_baseline.json"
+RSS_SAMPLE_SEC = 0.05
+
+
+def configure_env(base_url: str, *, warm_caches: bool) -> None:
+    """Points the pipeline at the stand-ins. Must run before any helpers import."""
+    os.environ["SERPAPI_ENDPOINT"] = f"{base_url}/search.json"
+    os.environ["SERPAPI_API_KEY"] = "bench"
+    os.environ["EXTRACT_TIMING_BREAKDOWN"] = "1"
+    os.environ["R2_ENDPOINT_URL"] = base_url
+    os.environ["R2_PUBLIC_IMG_BASE"] = f"{base_url}{R2_PUBLIC_PREFIX}"
+    for key in ("R2_ACCOUNT_ID", "R2_ACCESS_KEY_ID", "R2_SECRET_ACCESS_KEY"):
+        os.environ[key] = "bench"
+    if not warm_caches:
+        os.environ["RESULT_CACHE_MAX_ENTRIES"] = "0"
+        os.environ["SERP_CACHE_TTL_SEC"] = "0"
+        os.environ["LENS_CACHE_MAX_ENTRIES"] = "0"
+        os.environ["R2_KNOWN_KEY_TTL_SEC"] = "0"
+
+
+class FakeClip:
+    """
+    CPU stand-in for clip_service when torch or the weights are unavailable.
+    Embeds a 16x16 thumbnail of each crop, so look-alike listings still score
+    high, and optionally sleeps `cost_ms` per crop to mimic model time.
+    """
+
+    def __init__(self, cost_ms: float = 0.0):
+        self.cost_sec = cost_ms / 1000.0
+
+    def _embed(self, img: Any, crops: List[float]) -> List[List[float]]:
+        import numpy as np
+
+        vecs = []
+        w, h = img.size
+        for frac in crops:
+            side = max(1, int(min(w, h) * frac))
+            left, top = (w - side) // 2, (h - side) // 2
+            arr = np.asarray(img.crop((left, top, left + side, top + side)).resize((16, 16)), dtype=np.float32).ravel()
+            arr -= arr.mean()
+            norm = float(np.linalg.norm(arr)) or 1.0
+            vecs.append((arr / norm).tolist())
+            if self.cost_sec:
+                time.sleep(self.cost_sec)
+        return vecs
+
+    def image_bytes_to_embeddings_multicrop(self, img_bytes: bytes, crops: List[float]) -> List[List[float]]:
+        from PIL import Image
+
+        with Image.open(io.BytesIO(img_bytes)) as im:
+            return self._embed(im.convert("RGB"), crops)
+
+    def image_bytes_batch_to_embeddings(
+        self,
+        images: List[bytes],
+        crops: List[float],
+        cancel_event: Optional[threading.Event] = None,
+    ) -> List[Optional[List[List[float]]]]:
+        from PIL import Image
+
+        out: List[Optional[List[List[float]]]] = []
+        for b in images:
+            if cancel_event is not None and cancel_event.is_set():
+                return [None for _ in images]
+            try:
+                with Image.open(io.BytesIO(b)) as im:
+                    out.append(self._embed(im.convert("RGB"), crops))
+            except Exception:
+                out.append(None)
+        return out
+
+
+class RssSampler:
+    """Peak resident set size while a scenario runs, sampled from a thread."""
+
+    def __init__(self, read_rss: Any):
+        self._read = read_rss
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_SEC):
+            self.peak_bytes = max(self.peak_bytes, self._read())
+
+    def __enter__(self) -> "RssSampler":
+        self.start_bytes = self.peak_bytes = self._read()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self._read())
+
+
+def _upload(data: bytes, name: str) -> Any:
+    from starlette.datastructures import Headers, UploadFile
+
+    return UploadFile(io.BytesIO(data), filename=name, headers=Headers({"content-type": "image/jpeg"}))
+
+
+async def run_extract(ctx: Dict[str, Any], req: Dict[str, Any], images: List[bytes]) -> Dict[str, Any]:
+    ess = ctx["ess"]
+    started = time.perf_counter()
+    resp = await ess.build_extract_file_stream_response(
+        openai_client=ctx["openai_client"],
+        main_image=_upload(images[0], "main.jpg"),
+        files=[_upload(b, f"extra{i}.jpg") for i, b in enumerate(images[1:])],
+        itemName=req.get("itemName"),
+        text=req.get("text"),
+        mode=req.get("mode") or "both",
+        budget_sec=req.get("budget_sec"),
+    )
+    first_event = None
+    result: Optional[Dict[str, Any]] = None
+    error = None
+    async for chunk in resp.body_iterator:
+        if first_event is None:
+            first_event = time.perf_counter() - started
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get("type") == "result":
+                result = event.get("data") or {}
+            elif event.get("type") == "error":
+                error = event.get("message") or event.get("detail") or "error"
+    out: Dict[str, Any] = {
+        "latency_sec": time.perf_counter() - started,
+        "first_event_sec": first_event,
+        "ok": result is not None and error is None,
+        "error": error,
+    }
+    if result is not None:
+        out["stages"] = result.get("stage_timings_sec") or {}
+        out["network_calls"] = (result.get("external_calls") or {}).get("network_calls")
+        out["degraded"] = bool(result.get("degraded_stages"))
+    return out
+
+
+async def run_lens(ctx: Dict[str, Any], req: Dict[str, Any], images: List[bytes]) -> Dict[str, Any]:
+    from fastapi import HTTPException
+
+    started = time.perf_counter()
+    error = None
+    body: Dict[str, Any] = {}
+    try:
+        resp = await ctx["lens"].build_extract_file_stream_lens_guided_response(
+            main_image=_upload(images[0], "main.jpg"),
+            files=[_upload(b, f"extra{i}.jpg") for i, b in enumerate(images[1:])],
+            text=req.get("text"),
+        )
+        body = json.loads(resp.body)
+    except HTTPException as e:
+        error = str(e.detail)
+    return {
+        "latency_sec": time.perf_counter() - started,
+        "ok": error is None and bool(body.get("total")),
+        "error": error,
+        "stages": body.get("phase_timings_sec") or {},
+    }
+
+
+async def run_scenario(
+    ctx: Dict[str, Any],
+    flow: str,
+    *,
+    concurrency: int,
+    n_requests: int,
+    warm_caches: bool,
+) -> Dict[str, Any]:
+    runner = run_extract if flow == "extract" else run_lens
+    requests = ctx["fixtures"].requests
+    if not warm_caches:
+        ctx["image_processing"]._THUMB_EMBED_CACHE.clear()
+
+    queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(requests[i % len(requests)])
+    samples: List[Dict[str, Any]] = []
+
+    async def worker() -> None:
+        while True:
+            try:
+                req = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if not warm_caches:
+                # Approximately cold: concurrent requests may still share thumbnails mid-run.
+                ctx["image_processing"]._THUMB_EMBED_CACHE.clear()
+            try:
+                samples.append(await runner(ctx, req, [ctx["fixtures"].image(req)]))
+            except Exception as e:
+                samples.append({"ok": False, "error": repr(e), "latency_sec": 0.0})
+
+    with RssSampler(ctx["read_rss"]) as rss:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return {"flow": flow, "concurrency": concurrency, **summarize_samples(samples, wall=wall, rss=rss)}
+
+
+def summarize_samples(samples: List[Dict[str, Any]], *, wall: float, rss: RssSampler) -> Dict[str, Any]:
+    """Latency, per-stage and throughput summary of runner results, plus the flat `metrics` used for baselines."""
+    ok = [s for s in samples if s["ok"]]
+    latency = report.summarize([s["latency_sec"] * 1000 for s in ok])
+    stages: Dict[str, List[float]] = {}
+    for s in ok:
+        for stage, sec in (s.get("stages") or {}).items():
+            stages.setdefault(stage, []).append(sec * 1000)
+    stage_summary = {stage: report.summarize(vals) for stage, vals in stages.items()}
+
+    metrics: Dict[str, Optional[float]] = {
+        "latency_p50_ms": latency.get("p50"),
+        "latency_p95_ms": latency.get("p95"),
+        "throughput_rps": len(ok) / wall if wall else None,
+        "peak_rss_mb": rss.peak_bytes / 1e6,
+    }
+    first = [s["first_event_sec"] * 1000 for s in ok if s.get("first_event_sec") is not None]
+    if first:
+        metrics["first_event_p50_ms"] = report.percentile(first, 0.5)
+    for stage, summary in sorted(stage_summary.items()):
+        metrics[f"stage.{stage}.p50_ms"] = summary["p50"]
+        metrics[f"stage.{stage}.p95_ms"] = summary["p95"]
+
+    errors = [s["error"] for s in samples if not s["ok"]]
+    calls = [s["network_calls"] for s in ok if s.get("network_calls") is not None]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": len(errors),
+        "error_examples": sorted(set(map(str, errors)))[:3],
+        "degraded": sum(1 for s in ok if s.get("degraded")),
+        "wall_sec": wall,
+        "rss_start_mb": rss.start_bytes / 1e6,
+        "network_calls_per_request": sum(calls) / len(calls) if calls else None,
+        "latency_ms": latency,
+        "stages_ms": stage_summary,
+        "metrics": metrics,
+    }
+
+
+def print_scenario(name: str, s: Dict[str, Any]) -> None:
+    m = s["metrics"]
+    lat = s["latency_ms"]
+    print(
+        f"\n== {name}: {s['ok']}/{s['requests']} ok, {s['errors']} errors, {s['degraded']} degraded, "
+        f"{m['throughput_rps'] or 0:.2f} req/s, peak RSS {m['peak_rss_mb']:.0f} MB"
+    )
+    if lat.get("n"):
+        print(f"   total        p50 {lat['p50']:9.1f} ms   p95 {lat['p95']:9.1f} ms   max {lat['max']:9.1f} ms")
+    for stage, summary in s["stages_ms"].items():
+        print(f"   {stage:<12} p50 {summary['p50']:9.1f} ms   p95 {summary['p95']:9.1f} ms")
+    for example in s["error_examples"]:
+        print(f"   error: {example}")
+
+
+def load_pipeline(args: argparse.Namespace, fixtures: Any, server: StandInServer) -> Dict[str, Any]:
+    from openai import OpenAI
+
+    from helpers import extract_stream_service, image_processing, memory
+
+    if args.clip == "real":
+        image_processing.set_clip_service(image_processing.load_clip_service_module())
+    else:
+        image_processing.set_clip_service(FakeClip(cost_ms=args.fake_clip_ms))
+
+    ctx: Dict[str, Any] = {
+        "fixtures": fixtures,
+        "ess": extract_stream_service,
+        "image_processing": image_processing,
+        "openai_client": OpenAI(api_key="bench", base_url=f"{server.base_url}/v1", max_retries=0),
+        "read_rss": lambda: memory.process_memory_stats().get("rss_bytes", 0),
+    }
+    if "lens" in args.flows:
+        from helpers import lens_service
+
+        ctx["lens"] = lens_service
+    return ctx
+
+
+async def _run(args: argparse.Namespace, ctx: Dict[str, Any]) -> Dict[str, Any]:
+    scenarios: Dict[str, Any] = {}
+    for flow in args.flows:
+        if args.warmup:
+            await run_scenario(ctx, flow, concurrency=1, n_requests=args.warmup, warm_caches=args.warm_caches)
+        for c in args.concurrency:
+            name = f"{flow}@c{c}"
+            scenarios[name] = await run_scenario(
+                ctx, flow, concurrency=c, n_requests=args.requests, warm_caches=args.warm_caches
+            )
+            print_scenario(name, scenarios[name])
+    return scenarios
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_DIR)
+    parser.add_argument("--flows", default="extract,lens", help="comma list of extract,lens")
+    parser.add_argument("--concurrency", default="1,4", help="comma list of concurrent request counts")
+    parser.add_argument("--requests", type=int, default=12, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests per flow")
+    parser.add_argument("--clip", choices=("real", "fake"), default="real")
+    parser.add_argument("--fake-clip-ms", type=float, default=0.0, help="simulated model time per crop")
+    parser.add_argument(
+        "--latency",
+        action="append",
+        metavar="ROUTE=BASE_MS:JITTER_MS",
+        help="override injected latency for serp, lens, thumbs, llm or r2 (repeatable)",
+    )
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply all injected latency (0 = none)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm-caches", action="store_true", help="keep SERP, result and thumbnail caches on")
+    parser.add_argument("--out", type=Path, help="write results JSON here")
+    parser.add_argument("--save-baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=report.DEFAULT_THRESHOLD)
+    parser.add_argument("--verbose-compare", action="store_true")
+    args = parser.parse_args()
+    args.flows = [f.strip() for f in args.flows.split(",") if f.strip()]
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    if not (args.fixtures / "manifest.json").exists():
+        print(f"[bench] no fixtures at {args.fixtures}; run `python -m bench.fixtures generate` first")
+        return 2
+    fixtures = FixtureSet(args.fixtures)
+    server = StandInServer(
+        fixtures, latency=parse_latency(args.latency), latency_scale=args.latency_scale, seed=args.seed
+    ).start()
+    configure_env(server.base_url, warm_caches=args.warm_caches)
+    try:
+        ctx = load_pipeline(args, fixtures, server)
+        scenarios = asyncio.run(_run(args, ctx))
+    finally:
+        server.stop()
+
+    results = {
+        "meta": report.run_meta(
+            bench="e2e",
+            clip=args.clip,
+            fake_clip_ms=args.fake_clip_ms,
+            latency={k: [v.base_ms, v.jitter_ms] for k, v in server.latency.items()},
+            latency_scale=args.latency_scale,
+            warm_caches=args.warm_caches,
+            fixtures=str(args.fixtures),
+            fixtures_digest=hashlib.sha256((args.fixtures / "manifest.json").read_bytes()).hexdigest()[:12],
+            stand_in_requests=dict(server.counts),
+        ),
+        "scenarios": scenarios,
+    }
+    if args.out:
+        report.save(args.out, results)
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+
+    if args.baseline:
+        baseline = report.load(args.baseline)
+        if baseline["meta"].get("fixtures_digest") != results["meta"]["fixtures_digest"]:
+            print("[bench] warning: baseline was recorded against a different fixture set")
+        for key in ("clip", "latency", "latency_scale", "warm_caches"):
+            if baseline["meta"].get(key) != results["meta"][key]:
+                print(f"[bench] warning: baseline {key} differs ({baseline['meta'].get(key)} vs {results['meta'][key]})")
+        rows = report.compare(baseline, results, threshold=args.threshold)
+        if report.print_comparison(rows, verbose=args.verbose_compare):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
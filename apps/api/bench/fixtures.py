@@ -0,0 +1,444 @@
+"""
+Fixture sets for the offline benchmarks.
+
+A fixture set is a directory:
+
+    manifest.json   requests to replay plus lookup tables (see below)
+    images/         uploaded images, one per request
+    thumbs/         listing thumbnails referenced from serp/ and lens/
+    serp/           SerpAPI eBay responses
+    lens/           SerpAPI Google Lens responses
+    llm/            OpenAI extraction outputs ({"output_text": ..., "usage": {...}})
+
+manifest.json:
+
+    {"version": 1,
+     "requests": [{"id", "image", "mode", "itemName", "text"}],
+     "serp": {"<normalized query>|active": "serp/x.json", ...},
+     "llm":  {"<sha256 of image bytes>": "llm/x.json"},
+     "lens": {"<sha256 of image bytes>": "lens/x.json"}}
+
+Thumbnail URLs inside serp/ and lens/ files are written as "{{THUMBS}}/<name>"
+and resolved to the stand-in server when served.
+
+    python -m bench.fixtures generate --out bench/data/fixtures
+    python -m bench.fixtures record --images ~/photos --out bench/data/recorded
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+THUMBS_PLACEHOLDER = "{{THUMBS}}"
+DEFAULT_DIR = Path(__file__).resolve().parent / "data" / "fixtures"
+EMPTY_SERP = b'{"organic_results": []}'
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_query(q: str) -> str:
+    # Same normalization as the SERP cache key.
+    return " ".join((q or "").lower().split())
+
+
+def serp_key(q: str, sold: bool) -> str:
+    return f"{normalize_query(q)}|{'sold' if sold else 'active'}"
+
+
+def serp_token_index(keys: Any) -> Dict[str, set]:
+    return {key: set(_TOKEN_RE.findall(key.rsplit("|", 1)[0])) for key in keys}
+
+
+def closest_serp_key(index: Dict[str, set], q: str, sold: bool) -> Optional[str]:
+    """Indexed key of the same kind whose query shares the most tokens with `q` (Jaccard)."""
+    kind = "sold" if sold else "active"
+    tokens = set(_TOKEN_RE.findall(normalize_query(q)))
+    best, best_score = None, 0.0
+    for key, key_tokens in index.items():
+        if not key.endswith(f"|{kind}") or not key_tokens:
+            continue
+        score = len(tokens & key_tokens) / len(tokens | key_tokens)
+        if score > best_score:
+            best, best_score = key, score
+    return best
+
+
+def _slug(text: str, limit: int = 48) -> str:
+    return "-".join(_TOKEN_RE.findall(text.lower()))[:limit] or "item"
+
+
+class FixtureSet:
+    """Read-only view of a fixture directory, used by the stand-in servers."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.manifest: Dict[str, Any] = json.loads((self.root / "manifest.json").read_text(encoding="utf-8"))
+        self.requests: List[Dict[str, Any]] = self.manifest.get("requests", [])
+        self._files: Dict[str, bytes] = {}
+        self._serp_tokens = serp_token_index(self.manifest.get("serp", {}))
+
+    def resolve(self, body: bytes, base_url: str) -> bytes:
+        return body.replace(THUMBS_PLACEHOLDER.encode(), f"{base_url}/thumbs".encode())
+
+    def read(self, rel: str) -> bytes:
+        data = self._files.get(rel)
+        if data is None:
+            data = (self.root / rel).read_bytes()
+            self._files[rel] = data
+        return data
+
+    def image(self, req: Dict[str, Any]) -> bytes:
+        return self.read(req["image"])
+
+    def thumb(self, name: str) -> Optional[bytes]:
+        path = (self.root / "thumbs" / name).resolve()
+        if path.parent != (self.root / "thumbs").resolve() or not path.is_file():
+            return None
+        return self.read(f"thumbs/{name}")
+
+    def serp(self, q: str, sold: bool) -> bytes:
+        """
+        Exact query match first. Refined queries are built from listing titles, so
+        otherwise the recorded query sharing the most tokens stands in for them.
+        """
+        table = self.manifest.get("serp", {})
+        key = serp_key(q, sold)
+        rel = table.get(key)
+        if rel is None:
+            best = closest_serp_key(self._serp_tokens, q, sold)
+            rel = table.get(best) if best else table.get(f"_default|{key.rsplit('|', 1)[1]}")
+        return self.read(rel) if rel else EMPTY_SERP
+
+    def llm(self, image_sha: Optional[str]) -> Dict[str, Any]:
+        table = self.manifest.get("llm", {})
+        rel = table.get(image_sha or "") or table.get("_default")
+        if rel is None:
+            return {"output_text": json.dumps({"query": "vintage item"})}
+        return json.loads(self.read(rel))
+
+    def lens(self, image_sha: Optional[str]) -> bytes:
+        table = self.manifest.get("lens", {})
+        rel = table.get(image_sha or "") or table.get("_default")
+        return self.read(rel) if rel else b"{}"
+
+
+# --- synthetic generation ---------------------------------------------------
+
+_CATALOG = [
+    ("sony walkman wm-fx", ["cassette", "player", "tested", "vintage", "portable", "wm-fx193"], 45.0),
+    ("pyrex butterprint mixing bowl", ["403", "turquoise", "2.5", "qt", "vintage", "bowl"], 28.0),
+    ("nike air max 90 infrared", ["mens", "size", "10", "ct1685-100", "sneakers", "white"], 110.0),
+    ("levis 501 jeans usa", ["vintage", "made", "in", "usa", "32x30", "selvedge"], 65.0),
+    ("le creuset dutch oven", ["5.5", "qt", "round", "enameled", "cast", "iron", "flame"], 180.0),
+    ("nintendo game boy color", ["cgb-001", "teal", "console", "tested", "working"], 70.0),
+    ("coach legacy shoulder bag", ["leather", "9966", "black", "vintage", "purse"], 95.0),
+    ("canon ae-1 program", ["35mm", "film", "camera", "50mm", "f1.8", "lens"], 160.0),
+]
+_FILLER = ["lot", "rare", "nice", "used", "new", "oem", "original", "authentic", "box", "read"]
+_CONDITIONS = ["Pre-Owned", "Brand New", "New (Other)", "Used", "For parts or not working"]
+
+
+def _jpeg(img: Any, quality: int = 85) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def _base_image(rng: random.Random, size: Tuple[int, int]) -> Any:
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", size, tuple(rng.randint(150, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    w, h = size
+    for _ in range(14):
+        x0, y0 = rng.randint(0, w - 1), rng.randint(0, h - 1)
+        x1, y1 = min(w, x0 + rng.randint(w // 10, w // 2)), min(h, y0 + rng.randint(h // 10, h // 2))
+        color = tuple(rng.randint(0, 255) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+    return img
+
+
+def _variant(img: Any, rng: random.Random, size: int) -> Any:
+    """A listing photo of the same item: off-centre crop, small rotation, colour shift."""
+    from PIL import ImageEnhance
+
+    w, h = img.size
+    frac = rng.uniform(0.7, 1.0)
+    cw, ch = int(w * frac), int(h * frac)
+    left, top = rng.randint(0, w - cw), rng.randint(0, h - ch)
+    out = img.crop((left, top, left + cw, top + ch)).rotate(rng.uniform(-8, 8), fillcolor=(255, 255, 255))
+    out = ImageEnhance.Brightness(out).enhance(rng.uniform(0.85, 1.15))
+    return out.resize((size, size))
+
+
+def generate(
+    out: Path,
+    *,
+    items: int = 6,
+    listings: int = 50,
+    requests_per_item: int = 2,
+    image_size: Tuple[int, int] = (1600, 1200),
+    thumb_size: int = 225,
+    seed: int = 7,
+) -> Path:
+    """
+    Writes a synthetic fixture set. Each item gets an upload image, an LLM query,
+    active and sold SERP pages (roughly 60% look-alike listings, the rest other
+    items) and a Lens page. Requests cycle through modes, with some itemName and
+    text requests mixed in.
+    """
+    rng = random.Random(seed)
+    for sub in ("images", "thumbs", "serp", "lens", "llm"):
+        (out / sub).mkdir(parents=True, exist_ok=True)
+
+    catalog = [_CATALOG[i % len(_CATALOG)] for i in range(items)]
+    bases = [_base_image(rng, image_size) for _ in catalog]
+    manifest: Dict[str, Any] = {"version": 1, "requests": [], "serp": {}, "llm": {}, "lens": {}}
+    modes = ["both", "both", "active", "sold"]
+
+    for idx, ((query, words, price), base) in enumerate(zip(catalog, bases)):
+        slug = f"{idx:02d}-{_slug(query, 24)}"
+        image_bytes = _jpeg(base, quality=90)
+        (out / "images" / f"{slug}.jpg").write_bytes(image_bytes)
+        image_sha = sha256_hex(image_bytes)
+
+        llm_rel = f"llm/{slug}.json"
+        extracted = {"query": query, "brand": query.split()[0], "confidence": round(rng.uniform(0.6, 0.95), 2)}
+        (out / llm_rel).write_text(
+            json.dumps({"output_text": json.dumps(extracted), "usage": {"input_tokens": 1400, "output_tokens": 60}}),
+            encoding="utf-8",
+        )
+        manifest["llm"][image_sha] = llm_rel
+
+        thumbs: List[Tuple[str, bool]] = []
+        for j in range(listings):
+            match = rng.random() < 0.6
+            others = [b for b in bases if b is not base]
+            source = base if match or not others else rng.choice(others)
+            name = f"{slug}-{j:03d}.jpg"
+            (out / "thumbs" / name).write_bytes(_jpeg(_variant(source, rng, thumb_size)))
+            thumbs.append((name, match))
+
+        for sold in (False, True):
+            results = []
+            for j, (name, match) in enumerate(thumbs):
+                title_words = query.split() + rng.sample(words, k=min(len(words), rng.randint(2, 4)))
+                if not match:
+                    title_words = rng.sample(title_words, k=max(2, len(title_words) // 2))
+                title_words += rng.sample(_FILLER, k=rng.randint(0, 2))
+                p = price * rng.lognormvariate(0, 0.35) * (0.85 if sold else 1.0)
+                if rng.random() < 0.04:
+                    p *= rng.choice([0.1, 8.0])  # outliers for the IQR filter
+                results.append(
+                    {
+                        "position": j + 1,
+                        "product_id": f"{idx}{int(sold)}{j:04d}{rng.randint(1000, 9999)}",
+                        "title": " ".join(title_words).title(),
+                        "link": f"https://www.ebay.com/itm/{rng.randint(10**11, 10**12)}",
+                        "thumbnail": f"{THUMBS_PLACEHOLDER}/{name}",
+                        "condition": rng.choice(_CONDITIONS),
+                        "price": {"raw": f"${p:,.2f}", "extracted": round(p, 2)},
+                        "shipping": rng.choice(["Free shipping", "+$5.99 shipping", "+$12.45 shipping"]),
+                    }
+                )
+            rel = f"serp/{slug}-{'sold' if sold else 'active'}.json"
+            (out / rel).write_text(json.dumps({"organic_results": results}), encoding="utf-8")
+            manifest["serp"][serp_key(query, sold)] = rel
+
+        lens_rel = f"lens/{slug}.json"
+        visual = [
+            {
+                "position": j + 1,
+                "title": f"{query.title()} {' '.join(rng.sample(words, k=2))}",
+                "link": f"https://example.com/listing/{idx}/{j}",
+                "source": rng.choice(["eBay", "Etsy", "Mercari", "Poshmark"]),
+                "thumbnail": f"{THUMBS_PLACEHOLDER}/{name}",
+            }
+            for j, (name, _match) in enumerate(thumbs[:40])
+        ]
+        (out / lens_rel).write_text(json.dumps({"visual_matches": visual}), encoding="utf-8")
+        manifest["lens"][image_sha] = lens_rel
+
+        for r in range(requests_per_item):
+            req: Dict[str, Any] = {
+                "id": f"{slug}-{r}",
+                "image": f"images/{slug}.jpg",
+                "mode": modes[(idx + r) % len(modes)],
+                "itemName": None,
+                "text": None,
+            }
+            if r % 3 == 1:
+                req["text"] = query.split()[0]
+            elif r % 3 == 2:
+                req["itemName"] = query
+            manifest["requests"].append(req)
+
+    manifest["serp"]["_default|active"] = manifest["serp"][serp_key(catalog[0][0], False)]
+    manifest["serp"]["_default|sold"] = manifest["serp"][serp_key(catalog[0][0], True)]
+    (out / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    print(f"[fixtures] generated {len(manifest['requests'])} requests, {items * listings} thumbnails in {out}")
+    return out
+
+
+# --- recording from the real services ---------------------------------------
+
+def _rewrite_thumbs(payload: Any, thumbs: Dict[str, str]) -> Any:
+    if isinstance(payload, dict):
+        return {k: (thumbs.get(v, v) if k == "thumbnail" and isinstance(v, str) else _rewrite_thumbs(v, thumbs)) for k, v in payload.items()}
+    if isinstance(payload, list):
+        return [_rewrite_thumbs(v, thumbs) for v in payload]
+    return payload
+
+
+async def _download_thumbs(http: Any, out: Path, payload: Any) -> Dict[str, str]:
+    import asyncio
+
+    urls: List[str] = []
+
+    def walk(node: Any) -> None:
+        if isinstance(node, dict):
+            v = node.get("thumbnail")
+            if isinstance(v, str) and v.startswith("http"):
+                urls.append(v)
+            for child in node.values():
+                walk(child)
+        elif isinstance(node, list):
+            for child in node:
+                walk(child)
+
+    walk(payload)
+    sem = asyncio.Semaphore(8)
+    mapping: Dict[str, str] = {}
+
+    async def one(url: str) -> None:
+        name = f"{hashlib.sha1(url.encode()).hexdigest()[:16]}.jpg"
+        path = out / "thumbs" / name
+        if not path.exists():
+            async with sem:
+                try:
+                    r = await http.get(url, timeout=10.0, follow_redirects=True)
+                    r.raise_for_status()
+                except Exception as e:
+                    print(f"[fixtures] thumbnail failed {url}: {e}")
+                    return
+            path.write_bytes(r.content)
+        mapping[url] = f"{THUMBS_PLACEHOLDER}/{name}"
+
+    await asyncio.gather(*(one(u) for u in dict.fromkeys(urls)))
+    return mapping
+
+
+async def record(images_dir: Path, out: Path, *, mode: str = "both", lens: bool = False) -> Path:
+    """
+    Builds a fixture set from real SerpAPI/OpenAI responses for every image in
+    `images_dir` (needs SERPAPI_API_KEY and OPENAI_API_KEY; `lens` also needs R2).
+    Records the LLM query and the SERP pages for it. Refined-query searches are
+    served from the closest recorded query; use the trace recorder for full runs.
+    """
+    import httpx
+    from openai import OpenAI
+
+    from helpers import extract_stream_service as ess
+    from helpers import image_processing, marketplace_client
+    from helpers.deadline import deadline_from_budget
+
+    for sub in ("images", "thumbs", "serp", "lens", "llm"):
+        (out / sub).mkdir(parents=True, exist_ok=True)
+    manifest_path = out / "manifest.json"
+    manifest: Dict[str, Any] = (
+        json.loads(manifest_path.read_text(encoding="utf-8"))
+        if manifest_path.exists()
+        else {"version": 1, "requests": [], "serp": {}, "llm": {}, "lens": {}}
+    )
+    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"))
+
+    async with httpx.AsyncClient(timeout=marketplace_client.serp_timeout()) as http:
+        for path in paths:
+            raw = path.read_bytes()
+            ctype = "image/png" if path.suffix.lower() == ".png" else "image/webp" if path.suffix.lower() == ".webp" else "image/jpeg"
+            image_bytes, ctype = image_processing._normalize_image_bytes(raw, ctype)
+            slug = _slug(path.stem)
+            rel_image = f"images/{slug}{path.suffix.lower()}"
+            (out / rel_image).write_bytes(image_bytes)
+            image_sha = sha256_hex(image_bytes)
+
+            query, _used_llm, extracted = await ess.get_initial_query(
+                openai_client=openai_client,
+                itemName=None,
+                text=None,
+                main_bytes=image_bytes,
+                extra_bytes=[],
+                main_content_type=ctype,
+                extra_content_types=[],
+                deadline=deadline_from_budget(60.0),
+            )
+            (out / f"llm/{slug}.json").write_text(json.dumps({"output_text": json.dumps(extracted)}), encoding="utf-8")
+            manifest["llm"][image_sha] = f"llm/{slug}.json"
+
+            for sold in (False, True):
+                payload = await marketplace_client.serp_search(http, q=query, sold=sold)
+                payload = _rewrite_thumbs(payload, await _download_thumbs(http, out, payload))
+                rel = f"serp/{slug}-{'sold' if sold else 'active'}.json"
+                (out / rel).write_text(json.dumps(payload), encoding="utf-8")
+                manifest["serp"][serp_key(query, sold)] = rel
+
+            if lens:
+                from starlette.datastructures import Headers, UploadFile
+
+                from helpers.r2_storage import upload_uploadfile_and_get_url
+
+                upload = UploadFile(io.BytesIO(image_bytes), filename=path.name, headers=Headers({"content-type": ctype}))
+                url = await upload_uploadfile_and_get_url(upload, prefix="tmp")
+                payload = await marketplace_client.serp_lens_search(http, image_url=url)
+                payload = _rewrite_thumbs(payload, await _download_thumbs(http, out, payload))
+                (out / f"lens/{slug}.json").write_text(json.dumps(payload), encoding="utf-8")
+                manifest["lens"][image_sha] = f"lens/{slug}.json"
+
+            manifest["requests"].append({"id": slug, "image": rel_image, "mode": mode, "itemName": None, "text": None})
+            print(f"[fixtures] recorded {path.name}: query={query!r}")
+
+    manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    gen = sub.add_parser("generate", help="write a synthetic fixture set")
+    gen.add_argument("--out", type=Path, default=DEFAULT_DIR)
+    gen.add_argument("--items", type=int, default=6)
+    gen.add_argument("--listings", type=int, default=50)
+    gen.add_argument("--requests-per-item", type=int, default=2)
+    gen.add_argument("--seed", type=int, default=7)
+
+    rec = sub.add_parser("record", help="record fixtures from the real services")
+    rec.add_argument("--images", type=Path, required=True)
+    rec.add_argument("--out", type=Path, required=True)
+    rec.add_argument("--mode", default="both", choices=("active", "sold", "both"))
+    rec.add_argument("--lens", action="store_true", help="also upload to R2 and record Google Lens")
+
+    args = parser.parse_args()
+    if args.cmd == "generate":
+        generate(args.out, items=args.items, listings=args.listings, requests_per_item=args.requests_per_item, seed=args.seed)
+    else:
+        import asyncio
+
+        asyncio.run(record(args.images, args.out, mode=args.mode, lens=args.lens))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Microbenchmarks for the CPU-bound pieces of the pipeline, on generated inputs
+of realistic size (50-500 listings, 512-d CLIP vectors, 12MP photos).
+
+Each case reports median/p95/min wall time per call and the peak Python heap
+allocation of one call (tracemalloc; numpy buffers are traced, PIL image
+buffers are not). Every run is written to bench/data/micro/ so runs can be
+compared; --compare diffs against a saved run (or `latest`).
+
+    python -m bench.micro
+    python -m bench.micro --filter rerank --sizes 50,500 --compare latest
+    python -m bench.micro --save-baseline && python -m bench.micro --baseline
+
+Run from apps/api. The CLIP crop/preprocess cases need torch and open_clip and
+are skipped without them.
+"""
+import argparse
+import gc
+import io
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from bench import report
+
+RESULTS_DIR = Path(__file__).resolve().parent / "data" / "micro"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "data" / "micro_baseline.json"
+EMBED_DIM = 512
+PHOTO_SIZE = (4000, 3000)  # 12MP
+DEFAULT_SIZES = (50, 200, 500)
+
+
+@dataclass
+class Case:
+    """`prepare` builds fresh arguments for one call (untimed); `run` is the timed call."""
+
+    name: str
+    prepare: Callable[[], Any]
+    run: Callable[[Any], Any]
+    params: Dict[str, Any] = field(default_factory=dict)
+
+
+# --- generated inputs ---------------------------------------------------------
+
+_WORDS = [
+    "sony", "walkman", "cassette", "player", "wm-fx193", "vintage", "tested", "pyrex", "403", "bowl",
+    "nike", "air", "max", "ct1685-100", "levis", "501", "usa", "32x30", "canon", "ae-1", "35mm",
+    "lens", "f1.8", "coach", "9966", "leather", "rare", "lot", "new", "sealed", "free", "shipping",
+]
+_CONDITIONS = ["Pre-Owned", "Brand New", "New (Other)", "Used", "For parts or not working", None]
+
+
+def _unit(np_rng: Any, n: int) -> List[List[float]]:
+    import numpy as np
+
+    vecs = np_rng.standard_normal((n, EMBED_DIM)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs.tolist()
+
+
+def make_listings(n: int, *, seed: int = 0, embeddings: bool = True) -> List[Dict[str, Any]]:
+    """SerpAPI-shaped listings; ~10% lack an embedding and ~5% carry only a raw price string."""
+    import numpy as np
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    vecs = _unit(np_rng, n) if embeddings else []
+    items = []
+    for i in range(n):
+        price = round(40 * rng.lognormvariate(0, 0.4) * (rng.choice([0.1, 8.0]) if rng.random() < 0.04 else 1.0), 2)
+        it: Dict[str, Any] = {
+            "product_id": f"{seed}{i:05d}",
+            "title": " ".join(rng.choice(_WORDS) for _ in range(rng.randint(5, 12))).title(),
+            "link": f"https://www.ebay.com/itm/{rng.randint(10**11, 10**12)}",
+            "thumbnail": f"https://i.ebayimg.com/images/g/{i:06d}/s-l225.jpg",
+            "condition": rng.choice(_CONDITIONS),
+            "price": {"raw": f"${price:,.2f}"} if rng.random() < 0.05 else {"raw": f"${price:,.2f}", "extracted": price},
+            "shipping": rng.choice(["Free shipping", "+$5.99 shipping"]),
+            "location": rng.choice(["United States", "Japan", None]),
+        }
+        if embeddings and rng.random() >= 0.1:
+            it["_thumb_embedding"] = [vecs[i]]
+        items.append(it)
+    return items
+
+
+def make_photo(*, seed: int = 0, fmt: str = "JPEG") -> bytes:
+    from PIL import Image, ImageFilter
+
+    from bench.fixtures import _base_image
+
+    img = _base_image(random.Random(seed), PHOTO_SIZE)
+    # Sensor-like noise keeps the encoded size and decode cost close to a phone photo.
+    noise = Image.effect_noise(PHOTO_SIZE, 24).convert("RGB")
+    img = Image.blend(img, noise, 0.15).filter(ImageFilter.SMOOTH)
+    out = io.BytesIO()
+    if fmt == "PNG":
+        img.putalpha(255)
+        img.save(out, format="PNG", compress_level=1)
+    else:
+        img.save(out, format=fmt, quality=90)
+    return out.getvalue()
+
+
+# --- cases --------------------------------------------------------------------
+
+def build_cases(sizes: List[int], *, seed: int) -> List[Case]:
+    import numpy as np
+
+    from helpers import image_processing, image_ranking, output_builder, query_refining, serialization
+
+    cases: List[Case] = []
+    main_vecs = _unit(np.random.default_rng(seed + 1), 2)  # MAIN_CROPS: full + 0.85
+
+    for n in sizes:
+        listings = make_listings(n, seed=seed)
+
+        def fresh(listings: List[Dict[str, Any]] = listings) -> List[Dict[str, Any]]:
+            # Shallow item copies in the original (unsorted) order; rerank sorts and annotates in place.
+            return [dict(it) for it in listings]
+
+        cases.append(
+            Case(
+                f"rerank_items_by_image_similarity[n={n}]",
+                fresh,
+                lambda items: image_ranking.rerank_items_by_image_similarity(items, main_vecs, threshold=0.68, keep_top_k=25),
+                {"n": n, "dim": EMBED_DIM, "main_crops": 2},
+            )
+        )
+        priced = make_listings(n, seed=seed, embeddings=False)
+        cases.append(
+            Case(f"filter_outliers_iqr[n={n}]", lambda priced=priced: priced, output_builder.filter_outliers_iqr, {"n": n})
+        )
+        cases.append(
+            Case(
+                f"compute_segmented_summaries[n={n}]",
+                lambda priced=priced: priced,
+                output_builder.compute_segmented_summaries,
+                {"n": n},
+            )
+        )
+        payload = {
+            "mode": "both",
+            "active_listings": [output_builder.slim_item({**it, "_image_similarity": 0.7}) for it in priced],
+            "sold_listings": [output_builder.slim_item({**it, "_image_similarity": 0.7}) for it in priced],
+            "market_analysis": output_builder.compute_segmented_summaries(priced),
+            "tags": ("a", "b"),
+        }
+        cases.append(Case(f"json_sanitize[n={n}]", lambda payload=payload: payload, output_builder.json_sanitize, {"n": n}))
+        result_event = {"type": "result", "data": payload}
+        cases.append(
+            Case(
+                f"ndjson_line[n={n}]",
+                lambda result_event=result_event: result_event,
+                serialization.ndjson_line,
+                {"n": n, "encoder": "orjson" if serialization.orjson is not None else "json"},
+            )
+        )
+        titles = [it["title"] for it in priced]
+        cases.append(
+            Case(
+                f"extract_strong_tokens[titles={n}]",
+                lambda titles=titles: titles,
+                lambda titles: [query_refining.extract_strong_tokens(t) for t in titles],
+                {"n": n},
+            )
+        )
+
+    jpeg = make_photo(seed=seed)
+    png = make_photo(seed=seed, fmt="PNG")
+    cases += [
+        Case(
+            "normalize_image_bytes[jpeg_12mp,passthrough]",
+            lambda: (jpeg, "image/jpeg"),
+            lambda a: image_processing._normalize_image_bytes(*a),
+            {"bytes": len(jpeg)},
+        ),
+        Case(
+            "normalize_image_bytes[jpeg_12mp,reencode]",
+            lambda: (jpeg, None),
+            lambda a: image_processing._normalize_image_bytes(*a),
+            {"bytes": len(jpeg)},
+        ),
+        Case(
+            "normalize_image_bytes[png_rgba_12mp,convert]",
+            lambda: (png, "image/heic"),
+            lambda a: image_processing._normalize_image_bytes(*a),
+            {"bytes": len(png)},
+        ),
+    ]
+    cases += _clip_cases(jpeg, image_processing)
+    return cases
+
+
+def _clip_cases(jpeg: bytes, image_processing: Any) -> List[Case]:
+    try:
+        clip_service = image_processing.load_clip_service_module()
+        from open_clip.transform import image_transform
+    except Exception as e:
+        print(f"[bench] skipping clip_service cases: {type(e).__name__}: {e}")
+        return []
+    from PIL import Image
+
+    # Same eval transform as the ViT-B-32 model load, without downloading weights.
+    preprocess = image_transform(224, is_train=False)
+    crops = clip_service.MAIN_CROPS
+
+    def decode() -> Any:
+        with Image.open(io.BytesIO(jpeg)) as im:
+            return im.convert("RGB")
+
+    return [
+        Case("clip_decode[jpeg_12mp]", lambda: jpeg, lambda b: Image.open(io.BytesIO(b)).convert("RGB"), {"bytes": len(jpeg)}),
+        Case(
+            "clip_crop_preprocess[12mp,crops=2]",
+            decode,
+            lambda img: [preprocess(clip_service._crop_image(img, frac)) for frac in crops],
+            {"crops": list(crops)},
+        ),
+    ]
+
+
+# --- measurement --------------------------------------------------------------
+
+def measure(case: Case, *, min_repeats: int, max_repeats: int, budget_sec: float) -> Dict[str, Any]:
+    for _ in range(2):
+        case.run(case.prepare())
+
+    times: List[float] = []
+    spent = 0.0
+    gc.collect()
+    while len(times) < max_repeats and (len(times) < min_repeats or spent < budget_sec):
+        args = case.prepare()
+        start = time.perf_counter()
+        case.run(args)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        spent += elapsed
+
+    # Allocation pass runs separately: tracing slows the call down several times.
+    args = case.prepare()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = case.run(args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    us = [t * 1e6 for t in times]
+    return {
+        "params": case.params,
+        "repeats": len(times),
+        "time_min_us": min(us),
+        "metrics": {
+            "time_median_us": statistics.median(us),
+            "time_p95_us": report.percentile(us, 0.95),
+            "alloc_peak_kb": (peak - base) / 1024,
+            "alloc_retained_kb": max(0, current - base) / 1024,
+        },
+    }
+
+
+def print_result(name: str, r: Dict[str, Any]) -> None:
+    m = r["metrics"]
+    print(
+        f"{name:<48} {m['time_median_us']:>12.1f} {m['time_p95_us']:>12.1f} {r['time_min_us']:>12.1f}"
+        f" {m['alloc_peak_kb']:>12.1f} {r['repeats']:>6}"
+    )
+
+
+def _latest_result(exclude: Optional[Path] = None) -> Optional[Path]:
+    runs = sorted(p for p in RESULTS_DIR.glob("*.json") if p != exclude)
+    return runs[-1] if runs else None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="listing counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-repeats", type=int, default=5)
+    parser.add_argument("--max-repeats", type=int, default=200)
+    parser.add_argument("--budget-sec", type=float, default=1.0, help="timing budget per case")
+    parser.add_argument("--out", type=Path, help="result file (default: bench/data/micro/<timestamp>.json)")
+    parser.add_argument("--compare", help="result file to compare against, or `latest`")
+    parser.add_argument("--save-baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=report.DEFAULT_THRESHOLD)
+    parser.add_argument("--verbose-compare", action="store_true")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    print("[bench] generating inputs")
+    cases = [c for c in build_cases(sizes, seed=args.seed) if args.filter in c.name]
+
+    print(f"\n{'case':<48} {'median us':>12} {'p95 us':>12} {'min us':>12} {'peak KiB':>12} {'runs':>6}")
+    scenarios: Dict[str, Any] = {}
+    for case in cases:
+        scenarios[case.name] = measure(
+            case, min_repeats=args.min_repeats, max_repeats=args.max_repeats, budget_sec=args.budget_sec
+        )
+        print_result(case.name, scenarios[case.name])
+
+    results = {"meta": report.run_meta(bench="micro", seed=args.seed, sizes=sizes), "scenarios": scenarios}
+    out = args.out or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    previous = _latest_result(exclude=out) if args.compare == "latest" else Path(args.compare) if args.compare else None
+    report.save(out, results)
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+
+    regressions = 0
+    for against in (previous, args.baseline):
+        if against is None:
+            continue
+        if not Path(against).exists():
+            print(f"[bench] nothing to compare against at {against}")
+            continue
+        print(f"\n[bench] compared with {against}")
+        rows = report.compare(report.load(Path(against)), results, threshold=args.threshold)
+        regressions += report.print_comparison(rows, verbose=args.verbose_compare)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Per-worker memory with and without preloading: launches serve.py with N workers
+in each mode, waits until the workers report ready, and reads every worker's
+/proc/<pid>/smaps_rollup.
+
+    rss_mb       resident pages, counting pages shared with the master in full
+    pss_mb       proportional share: shared pages split across the processes mapping them
+    private_mb   pages only this worker has (what each extra worker really costs)
+
+    python -m bench.preload_rss --workers 4
+    python -m bench.preload_rss --workers 4 --required ""   # without torch/weights
+
+Run from apps/api (Linux only).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from bench import report
+from bench.cold_start import _free_port, _get_ready
+from helpers.memory import smaps_rollup
+
+MB = 1024 * 1024
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        return [int(p) for p in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def _tree_rollup(pid: int) -> Dict[str, int]:
+    # A worker's own children (e.g. uvicorn reloader helpers) are counted with it.
+    total: Dict[str, int] = {}
+    for p in [pid, *_children(pid)]:
+        for k, v in smaps_rollup(p).items():
+            total[k] = total.get(k, 0) + v
+    return total
+
+
+def measure_mode(*, preload: bool, workers: int, required: str, timeout_sec: float, settle_sec: float) -> Dict[str, Any]:
+    port = _free_port()
+    cmd = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    cmd.append("--preload" if preload else "--no-preload")
+    env = {**os.environ, "READY_REQUIRED": required, "JOB_WORKERS": "0", "PYTHONUNBUFFERED": "1"}
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    started = time.perf_counter()
+    try:
+        # The shared socket hands /ready to whichever worker accepts; several 200s in a row
+        # make it likely every worker is up, and the settle time covers the rest.
+        streak = 0
+        while streak < 3 * workers:
+            if time.perf_counter() - started > timeout_sec or proc.poll() is not None:
+                raise RuntimeError(f"{'preload' if preload else 'no-preload'}: workers not ready")
+            r = _get_ready(f"http://127.0.0.1:{port}/ready")
+            streak = streak + 1 if r and r["status"] == 200 else 0
+            time.sleep(0.05)
+        ready_ms = (time.perf_counter() - started) * 1000
+        time.sleep(settle_sec)
+        pids = _children(proc.pid)
+        master = smaps_rollup(proc.pid)
+        per_worker = [_tree_rollup(p) for p in pids]
+    finally:
+        proc.terminate()
+        try:
+            proc.communicate(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    def mb(key: str) -> List[float]:
+        return [w.get(key, 0) / MB for w in per_worker]
+
+    private = [w.get("Private_Clean", 0) / MB + w.get("Private_Dirty", 0) / MB for w in per_worker]
+    pss = mb("Pss")
+    return {
+        "workers": len(per_worker),
+        "metrics": {
+            "ready_ms": ready_ms,
+            "worker_rss_mb": statistics.mean(mb("Rss")),
+            "worker_pss_mb": statistics.mean(pss),
+            "worker_private_mb": statistics.mean(private),
+            "master_rss_mb": master.get("Rss", 0) / MB,
+            "total_pss_mb": sum(pss) + master.get("Pss", 0) / MB,
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--required", default="clip", help="READY_REQUIRED for the workers")
+    parser.add_argument("--timeout-sec", type=float, default=300.0)
+    parser.add_argument("--settle-sec", type=float, default=3.0)
+    parser.add_argument("--out", type=Path)
+    args = parser.parse_args()
+
+    scenarios = {}
+    for preload in (False, True):
+        name = "preload" if preload else "no_preload"
+        scenarios[name] = measure_mode(
+            preload=preload,
+            workers=args.workers,
+            required=args.required,
+            timeout_sec=args.timeout_sec,
+            settle_sec=args.settle_sec,
+        )
+        m = scenarios[name]["metrics"]
+        print(
+            f"[bench] {name:<10} workers={scenarios[name]['workers']} ready {m['ready_ms']:.0f} ms  per worker: "
+            f"rss {m['worker_rss_mb']:.0f} MB  pss {m['worker_pss_mb']:.0f} MB  private {m['worker_private_mb']:.0f} MB  "
+            f"(master rss {m['master_rss_mb']:.0f} MB, total pss {m['total_pss_mb']:.0f} MB)"
+        )
+
+    base, pre = scenarios["no_preload"]["metrics"], scenarios["preload"]["metrics"]
+    saved = base["worker_private_mb"] - pre["worker_private_mb"]
+    print(
+        f"[bench] preload saves {saved:.0f} MB private memory per worker "
+        f"({base['total_pss_mb'] - pre['total_pss_mb']:.0f} MB total PSS at {args.workers} workers)"
+    )
+    if args.out:
+        report.save(args.out, {"meta": report.run_meta(bench="preload_rss", workers=args.workers), "scenarios": scenarios})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
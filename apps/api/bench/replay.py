@@ -0,0 +1,375 @@
+"""
+Replays recorded production traces (helpers/trace_recorder.py) against the local
+stand-ins, so changes are measured on the real mix of modes, items and fallbacks.
+
+Requests are issued open-loop at their recorded arrival times divided by
+--speedup (long idle gaps are capped by --max-gap-sec). External calls are
+answered from the traces' stored responses with their recorded latencies
+(--latency synthetic uses the e2e defaults instead). Reports the same
+per-stage/throughput/memory metrics as bench.e2e, side by side with the
+production timings in the traces, and supports the same baselines.
+
+    python -m bench.replay --traces traces --speedup 20 --clip fake
+    python -m bench.replay --traces traces --speedup 20 --clip fake --baseline bench/data/replay_baseline.json
+
+Run from apps/api.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from bench import e2e, report
+from bench.fixtures import EMPTY_SERP, closest_serp_key, serp_key, serp_token_index
+from bench.stand_ins import StandInServer, parse_latency
+
+# Only reads and parses trace files; safe to import before configure_env.
+from helpers import trace_recorder
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "data" / "replay_baseline.json"
+SERVICE_ROUTES = {"serpapi": "serp", "serpapi_lens": "lens", "thumbnail_cdn": "thumbs", "openai": "llm", "r2": "r2"}
+_RESOLVE_KEYS = ("thumbnail", "image")
+
+
+def thumb_name(url: str) -> str:
+    return base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+
+
+def thumb_url(name: str) -> Optional[str]:
+    try:
+        return base64.urlsafe_b64decode(name + "=" * (-len(name) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class TraceSet:
+    """
+    Stand-in source built from a trace directory. Responses are indexed by what
+    the stand-in can see on the wire: SERP by normalized query, thumbnails by
+    URL, OpenAI and Lens by the sha256 of the request's main image.
+    """
+
+    def __init__(self, root: Path, *, flows: List[str], include_cached: bool = False, limit: Optional[int] = None, seed: int = 0):
+        self.root = Path(root)
+        self.records = [r for r in trace_recorder.read_traces(self.root) if r.get("flow") in flows]
+        self.records.sort(key=lambda r: r["ts"])
+        self.skipped: Counter = Counter()
+        self.misses: Counter = Counter()
+        self._blobs: Dict[str, bytes] = {}
+        self._serp: Dict[str, str] = {}
+        self._thumbs: Dict[str, str] = {}
+        self._llm: Dict[str, List[Dict[str, Any]]] = {}
+        self._llm_next: Counter = Counter()
+        self._lens: Dict[str, str] = {}
+        self._latency: Dict[str, Dict[Optional[str], List[float]]] = {}
+        self._resolved: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.requests: List[Dict[str, Any]] = []
+
+        for rec in self.records:
+            self._index(rec)
+            req = self._request(rec, include_cached=include_cached)
+            if req is not None:
+                self.requests.append(req)
+        if limit:
+            self.requests = self.requests[:limit]
+        self._serp_tokens = serp_token_index(self._serp)
+
+    def _index(self, rec: Dict[str, Any]) -> None:
+        images = rec.get("in", {}).get("img") or []
+        main_sha = images[0] if images else None
+        for call in trace_recorder.call_rows(rec):
+            route = SERVICE_ROUTES.get(call["service"])
+            if route is None or call.get("cache") in ("hit", "shared"):
+                continue
+            key = call.get("key")
+            blob = call.get("blob")
+            # Lens calls carry their view's image hash; older traces only have the main image.
+            if route in ("llm", "r2") or (route == "lens" and not key):
+                key = main_sha
+            if call.get("latency_ms") is not None:
+                per_route = self._latency.setdefault(route, {})
+                per_route.setdefault(key, []).append(call["latency_ms"] / 1000.0)
+                per_route.setdefault(None, []).append(call["latency_ms"] / 1000.0)
+            if not blob:
+                continue
+            if route == "serp":
+                self._serp[key] = blob
+            elif route == "thumbs":
+                self._thumbs[key] = blob
+            elif route == "lens":
+                self._lens[key] = blob
+            elif route == "llm" and rec["flow"] == "extract":
+                self._llm.setdefault(key, []).append(
+                    {"blob": blob, "usage": {"input_tokens": call.get("tokens_in") or 0, "output_tokens": call.get("tokens_out") or 0}}
+                )
+
+    def _request(self, rec: Dict[str, Any], *, include_cached: bool) -> Optional[Dict[str, Any]]:
+        if rec.get("outcome") == "cached" and not include_cached:
+            self.skipped["cached"] += 1
+            return None
+        inputs = rec.get("in", {})
+        images = []
+        for sha in inputs.get("img") or []:
+            data = trace_recorder.read_image(self.root, sha)
+            if data is None:
+                self.skipped["image_missing"] += 1
+                return None
+            images.append(data)
+        if not images:
+            self.skipped["no_images"] += 1
+            return None
+        return {
+            "id": rec["id"],
+            "ts": rec["ts"],
+            "flow": rec["flow"],
+            "mode": inputs.get("mode") or "both",
+            "text": inputs.get("text"),
+            "itemName": inputs.get("item"),
+            "budget_sec": inputs.get("budget"),
+            "images": images,
+            "recorded": rec,
+        }
+
+    def _blob(self, sha: str) -> Optional[bytes]:
+        data = self._blobs.get(sha)
+        if data is None:
+            data = trace_recorder.read_blob(self.root, sha)
+            if data is not None:
+                self._blobs[sha] = data
+        return data
+
+    # --- stand-in source interface ---
+
+    def recorded_latency(self, route: str, key: Optional[str]) -> Optional[float]:
+        per_route = self._latency.get(route)
+        if not per_route:
+            return None
+        if route == "thumbs" and key:
+            key = thumb_url(key)
+        samples = per_route.get(key) or per_route.get(None)
+        with self._lock:
+            return self._rng.choice(samples)
+
+    def serp(self, q: str, sold: bool) -> bytes:
+        key = serp_key(q, sold)
+        sha = self._serp.get(key)
+        if sha is None:
+            best = closest_serp_key(self._serp_tokens, q, sold)
+            sha = self._serp.get(best) if best else None
+            self.misses["serp_closest" if sha else "serp"] += 1
+        data = self._blob(sha) if sha else None
+        return data if data is not None else EMPTY_SERP
+
+    def thumb(self, name: str) -> Optional[bytes]:
+        url = thumb_url(name)
+        sha = self._thumbs.get(url) if url else None
+        data = self._blob(sha) if sha else None
+        if data is None:
+            self.misses["thumbs"] += 1
+        return data
+
+    def llm(self, image_sha: Optional[str]) -> Dict[str, Any]:
+        outputs = self._llm.get(image_sha or "")
+        if not outputs:
+            self.misses["llm"] += 1
+            return {"output_text": json.dumps({"query": "item"})}
+        with self._lock:
+            i = self._llm_next[image_sha] % len(outputs)
+            self._llm_next[image_sha] += 1
+        data = self._blob(outputs[i]["blob"]) or b"{}"
+        return {"output_text": data.decode("utf-8"), "usage": outputs[i]["usage"]}
+
+    def lens(self, image_sha: Optional[str]) -> bytes:
+        sha = self._lens.get(image_sha or "")
+        data = self._blob(sha) if sha else None
+        if data is None:
+            self.misses["lens"] += 1
+            return b"{}"
+        return data
+
+    def resolve(self, body: bytes, base_url: str) -> bytes:
+        """Points recorded thumbnail URLs at the stand-in."""
+        cached = self._resolved.get(id(body))
+        if cached is not None:
+            return cached
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return body
+
+        def walk(node: Any) -> Any:
+            if isinstance(node, dict):
+                return {
+                    k: (f"{base_url}/thumbs/{thumb_name(v)}" if k in _RESOLVE_KEYS and isinstance(v, str) and v.startswith("http") else walk(v))
+                    for k, v in node.items()
+                }
+            if isinstance(node, list):
+                return [walk(v) for v in node]
+            return node
+
+        out = json.dumps(walk(payload)).encode()
+        self._resolved[id(body)] = out
+        return out
+
+
+def _schedule(requests: List[Dict[str, Any]], *, speedup: float, max_gap_sec: float) -> List[float]:
+    offsets: List[float] = []
+    at = 0.0
+    prev = requests[0]["ts"] if requests else 0.0
+    for req in requests:
+        at += min((req["ts"] - prev) / speedup, max_gap_sec)
+        prev = req["ts"]
+        offsets.append(at)
+    return offsets
+
+
+async def replay(ctx: Dict[str, Any], traces: TraceSet, args: argparse.Namespace) -> Dict[str, Any]:
+    offsets = _schedule(traces.requests, speedup=args.speedup, max_gap_sec=args.max_gap_sec)
+    samples: List[Dict[str, Any]] = []
+
+    async def one(req: Dict[str, Any]) -> None:
+        runner = e2e.run_extract if req["flow"] == "extract" else e2e.run_lens
+        if not args.warm_caches:
+            ctx["image_processing"]._THUMB_EMBED_CACHE.clear()
+        try:
+            sample = await runner(ctx, req, req["images"])
+        except Exception as e:
+            sample = {"ok": False, "error": repr(e), "latency_sec": 0.0}
+        samples.append({**sample, "flow": req["flow"], "mode": req["mode"], "recorded": req["recorded"]})
+
+    tasks = []
+    with e2e.RssSampler(ctx["read_rss"]) as rss:
+        started = time.perf_counter()
+        for req, offset in zip(traces.requests, offsets):
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(req)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+
+    scenarios: Dict[str, Any] = {}
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for s in samples:
+        groups.setdefault(f"replay.{s['flow']}", []).append(s)
+        if s["flow"] == "extract":
+            groups.setdefault(f"replay.extract.{s['mode']}", []).append(s)
+    for name, group in sorted(groups.items()):
+        scenario = e2e.summarize_samples(group, wall=wall, rss=rss)
+        scenario["recorded"] = _recorded_summary([s["recorded"] for s in group])
+        scenarios[name] = scenario
+    return scenarios
+
+
+def _recorded_summary(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    stages: Dict[str, List[float]] = {}
+    for rec in records:
+        for stage, sec in (rec.get("stages") or {}).items():
+            stages.setdefault(stage, []).append(sec * 1000)
+    return {
+        "latency_ms": report.summarize([rec["total_ms"] for rec in records if rec.get("total_ms") is not None]),
+        "stages_ms": {stage: report.summarize(vals) for stage, vals in stages.items()},
+        "outcomes": dict(Counter(rec.get("outcome") for rec in records)),
+    }
+
+
+def print_replay(name: str, s: Dict[str, Any]) -> None:
+    e2e.print_scenario(name, s)
+    rec = s["recorded"]
+    print(f"   recorded outcomes {rec['outcomes']}")
+    lat = rec["latency_ms"]
+    if lat.get("n"):
+        print(f"   recorded total p50 {lat['p50']:9.1f} ms   p95 {lat['p95']:9.1f} ms")
+    for stage, summary in rec["stages_ms"].items():
+        replayed = s["stages_ms"].get(stage, {})
+        print(
+            f"   recorded {stage:<12} p50 {summary['p50']:9.1f} ms   p95 {summary['p95']:9.1f} ms"
+            f"   (replayed p50 {replayed.get('p50') or 0:9.1f} ms)"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traces", type=Path, default=trace_recorder.TRACE_DIR)
+    parser.add_argument("--flows", default="extract,lens", help="comma list of extract,lens")
+    parser.add_argument("--speedup", type=float, default=10.0, help="divide recorded inter-arrival gaps by this")
+    parser.add_argument("--max-gap-sec", type=float, default=5.0, help="cap on any (sped-up) gap between arrivals")
+    parser.add_argument("--limit", type=int, help="replay at most this many traces")
+    parser.add_argument("--include-cached", action="store_true", help="also replay traces answered from the result cache")
+    parser.add_argument("--latency", choices=("recorded", "synthetic"), default="recorded")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply all injected latency (0 = none)")
+    parser.add_argument("--clip", choices=("real", "fake"), default="real")
+    parser.add_argument("--fake-clip-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm-caches", action="store_true")
+    parser.add_argument("--out", type=Path)
+    parser.add_argument("--save-baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--baseline", type=Path, nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=report.DEFAULT_THRESHOLD)
+    parser.add_argument("--verbose-compare", action="store_true")
+    args = parser.parse_args()
+    args.flows = [f.strip() for f in args.flows.split(",") if f.strip()]
+
+    traces = TraceSet(args.traces, flows=args.flows, include_cached=args.include_cached, limit=args.limit, seed=args.seed)
+    print(f"[bench] {len(traces.requests)} of {len(traces.records)} traces replayable; skipped {dict(traces.skipped)}")
+    if not traces.requests:
+        return 2
+    if args.latency == "synthetic":
+        traces.recorded_latency = lambda route, key: None  # type: ignore[method-assign]
+
+    server = StandInServer(traces, latency=parse_latency(None), latency_scale=args.latency_scale, seed=args.seed).start()
+    e2e.configure_env(server.base_url, warm_caches=args.warm_caches)
+    try:
+        ctx = e2e.load_pipeline(args, traces, server)
+        scenarios = asyncio.run(replay(ctx, traces, args))
+    finally:
+        server.stop()
+    for name, scenario in scenarios.items():
+        print_replay(name, scenario)
+    print(f"\n[bench] stand-in requests {dict(server.counts)}; trace misses {dict(traces.misses)}")
+
+    ids = "".join(r["id"] for r in traces.requests)
+    results = {
+        "meta": report.run_meta(
+            bench="replay",
+            clip=args.clip,
+            fake_clip_ms=args.fake_clip_ms,
+            latency=args.latency,
+            latency_scale=args.latency_scale,
+            speedup=args.speedup,
+            warm_caches=args.warm_caches,
+            traces=str(args.traces),
+            traces_digest=hashlib.sha256(ids.encode()).hexdigest()[:12],
+            trace_count=len(traces.requests),
+            stand_in_requests=dict(server.counts),
+            trace_misses=dict(traces.misses),
+        ),
+        "scenarios": scenarios,
+    }
+    if args.out:
+        report.save(args.out, results)
+    if args.save_baseline:
+        report.save(args.save_baseline, results)
+    if args.baseline:
+        baseline = report.load(args.baseline)
+        for key in ("traces_digest", "clip", "latency", "latency_scale", "speedup", "warm_caches"):
+            if baseline["meta"].get(key) != results["meta"][key]:
+                print(f"[bench] warning: baseline {key} differs ({baseline['meta'].get(key)} vs {results['meta'][key]})")
+        rows = report.compare(baseline, results, threshold=args.threshold)
+        if report.print_comparison(rows, verbose=args.verbose_compare):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
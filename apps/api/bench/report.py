@@ -0,0 +1,123 @@
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_THRESHOLD = 0.10
+# Differences below these floors are noise, whatever the relative change.
+ABS_FLOOR = {"_ms": 5.0, "_mb": 5.0, "_kb": 64.0, "_us": 2.0}
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    vals = sorted(values)
+    k = (len(vals) - 1) * p
+    lo = math.floor(k)
+    hi = math.ceil(k)
+    if lo == hi:
+        return vals[int(k)]
+    return vals[lo] + (vals[hi] - vals[lo]) * (k - lo)
+
+
+def summarize(values: Sequence[float]) -> Dict[str, Any]:
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "mean": sum(values) / len(values),
+        "max": max(values),
+    }
+
+
+def run_meta(**extra: Any) -> Dict[str, Any]:
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        rev = ""
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_rev": rev or None,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        **extra,
+    }
+
+
+def save(path: Path, results: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True), encoding="utf-8")
+    print(f"[bench] wrote {path}")
+
+
+def load(path: Path) -> Dict[str, Any]:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_rps") or metric.endswith("_per_sec")
+
+
+def _floor(metric: str) -> float:
+    for suffix, floor in ABS_FLOOR.items():
+        if metric.endswith(suffix):
+            return floor
+    return 0.0
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    *,
+    threshold: float = DEFAULT_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    Compares the flat `metrics` dict of every scenario present in both runs.
+    Latency, memory and allocation metrics regress when they grow by more than
+    `threshold`; throughput (`*_rps`, `*_per_sec`) regresses when it drops.
+    """
+    rows: List[Dict[str, Any]] = []
+    base_scenarios = baseline.get("scenarios", {})
+    for name, scenario in current.get("scenarios", {}).items():
+        base = base_scenarios.get(name)
+        if base is None:
+            continue
+        for metric, value in scenario.get("metrics", {}).items():
+            old = base.get("metrics", {}).get(metric)
+            if old is None or value is None:
+                continue
+            change = (value - old) / old if old else 0.0
+            worse = -change if _higher_is_better(metric) else change
+            status = "ok"
+            if abs(value - old) >= _floor(metric):
+                if worse > threshold:
+                    status = "regression"
+                elif worse < -threshold:
+                    status = "improved"
+            rows.append(
+                {"scenario": name, "metric": metric, "baseline": old, "current": value, "change": change, "status": status}
+            )
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]], *, verbose: bool = False) -> int:
+    regressions = [r for r in rows if r["status"] == "regression"]
+    improved = [r for r in rows if r["status"] == "improved"]
+    shown = rows if verbose else regressions + improved
+    if shown:
+        print(f"{'scenario':<28} {'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}  status")
+    for r in shown:
+        print(
+            f"{r['scenario']:<28} {r['metric']:<40} {r['baseline']:>12.3f} {r['current']:>12.3f} "
+            f"{r['change'] * 100:>7.1f}%  {r['status']}"
+        )
+    print(f"[bench] compared {len(rows)} metrics: {len(regressions)} regressed, {len(improved)} improved")
+    return len(regressions)
@@ -0,0 +1,264 @@
+"""
+Local stand-ins for SerpAPI, the thumbnail CDN, OpenAI and R2, served from a
+fixture set (bench/fixtures.py) or recorded traces (bench/replay.py) with injected
+latency. Everything runs on one threaded HTTP server so the pipeline's pooled
+clients, timeouts and retries behave as in production.
+
+    GET  /search.json?engine=ebay|google_lens   SerpAPI
+    GET  /thumbs/<name>                          thumbnail CDN
+    POST /v1/responses                           OpenAI Responses API
+    PUT  /<bucket>/<key>                         R2 (S3 path-style)
+    HEAD /<bucket>/<key>                         R2 existence check
+    GET  /r2pub/<key>                            R2 public URL of an uploaded image
+"""
+import base64
+import json
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from bench.fixtures import serp_key, sha256_hex
+
+R2_PUBLIC_PREFIX = "/r2pub"
+
+
+@dataclass
+class Latency:
+    """Injected delay per call: `base_ms` plus uniform jitter of +/- `jitter_ms`."""
+
+    base_ms: float = 0.0
+    jitter_ms: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        ms = self.base_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, ms) / 1000.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        base, _, jitter = spec.partition(":")
+        return cls(float(base), float(jitter or 0))
+
+
+# Rough production medians; override with --latency route=base:jitter.
+DEFAULT_LATENCY: Dict[str, Latency] = {
+    "serp": Latency(900, 300),
+    "lens": Latency(1800, 500),
+    "thumbs": Latency(45, 25),
+    "llm": Latency(1600, 500),
+    "r2": Latency(120, 60),
+}
+
+
+def parse_latency(specs: Optional[list]) -> Dict[str, Latency]:
+    out = dict(DEFAULT_LATENCY)
+    for spec in specs or []:
+        route, _, value = spec.partition("=")
+        if route not in out:
+            raise ValueError(f"unknown latency route {route!r}; expected one of {sorted(out)}")
+        out[route] = Latency.parse(value)
+    return out
+
+
+class StandInServer:
+    """
+    Serves responses from `source`, which provides serp(q, sold), thumb(name),
+    llm(image_sha), lens(image_sha) and resolve(body, base_url); see FixtureSet.
+    A source may also provide recorded_latency(route, key) -> seconds, used in
+    place of the configured latency when it returns a value.
+    `latency_scale` multiplies every injected delay (0 turns injection off).
+    Counts requests per route for the report.
+    """
+
+    def __init__(
+        self,
+        source: Any,
+        *,
+        latency: Optional[Dict[str, Latency]] = None,
+        latency_scale: float = 1.0,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.source = source
+        self.latency = latency or dict(DEFAULT_LATENCY)
+        self.latency_scale = latency_scale
+        self.counts: Counter = Counter()
+        self.uploads: Dict[str, str] = {}  # object key -> sha256 of the body
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stand-ins", daemon=True)
+        self._thread.start()
+        print(f"[bench] stand-ins listening on {self.base_url}")
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def delay(self, route: str, key: Optional[str] = None) -> None:
+        if self.latency_scale <= 0:
+            return
+        recorded = getattr(self.source, "recorded_latency", None)
+        seconds = recorded(route, key) if recorded is not None else None
+        if seconds is None:
+            lat = self.latency.get(route)
+            if lat is None:
+                return
+            with self._rng_lock:
+                seconds = lat.sample(self._rng)
+        time.sleep(seconds * self.latency_scale)
+
+    def resolve(self, body: bytes) -> bytes:
+        return self.source.resolve(body, self.base_url)
+
+    # --- routes; each returns (status, content type, body) ---
+
+    def search(self, params: Dict[str, str]) -> Tuple[int, str, bytes]:
+        if params.get("engine") == "google_lens":
+            self.counts["lens"] += 1
+            key = urlsplit(params.get("url", "")).path.split(f"{R2_PUBLIC_PREFIX}/", 1)[-1]
+            image_sha = self.uploads.get(key)
+            self.delay("lens", image_sha)
+            return 200, "application/json", self.resolve(self.source.lens(image_sha))
+        self.counts["serp"] += 1
+        sold = params.get("show_only") == "Sold"
+        q = params.get("_nkw", "")
+        self.delay("serp", serp_key(q, sold))
+        return 200, "application/json", self.resolve(self.source.serp(q, sold))
+
+    def thumb(self, name: str) -> Tuple[int, str, bytes]:
+        self.counts["thumbs"] += 1
+        self.delay("thumbs", name)
+        data = self.source.thumb(name)
+        if data is None:
+            return 404, "text/plain", b"not found"
+        return 200, "image/jpeg", data
+
+    def responses(self, body: Dict[str, Any]) -> Tuple[int, str, bytes]:
+        self.counts["llm"] += 1
+        image_sha = _first_image_sha(body.get("input"))
+        self.delay("llm", image_sha)
+        fixture = self.source.llm(image_sha)
+        usage = fixture.get("usage") or {}
+        tokens_in = int(usage.get("input_tokens", 0))
+        tokens_out = int(usage.get("output_tokens", 0))
+        out = {
+            "id": f"resp_{self.counts['llm']}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": body.get("model", ""),
+            "status": "completed",
+            "output": [
+                {
+                    "type": "message",
+                    "id": f"msg_{self.counts['llm']}",
+                    "role": "assistant",
+                    "status": "completed",
+                    "content": [{"type": "output_text", "text": fixture["output_text"], "annotations": []}],
+                }
+            ],
+            "usage": {"input_tokens": tokens_in, "output_tokens": tokens_out, "total_tokens": tokens_in + tokens_out},
+        }
+        return 200, "application/json", json.dumps(out).encode()
+
+    def put_object(self, path: str, data: bytes) -> Tuple[int, str, bytes]:
+        self.counts["r2"] += 1
+        self.delay("r2")
+        # Path-style: /<bucket>/<key>
+        key = path.lstrip("/").split("/", 1)[-1]
+        self.uploads[key] = sha256_hex(data)
+        return 200, "application/xml", b""
+
+    def head_object(self, path: str) -> Tuple[int, str, bytes]:
+        self.counts["r2_head"] += 1
+        self.delay("r2")
+        key = path.lstrip("/").split("/", 1)[-1]
+        return (200, "application/xml", b"") if key in self.uploads else (404, "application/xml", b"")
+
+    def public_object(self, key: str) -> Tuple[int, str, bytes]:
+        return (200, "text/plain", self.uploads[key].encode()) if key in self.uploads else (404, "text/plain", b"")
+
+
+def _first_image_sha(payload: Any) -> Optional[str]:
+    """sha256 of the first `input_image` data URL in a Responses API input, if any."""
+    if not isinstance(payload, list):
+        return None
+    for message in payload:
+        for part in (message or {}).get("content") or []:
+            if part.get("type") == "input_image":
+                url = part.get("image_url") or ""
+                _, _, b64 = url.partition("base64,")
+                try:
+                    return sha256_hex(base64.b64decode(b64))
+                except ValueError:
+                    return None
+    return None
+
+
+def _handler_for(stand_in: StandInServer) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, content_type: str, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> bytes:
+            n = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(n) if n else b""
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path == "/search.json":
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                self._send(*stand_in.search(params))
+            elif url.path.startswith("/thumbs/"):
+                self._send(*stand_in.thumb(unquote(url.path[len("/thumbs/"):])))
+            elif url.path.startswith(f"{R2_PUBLIC_PREFIX}/"):
+                self._send(*stand_in.public_object(url.path[len(R2_PUBLIC_PREFIX) + 1:]))
+            else:
+                self._send(404, "text/plain", b"not found")
+
+        def do_POST(self) -> None:
+            body = self._body()
+            if urlsplit(self.path).path.endswith("/responses"):
+                self._send(*stand_in.responses(json.loads(body or b"{}")))
+            else:
+                self._send(404, "text/plain", b"not found")
+
+        def do_HEAD(self) -> None:
+            status, ctype, _ = stand_in.head_object(urlsplit(self.path).path)
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_PUT(self) -> None:
+            data = self._body()
+            status, ctype, body = stand_in.put_object(urlsplit(self.path).path, data)
+            self._send(status, ctype, body, {"ETag": f'"{sha256_hex(data)[:32]}"'})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
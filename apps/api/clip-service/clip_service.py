@@ -1,3 +1,5 @@
+import os
+import threading
 from io import BytesIO
 from typing import List, Optional
 
@@ -52,11 +54,23 @@ def _crop_image(img: Image.Image, frac: float) -> Image.Image:
     return img.crop((left, top, left + crop_side, top + crop_side))
 
 
+def configure_threads(intra_op: int, inter_op: Optional[int] = None) -> None:
+    """Caps torch's CPU thread pools; with several worker processes per box they otherwise oversubscribe cores."""
+    torch.set_num_threads(max(1, intra_op))
+    try:
+        torch.set_num_interop_threads(max(1, inter_op or 1))
+    except RuntimeError:
+        pass  # Only settable before the first inter-op parallel call in this process.
+
+
 def load_clip():
     global _CLIP_MODEL, _CLIP_PREPROCESS
     if _CLIP_MODEL is not None:
         return _CLIP_MODEL, _CLIP_PREPROCESS
 
+    if os.getenv("TORCH_NUM_THREADS"):
+        configure_threads(int(os.environ["TORCH_NUM_THREADS"]))
+
     model_name = "ViT-B-32"
     pretrained = "laion2b_s34b_b79k"
     model, _, preprocess = open_clip.create_model_and_transforms(
@@ -64,6 +78,8 @@ def load_clip():
         pretrained=pretrained,
     )
     model.eval()
+    # Inference only: no grad buffers, and weights stay untouched after a fork (see serve.py).
+    model.requires_grad_(False)
     model.to(_CLIP_DEVICE)
     _CLIP_MODEL = model
     _CLIP_PREPROCESS = preprocess
@@ -71,7 +87,11 @@ def load_clip():
 
 
 def warm_model() -> None:
+    # Loading weights alone leaves the first request paying for lazy kernel/allocator setup.
     load_clip()
+    buf = BytesIO()
+    Image.new("RGB", (256, 256), (127, 127, 127)).save(buf, format="JPEG")
+    image_bytes_batch_to_embeddings([buf.getvalue()], MAIN_CROPS)
 
 
 def image_bytes_to_embeddings_multicrop(img_bytes: bytes, crops: List[float]) -> List[List[float]]:
@@ -94,6 +114,7 @@ def image_bytes_to_embeddings_multicrop(img_bytes: bytes, crops: List[float]) ->
 def image_bytes_batch_to_embeddings(
     images: List[bytes],
     crops: List[float],
+    cancel_event: Optional[threading.Event] = None,
 ) -> List[Optional[List[List[float]]]]:
     model, preprocess = load_clip()
     decoded: List[Optional[Image.Image]] = []
@@ -113,6 +134,9 @@ def image_bytes_batch_to_embeddings(
     autocast_ctx = torch.autocast(device_type="cuda", dtype=torch.float16) if _CLIP_DEVICE == "cuda" else nullcontext()
     with torch.no_grad(), autocast_ctx:
         for frac in crops:
+            # The request that queued this batch is gone; stop at the crop boundary.
+            if cancel_event is not None and cancel_event.is_set():
+                return [None for _ in images]
             batch_inputs = [preprocess(_crop_image(decoded[i], frac)) for i in valid_indices]
             image_batch = torch.stack(batch_inputs, dim=0).to(_CLIP_DEVICE)
             feats = model.encode_image(image_batch)
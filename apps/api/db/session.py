@@ -1,30 +1,40 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
 from dotenv import load_dotenv
 load_dotenv()
 
+from helpers import subsystems
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL is not set")
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-)
 
-SessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine,
-)
+def _make_sessionmaker():
+    # Built on first use (or by warmup) so a missing or unreachable DB only fails the routes that need it.
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is not set")
+    engine = create_engine(
+        DATABASE_URL,
+        pool_pre_ping=True,
+    )
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=engine,
+    )
+
+
+DB = subsystems.Subsystem("db", _make_sessionmaker)
+
 
 def get_db():
     """
     FastAPI dependency that provides a database session.
     """
-    db = SessionLocal()
+    db = DB.get()()
     try:
         yield db
     finally:
@@ -0,0 +1,20 @@
+import hmac
+import os
+
+from fastapi import HTTPException, Request
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+ADMIN_HEADER = "X-Admin-Token"
+
+
+def is_admin_request(request: Request | None) -> bool:
+    if request is None or not ADMIN_TOKEN:
+        return False
+    token = request.headers.get(ADMIN_HEADER, "")
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def require_admin(request: Request) -> None:
+    # 404 rather than 403 so the debug endpoints are not discoverable.
+    if not is_admin_request(request):
+        raise HTTPException(status_code=404, detail="Not Found")
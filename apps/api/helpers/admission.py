@@ -0,0 +1,174 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+EXTRACT_MAX_CONCURRENCY = int(os.getenv("EXTRACT_MAX_CONCURRENCY", "8"))
+EXTRACT_MAX_QUEUE = int(os.getenv("EXTRACT_MAX_QUEUE", "16"))
+LENS_MAX_CONCURRENCY = int(os.getenv("LENS_MAX_CONCURRENCY", "16"))
+LENS_MAX_QUEUE = int(os.getenv("LENS_MAX_QUEUE", "32"))
+QUEUE_UPDATE_SEC = 1.0
+
+
+class AdmissionTicket:
+    """One request's place in an AdmissionController: queued, then admitted, then released."""
+
+    def __init__(self, controller: "AdmissionController", future: asyncio.Future):
+        self.controller = controller
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = time.monotonic() if future.done() else None
+        self._released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.future.done() and not self.future.cancelled()
+
+    async def wait_events(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yields queue-position events until this ticket is admitted."""
+        if self.admitted:
+            return
+        while not self.future.done():
+            yield {
+                "type": "queue",
+                "status": "waiting",
+                "position": self.controller.position(self.future),
+                "active": self.controller.active,
+                "limit": self.controller.limit,
+            }
+            try:
+                await asyncio.wait_for(asyncio.shield(self.future), QUEUE_UPDATE_SEC)
+            except asyncio.TimeoutError:
+                pass
+        self.admitted_at = time.monotonic()
+        yield {
+            "type": "queue",
+            "status": "admitted",
+            "position": 0,
+            "waited_sec": round(self.admitted_at - self.enqueued_at, 3),
+        }
+
+    async def wait(self) -> None:
+        async for _ in self.wait_events():
+            pass
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self.admitted:
+            held = time.monotonic() - (self.admitted_at or self.enqueued_at)
+            self.controller._release(held)
+        else:
+            self.future.cancel()
+            self.controller._abandon(self.future)
+
+
+class AdmissionController:
+    """
+    Concurrency limit plus a bounded FIFO wait queue.
+    Requests beyond `limit` wait in line; once `max_queue` are already waiting,
+    new requests are rejected immediately with 429 and a Retry-After estimate.
+    """
+
+    def __init__(self, name: str, *, limit: int, max_queue: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._avg_hold_sec = 10.0
+        self.stats: Dict[str, float] = {
+            "admitted": 0,
+            "queued_total": 0,
+            "rejected": 0,
+            "abandoned": 0,
+        }
+
+    def position(self, future: asyncio.Future) -> int:
+        for i, f in enumerate(self._waiters):
+            if f is future:
+                return i + 1
+        return 0
+
+    def retry_after_sec(self) -> int:
+        # Time for the queue ahead to drain through `limit` slots.
+        waves = (len(self._waiters) + 1) / self.limit
+        return max(1, math.ceil(self._avg_hold_sec * waves))
+
+    def check(self) -> None:
+        """Raises 429 if a new request would find the wait queue full."""
+        if self.active < self.limit or len(self._waiters) < self.max_queue:
+            return
+        self.stats["rejected"] += 1
+        retry_after = self.retry_after_sec()
+        print(f"[admission] {self.name} rejected: active={self.active} queued={len(self._waiters)}")
+        raise HTTPException(
+            status_code=429,
+            detail={"error": "Server is busy, please retry", "retry_after_sec": retry_after},
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def enqueue(self) -> AdmissionTicket:
+        future = asyncio.get_running_loop().create_future()
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.stats["admitted"] += 1
+            future.set_result(True)
+            return AdmissionTicket(self, future)
+
+        self.check()
+        self.stats["queued_total"] += 1
+        self._waiters.append(future)
+        return AdmissionTicket(self, future)
+
+    def _release(self, held_sec: float) -> None:
+        self._avg_hold_sec = 0.8 * self._avg_hold_sec + 0.2 * held_sec
+        self.active -= 1
+        while self._waiters:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.active += 1
+            self.stats["admitted"] += 1
+            future.set_result(True)
+            break
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(future)
+            self.stats["abandoned"] += 1
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[AdmissionTicket]:
+        ticket = self.enqueue()
+        try:
+            await ticket.wait()
+            yield ticket
+        finally:
+            ticket.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "avg_hold_sec": round(self._avg_hold_sec, 3),
+            **self.stats,
+        }
+
+
+EXTRACT_ADMISSION = AdmissionController("extract", limit=EXTRACT_MAX_CONCURRENCY, max_queue=EXTRACT_MAX_QUEUE)
+LENS_ADMISSION = AdmissionController("lens", limit=LENS_MAX_CONCURRENCY, max_queue=LENS_MAX_QUEUE)
+
+
+def admission_stats() -> Dict[str, Dict[str, Any]]:
+    return {c.name: c.snapshot() for c in (EXTRACT_ADMISSION, LENS_ADMISSION)}
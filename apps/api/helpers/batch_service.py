@@ -0,0 +1,241 @@
+import asyncio
+import json
+import math
+import os
+import time
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from openai import OpenAI
+from starlette.datastructures import FormData, UploadFile
+
+from helpers import image_processing, stream_compression
+from helpers.admission import EXTRACT_ADMISSION
+from helpers.cancellation import stream_until_disconnect
+from helpers.deadline import RequestDeadline, deadline_from_budget
+from helpers.extract_stream_service import (
+    _error_event,
+    _ndjson,
+    normalize_mode,
+    parse_result_view,
+    run_extract_events,
+    validate_image_uploads,
+)
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_ITEM_CONCURRENCY = int(os.getenv("BATCH_ITEM_CONCURRENCY", "4"))
+
+_ITEM_DONE = object()
+
+
+def _form_uploads(form: FormData, field: Any) -> List[UploadFile]:
+    if not isinstance(field, str) or not field:
+        return []
+    return [v for v in form.getlist(field) if isinstance(v, UploadFile)]
+
+
+def parse_batch_manifest(form: FormData, *, default_mode: str) -> List[Dict[str, Any]]:
+    """
+    `manifest` is a JSON list, one entry per item:
+      {"item_id": "a1", "main_image": "<form field>", "files": ["<form field>", ...],
+       "itemName": null, "text": null, "mode": null}
+    Image fields name multipart parts uploaded in the same request.
+    """
+    raw = form.get("manifest")
+    if not isinstance(raw, str) or not raw.strip():
+        raise HTTPException(status_code=400, detail="manifest form field is required")
+    try:
+        manifest = json.loads(raw)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="manifest must be valid JSON")
+    if not isinstance(manifest, list) or not manifest:
+        raise HTTPException(status_code=400, detail="manifest must be a non-empty list")
+    if len(manifest) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Max {BATCH_MAX_ITEMS} items per batch")
+
+    items: List[Dict[str, Any]] = []
+    seen: set[str] = set()
+    for i, entry in enumerate(manifest):
+        if not isinstance(entry, dict):
+            raise HTTPException(status_code=400, detail=f"manifest[{i}] must be an object")
+        item_id = str(entry.get("item_id") or f"item_{i}")
+        if item_id in seen:
+            raise HTTPException(status_code=400, detail=f"Duplicate item_id {item_id}")
+        seen.add(item_id)
+
+        mains = _form_uploads(form, entry.get("main_image"))
+        if len(mains) != 1:
+            raise HTTPException(status_code=400, detail=f"{item_id}: main_image must name exactly one uploaded file")
+        extras: List[UploadFile] = []
+        for field in entry.get("files") or []:
+            extras.extend(_form_uploads(form, field))
+        validate_image_uploads(mains[0], extras)
+
+        items.append(
+            {
+                "item_id": item_id,
+                "main_image": mains[0],
+                "files": extras,
+                "itemName": entry.get("itemName"),
+                "text": entry.get("text"),
+                "mode": normalize_mode(entry.get("mode") or default_mode),
+            }
+        )
+    return items
+
+
+async def _run_item(
+    item: Dict[str, Any],
+    *,
+    openai_client: OpenAI,
+    budget_sec: Optional[float],
+    sem: asyncio.Semaphore,
+    queue: asyncio.Queue,
+    item_deadlines: List[RequestDeadline],
+    stats: Dict[str, int],
+    view: Optional[Dict[str, Any]] = None,
+) -> None:
+    item_id = item["item_id"]
+    status = "error"
+    try:
+        # Each item holds an extract slot while it runs, so a batch shares capacity with interactive requests.
+        async with sem, AsyncExitStack() as stack:
+            try:
+                await stack.enter_async_context(EXTRACT_ADMISSION.slot())
+            except HTTPException as e:
+                # Extract queue is full (429): report it on the item instead of failing silently.
+                queue.put_nowait({"item_id": item_id, **_error_event(e)})
+                return
+            t0 = time.time()
+            deadline = deadline_from_budget(budget_sec)
+            item_deadlines.append(deadline)
+            queue.put_nowait({"type": "item_start", "item_id": item_id})
+            try:
+                main_bytes, extra_bytes, main_content_type, extra_content_types = await image_processing.read_images(
+                    item["main_image"], item["files"]
+                )
+            except Exception as e:
+                queue.put_nowait({"item_id": item_id, **_error_event(e)})
+                return
+
+            async for event in run_extract_events(
+                openai_client=openai_client,
+                main_bytes=main_bytes,
+                extra_bytes=extra_bytes,
+                main_content_type=main_content_type,
+                extra_content_types=extra_content_types,
+                itemName=item["itemName"],
+                text=item["text"],
+                mode=item["mode"],
+                deadline=deadline,
+                t0=t0,
+                view=view,
+            ):
+                if event.get("type") == "result":
+                    status = "done"
+                queue.put_nowait({"item_id": item_id, **event})
+    finally:
+        stats[status] = stats.get(status, 0) + 1
+        queue.put_nowait(_ITEM_DONE)
+
+
+async def build_extract_batch_stream_response(
+    *,
+    openai_client: OpenAI,
+    request: Request,
+) -> StreamingResponse:
+    t0 = time.time()
+    print("[batch] request start")
+    form = await request.form(max_files=BATCH_MAX_ITEMS * 8)
+    default_mode = normalize_mode(str(form.get("mode") or "active"))
+    raw_budget = form.get("budget_sec")
+    try:
+        budget_sec = float(raw_budget) if isinstance(raw_budget, str) and raw_budget.strip() else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="budget_sec must be a number")
+    # One listing projection for every item's result (see parse_result_view).
+    raw_limit = form.get("listing_limit")
+    try:
+        listing_limit = int(raw_limit) if isinstance(raw_limit, str) and raw_limit.strip() else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="listing_limit must be an integer")
+    raw_fields = form.get("fields")
+    raw_format = form.get("listing_format")
+    view = parse_result_view(
+        raw_fields if isinstance(raw_fields, str) else None,
+        listing_limit,
+        raw_format if isinstance(raw_format, str) else None,
+    )
+    items = parse_batch_manifest(form, default_mode=default_mode)
+    EXTRACT_ADMISSION.check()
+
+    concurrency = max(1, min(BATCH_ITEM_CONCURRENCY, len(items)))
+    per_item_budget = deadline_from_budget(budget_sec).budget_sec
+    # Only used for disconnect handling; each item runs against its own deadline.
+    batch_deadline = RequestDeadline(per_item_budget * math.ceil(len(items) / concurrency))
+    print(f"[batch] items={len(items)} concurrency={concurrency} per_item_budget={per_item_budget}s")
+
+    async def gen():
+        queue: asyncio.Queue = asyncio.Queue()
+        sem = asyncio.Semaphore(concurrency)
+        item_deadlines: List[RequestDeadline] = []
+        stats: Dict[str, int] = {}
+        yield _ndjson(
+            {
+                "type": "batch_start",
+                "item_ids": [it["item_id"] for it in items],
+                "concurrency": concurrency,
+            }
+        )
+        batch_deadline.current_stage = "items"
+        tasks = [
+            asyncio.create_task(
+                _run_item(
+                    item,
+                    openai_client=openai_client,
+                    budget_sec=budget_sec,
+                    sem=sem,
+                    queue=queue,
+                    item_deadlines=item_deadlines,
+                    stats=stats,
+                    view=view,
+                )
+            )
+            for item in items
+        ]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                event = await queue.get()
+                if event is _ITEM_DONE:
+                    remaining -= 1
+                    continue
+                yield _ndjson(event)
+        finally:
+            if remaining:
+                for d in item_deadlines:
+                    d.cancel("batch_cancelled")
+                for task in tasks:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        elapsed = time.time() - t0
+        yield _ndjson(
+            {
+                "type": "batch_done",
+                "items": len(items),
+                "succeeded": stats.get("done", 0),
+                "failed": stats.get("error", 0),
+                "elapsed_sec": round(elapsed, 3),
+                "items_per_minute": round(len(items) * 60.0 / elapsed, 2) if elapsed > 0 else None,
+            }
+        )
+        print(f"[batch] request done: {len(items)} items in {elapsed:.2f}s")
+
+    return stream_compression.ndjson_response(
+        stream_until_disconnect(gen(), request=request, deadline=batch_deadline, label="batch"),
+        request=request,
+        label="batch",
+    )
@@ -0,0 +1,106 @@
+import hashlib
+import time
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional
+
+from helpers.deadline import RequestDeadline
+
+_LEDGER: ContextVar[Optional["CallLedger"]] = ContextVar("call_ledger", default=None)
+
+SLOWEST_CALLS_KEPT = 5
+
+
+class CallLedger:
+    """
+    Every external call made on behalf of one pipeline run.
+    Lives in a contextvar, so tasks spawned by the run (thumbnail downloads,
+    parallel SERP queries) record into it too. A SERP call shared between
+    concurrent requests is charged to the request that started it; the others
+    record a `shared` entry.
+    With `capture`, call sites' `key` and response `body` are kept too (bodies in
+    `blobs`, by sha256) so the run can be written out as a replayable trace.
+    """
+
+    def __init__(self, deadline: Optional[RequestDeadline] = None, *, capture: bool = False):
+        self.deadline = deadline
+        self.capture = capture
+        self.started_at = time.monotonic()
+        self.calls: List[Dict[str, Any]] = []
+        self.blobs: Dict[str, bytes] = {}
+
+    def record(self, service: str, *, key: Optional[str] = None, body: Optional[bytes] = None, **fields: Any) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {
+            "service": service,
+            "stage": (self.deadline.current_stage if self.deadline else None) or "none",
+            "at_sec": round(time.monotonic() - self.started_at, 3),
+        }
+        entry.update({k: v for k, v in fields.items() if v is not None})
+        if self.capture:
+            if key is not None:
+                entry["key"] = key
+            if body is not None:
+                sha = hashlib.sha256(body).hexdigest()
+                self.blobs[sha] = body
+                entry["blob"] = sha
+        self.calls.append(entry)
+        return entry
+
+    def summary(self) -> Dict[str, Any]:
+        by_service: Dict[str, Dict[str, Any]] = {}
+        by_stage: Dict[str, int] = {}
+        for c in self.calls:
+            s = by_service.setdefault(
+                c["service"],
+                {"calls": 0, "network_calls": 0, "latency_sec": 0.0, "max_latency_sec": 0.0, "bytes_in": 0, "bytes_out": 0},
+            )
+            s["calls"] += 1
+            cache = c.get("cache")
+            if cache in ("hit", "shared"):
+                s[f"cache_{cache}"] = s.get(f"cache_{cache}", 0) + 1
+            else:
+                s["network_calls"] += 1
+                by_stage[c["stage"]] = by_stage.get(c["stage"], 0) + 1
+            if c.get("outcome", "ok") != "ok":
+                s["failed"] = s.get("failed", 0) + 1
+            latency = c.get("latency_sec", 0.0)
+            s["latency_sec"] += latency
+            s["max_latency_sec"] = max(s["max_latency_sec"], latency)
+            s["bytes_in"] += c.get("bytes_in", 0)
+            s["bytes_out"] += c.get("bytes_out", 0)
+            for k in ("tokens_in", "tokens_out"):
+                if k in c:
+                    s[k] = s.get(k, 0) + c[k]
+        for s in by_service.values():
+            s["latency_sec"] = round(s["latency_sec"], 3)
+            s["max_latency_sec"] = round(s["max_latency_sec"], 3)
+
+        slowest = sorted(
+            (c for c in self.calls if c.get("latency_sec")),
+            key=lambda c: c["latency_sec"],
+            reverse=True,
+        )[:SLOWEST_CALLS_KEPT]
+        slowest = [{k: v for k, v in c.items() if k != "blob"} for c in slowest]
+        return {
+            "total_calls": len(self.calls),
+            "network_calls": sum(s["network_calls"] for s in by_service.values()),
+            "by_service": by_service,
+            "network_calls_by_stage": by_stage,
+            "slowest": slowest,
+        }
+
+
+def start_ledger(deadline: Optional[RequestDeadline] = None, *, capture: bool = False) -> "tuple[CallLedger, Token]":
+    ledger = CallLedger(deadline, capture=capture)
+    return ledger, _LEDGER.set(ledger)
+
+
+def end_ledger(token: Token) -> None:
+    try:
+        _LEDGER.reset(token)
+    except ValueError:
+        # Generator finalized from another context (e.g. closed by a different task).
+        pass
+
+
+def current() -> Optional[CallLedger]:
+    return _LEDGER.get()
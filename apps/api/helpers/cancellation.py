@@ -0,0 +1,98 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import Request
+
+from helpers.deadline import RequestDeadline
+
+DISCONNECT_POLL_SEC = 0.25
+
+_CANCEL_STATS: Dict[str, Any] = {
+    "requests_cancelled": 0,
+    "by_stage": {},
+    "budget_sec_released": 0.0,
+    "elapsed_sec_before_cancel": 0.0,
+}
+
+_DONE = object()
+
+
+def cancellation_stats() -> Dict[str, Any]:
+    return {
+        "requests_cancelled": _CANCEL_STATS["requests_cancelled"],
+        "by_stage": dict(_CANCEL_STATS["by_stage"]),
+        "budget_sec_released": round(_CANCEL_STATS["budget_sec_released"], 3),
+        "elapsed_sec_before_cancel": round(_CANCEL_STATS["elapsed_sec_before_cancel"], 3),
+    }
+
+
+def _record_cancellation(deadline: RequestDeadline, *, label: str, reason: str) -> None:
+    # Read the budget before cancel() zeroes it: that is the work we did not do.
+    released = deadline.remaining()
+    deadline.cancel(reason)
+    stage = deadline.current_stage or "unknown"
+    _CANCEL_STATS["requests_cancelled"] += 1
+    _CANCEL_STATS["by_stage"][stage] = _CANCEL_STATS["by_stage"].get(stage, 0) + 1
+    _CANCEL_STATS["budget_sec_released"] += released
+    _CANCEL_STATS["elapsed_sec_before_cancel"] += deadline.elapsed()
+    print(
+        f"[{label}] cancelled: reason={reason} stage={stage} "
+        f"released={released:.2f}s total_cancelled={_CANCEL_STATS['requests_cancelled']}"
+    )
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SEC)
+
+
+async def stream_until_disconnect(
+    chunks: AsyncIterator[Any],
+    *,
+    request: Optional[Request],
+    deadline: RequestDeadline,
+    label: str = "extract",
+) -> AsyncIterator[Any]:
+    """
+    Runs `chunks` in its own task and relays its output.
+    If the client disconnects (or the response is torn down) before the producer
+    finishes, the producer task is cancelled, which cancels its awaited SERP/thumbnail
+    requests and its queued embed_batcher jobs. A CLIP batch already running stops at
+    the next crop boundary once every job in it has been cancelled (the batcher's
+    per-group event); a batch shared with live requests runs to completion.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump() -> None:
+        try:
+            async for chunk in chunks:
+                queue.put_nowait(chunk)
+        finally:
+            queue.put_nowait(_DONE)
+
+    producer = asyncio.create_task(pump())
+    watcher = asyncio.create_task(wait_for_disconnect(request)) if request is not None else None
+    finished = False
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            waiting = {getter} if watcher is None else {getter, watcher}
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                _record_cancellation(deadline, label=label, reason="client_disconnected")
+                finished = True
+                return
+            chunk = getter.result()
+            if chunk is _DONE:
+                finished = True
+                await producer
+                return
+            yield chunk
+    finally:
+        if not finished and not producer.done():
+            _record_cancellation(deadline, label=label, reason="stream_closed")
+        for task in (producer, watcher):
+            if task is not None and not task.done():
+                task.cancel()
+        await asyncio.gather(*(t for t in (producer, watcher) if t is not None), return_exceptions=True)
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_BUDGET_SEC = float(os.getenv("EXTRACT_BUDGET_SEC", "20"))
+MIN_BUDGET_SEC = 3.0
+MAX_BUDGET_SEC = 60.0
+
+# Remaining seconds needed before optional work is started at full size.
+MULTICROP_MIN_SEC = 3.0
+MULTICROP_FULL_SEC = 6.0
+LLM_FALLBACK_MIN_SEC = 10.0
+REQUERY_MIN_SEC = 6.0
+
+# Floor for derived timeouts so a nearly spent budget still gets one real attempt.
+MIN_CALL_TIMEOUT_SEC = 1.0
+
+
+class RequestDeadline:
+    """
+    Request-scoped time budget.
+    Stages ask it how much time is left, derive their call timeouts from it,
+    and record when optional work was skipped or shortened.
+    Cancelling it (client went away) drops the remaining budget to zero and sets
+    `cancel_event`, so no new optional work starts. Running CLIP work is not tied to
+    it: cancelling the request task cancels its embed_batcher futures, and a model
+    batch stops once every job in it has been abandoned.
+    """
+
+    def __init__(self, budget_sec: float):
+        self.budget_sec = float(budget_sec)
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + self.budget_sec
+        self.degraded: List[Dict[str, Any]] = []
+        self.stage_timings: Dict[str, float] = {}
+        self.current_stage: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self.cancel_reason: Optional[str] = None
+
+    def restart(self) -> None:
+        """Starts the budget over, e.g. once a queued request is admitted."""
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + self.budget_sec
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        if self.cancel_event.is_set():
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self, reason: str) -> None:
+        if self.cancel_event.is_set():
+            return
+        self.cancel_reason = reason
+        self.cancel_event.set()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def allows(self, min_sec: float) -> bool:
+        return self.remaining() >= min_sec
+
+    def timeout(self, cap: float) -> float:
+        """
+        Timeout for one external call: never longer than `cap`,
+        never longer than what is left (but at least MIN_CALL_TIMEOUT_SEC).
+        """
+        return max(MIN_CALL_TIMEOUT_SEC, min(float(cap), self.remaining()))
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        self.stage_timings[stage] = round(self.stage_timings.get(stage, 0.0) + seconds, 3)
+
+    def degrade(self, stage: str, action: str, detail: Optional[str] = None) -> None:
+        entry: Dict[str, Any] = {
+            "stage": stage,
+            "action": action,
+            "remaining_sec": round(self.remaining(), 3),
+        }
+        if detail:
+            entry["detail"] = detail
+        self.degraded.append(entry)
+        print(f"[deadline] {stage} {action} remaining={entry['remaining_sec']}s")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "budget_sec": round(self.budget_sec, 3),
+            "elapsed_sec": round(self.elapsed(), 3),
+            "remaining_sec": round(self.remaining(), 3),
+            "degraded_stages": list(self.degraded),
+        }
+
+
+def deadline_from_budget(budget_sec: Optional[float]) -> RequestDeadline:
+    if budget_sec is None or budget_sec <= 0:
+        budget_sec = DEFAULT_BUDGET_SEC
+    budget_sec = min(MAX_BUDGET_SEC, max(MIN_BUDGET_SEC, float(budget_sec)))
+    return RequestDeadline(budget_sec)
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from helpers import metrics
+
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_SEC = float(os.getenv("EMBED_BATCH_WAIT_MS", "8")) / 1000.0
+
+# Signature of clip_service.image_bytes_batch_to_embeddings.
+EmbedBatchFn = Callable[[List[bytes], List[float], Optional[threading.Event]], List[Optional[List[List[float]]]]]
+
+_BATCHER_STATS: Dict[str, int] = {
+    "jobs_submitted": 0,
+    "jobs_embedded": 0,
+    "jobs_released": 0,
+    "batches_run": 0,
+}
+
+
+def batcher_stats() -> Dict[str, int]:
+    return dict(_BATCHER_STATS)
+
+
+class EmbedBatcher:
+    """
+    Cross-request CLIP micro-batcher.
+    Thumbnail embed jobs from every in-flight request (and every batch item) are
+    queued here and run as one model batch per crop set, so concurrent requests
+    share forward passes instead of competing for CPU with separate small batches.
+    Jobs whose waiter was cancelled are released before they reach the model.
+    """
+
+    def __init__(self, embed_fn: EmbedBatchFn):
+        self._embed_fn = embed_fn
+        self._queue: "asyncio.Queue[Tuple[bytes, List[float], asyncio.Future]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def embed(self, images: List[bytes], crops: List[float]) -> List[Optional[List[List[float]]]]:
+        if not images:
+            return []
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        futures: List[asyncio.Future] = []
+        for b in images:
+            fut = loop.create_future()
+            self._queue.put_nowait((b, list(crops), fut))
+            futures.append(fut)
+        _BATCHER_STATS["jobs_submitted"] += len(futures)
+        # Cancelling the gather cancels every job future, which releases queued jobs.
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self) -> List[Tuple[bytes, List[float], asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        flush_at = loop.time() + EMBED_BATCH_WAIT_SEC
+        while len(batch) < EMBED_BATCH_MAX:
+            wait = flush_at - loop.time()
+            if wait <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), wait))
+            except asyncio.TimeoutError:
+                break
+        while len(batch) < EMBED_BATCH_MAX and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            live = [job for job in batch if not job[2].done()]
+            _BATCHER_STATS["jobs_released"] += len(batch) - len(live)
+
+            groups: Dict[Tuple[float, ...], List[Tuple[bytes, List[float], asyncio.Future]]] = {}
+            for job in live:
+                groups.setdefault(tuple(job[1]), []).append(job)
+
+            for crops, jobs in groups.items():
+                await self._run_group(list(crops), jobs)
+
+    async def _run_group(self, crops: List[float], jobs: List[Tuple[bytes, List[float], asyncio.Future]]) -> None:
+        # Lets the model thread stop early once every job in this batch has been abandoned.
+        cancel_event = threading.Event()
+        pending = {"n": len(jobs)}
+
+        def _on_done(fut: asyncio.Future) -> None:
+            if fut.cancelled():
+                pending["n"] -= 1
+                if pending["n"] <= 0:
+                    cancel_event.set()
+
+        for _, _, fut in jobs:
+            fut.add_done_callback(_on_done)
+
+        start = time.perf_counter()
+        try:
+            results = await asyncio.to_thread(self._embed_fn, [job[0] for job in jobs], crops, cancel_event)
+        except Exception as e:
+            for _, _, fut in jobs:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        _BATCHER_STATS["batches_run"] += 1
+        metrics.CLIP_BATCH_SECONDS.observe(time.perf_counter() - start, kind="batch")
+        metrics.CLIP_BATCH_IMAGES.observe(len(jobs), kind="batch")
+        for (_, _, fut), vecs in zip(jobs, results):
+            if fut.done():
+                _BATCHER_STATS["jobs_released"] += 1
+                continue
+            fut.set_result(vecs)
+            _BATCHER_STATS["jobs_embedded"] += 1
+
+
+_BATCHERS: Dict[Any, EmbedBatcher] = {}
+
+
+def get_batcher(embed_fn: EmbedBatchFn) -> EmbedBatcher:
+    loop = asyncio.get_running_loop()
+    batcher = _BATCHERS.get(loop)
+    if batcher is None:
+        _BATCHERS.clear()
+        batcher = EmbedBatcher(embed_fn)
+        _BATCHERS[loop] = batcher
+    return batcher
@@ -1,22 +1,46 @@
 import asyncio
 import base64
+import functools
 import json
+import os
 import time
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import httpx
-from fastapi import HTTPException, UploadFile
+from fastapi import HTTPException, Request, UploadFile
 from fastapi.responses import StreamingResponse
 from openai import OpenAI
 
-from helpers import LLM_Helper, image_processing, image_ranking, output_builder, query_refining
+from helpers import (
+    LLM_Helper,
+    http_pool,
+    image_processing,
+    call_ledger,
+    image_ranking,
+    memory,
+    metrics,
+    output_builder,
+    profiler,
+    query_refining,
+    result_cache,
+    serialization,
+    stream_compression,
+    trace_recorder,
+)
+from helpers import deadline as deadline_budget
+from helpers.admission import EXTRACT_ADMISSION
+from helpers.cancellation import stream_until_disconnect
+from helpers.deadline import RequestDeadline, deadline_from_budget
 from helpers.marketplace_client import extract_items, serp_search, serp_timeout
 
 
 SIMILARITY_MIN = 0.55
 FINAL_SIMILARITY_MIN = 0.68
 FINAL_KEEP_TOP_K = 25
+LLM_TIMEOUT_SEC = 30.0
+# Adds per-stage seconds (`stage_timings_sec`) to the result payload.
+EXTRACT_TIMING_BREAKDOWN = os.getenv("EXTRACT_TIMING_BREAKDOWN", "0") == "1"
 
 
 def normalize_mode(mode: str) -> str:
@@ -26,6 +50,45 @@ def normalize_mode(mode: str) -> str:
     return mode
 
 
+def parse_result_view(
+    fields: Optional[str],
+    listing_limit: Optional[int],
+    listing_format: Optional[str],
+) -> Optional[Dict[str, Any]]:
+    """
+    Listing projection asked for by the client: `fields` is a comma list of
+    output_builder.LISTING_FIELDS, or `none` for no listing fields; missing or empty
+    keeps them all (FastAPI reads an empty form value as missing, so every endpoint
+    does). `listing_limit` caps each side, `listing_format` is rows|columnar.
+    None when the full result was asked for.
+    """
+    listing_format = (listing_format or "rows").strip().lower()
+    if listing_format not in ("rows", "columnar"):
+        raise HTTPException(status_code=400, detail="listing_format must be rows|columnar")
+    names: Optional[Tuple[str, ...]] = None
+    if fields is not None and fields.strip().lower() == "none":
+        names = ()
+    elif fields is not None:
+        names = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip())) or None
+        unknown = [f for f in names or () if f not in output_builder.LISTING_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown listing fields: {', '.join(unknown)}")
+    if listing_limit is not None and not 0 <= listing_limit <= output_builder.LISTING_LIMIT_MAX:
+        raise HTTPException(
+            status_code=400, detail=f"listing_limit must be between 0 and {output_builder.LISTING_LIMIT_MAX}"
+        )
+    if names is None and listing_limit is None and listing_format == "rows":
+        return None
+    return {"fields": names, "limit": listing_limit, "listing_format": listing_format}
+
+
+def _project_event(event: Dict[str, Any], view: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # Applied at the edge so cached and stored results keep every listing and field.
+    if view is None or event.get("type") != "result":
+        return event
+    return {**event, "data": output_builder.project_result(event["data"], **view)}
+
+
 def validate_image_uploads(main_image: UploadFile, files: List[UploadFile]) -> None:
     def looks_like_image(ct: str | None) -> bool:
         return ct is None or ct.startswith("image/")
@@ -60,12 +123,11 @@ async def get_initial_query(
     openai_client: OpenAI,
     itemName: Optional[str],
     text: Optional[str],
-    main_image: UploadFile,
     main_bytes: bytes,
-    files: List[UploadFile],
     extra_bytes: List[bytes],
     main_content_type: str,
     extra_content_types: List[str],
+    deadline: RequestDeadline,
 ) -> Tuple[str, bool, Optional[dict]]:
     if itemName and itemName.strip():
         return itemName.strip(), False, None
@@ -82,11 +144,17 @@ async def get_initial_query(
         extra_content_types,
     )
 
-    resp = openai_client.responses.create(
-        model="gpt-4o-mini",
-        input=[{"role": "user", "content": content}],
-        max_output_tokens=1500,
-    )
+    with metrics.track_call("openai") as call:
+        call["bytes_out"] = sum(len((c.get("text") or c.get("image_url") or "").encode("utf-8")) for c in content)
+        resp = await asyncio.to_thread(
+            openai_client.responses.create,
+            model="gpt-4o-mini",
+            input=[{"role": "user", "content": content}],
+            max_output_tokens=1500,
+            timeout=deadline.timeout(LLM_TIMEOUT_SEC),
+        )
+        call.update(metrics.openai_usage(resp))
+        call["body"] = (resp.output_text or "").encode("utf-8")
 
     raw_text = resp.output_text
     try:
@@ -112,41 +180,47 @@ async def maybe_fallback_to_llm_when_text_fails(
     openai_client: OpenAI,
     original_text: Optional[str],
     refined_query: Optional[str],
-    main_image: UploadFile,
     main_bytes: bytes,
-    files: List[UploadFile],
     extra_bytes: List[bytes],
     main_content_type: str,
     extra_content_types: List[str],
+    deadline: RequestDeadline,
 ) -> Optional[str]:
     if not (original_text and original_text.strip()):
         return None
     if refined_query:
         return None
+    if not deadline.allows(deadline_budget.LLM_FALLBACK_MIN_SEC):
+        deadline.degrade("llm_fallback", "skipped")
+        return None
 
     llm_query, _used_llm, _extracted = await get_initial_query(
         openai_client=openai_client,
         itemName=None,
         text=None,
-        main_image=main_image,
         main_bytes=main_bytes,
-        files=files,
         extra_bytes=extra_bytes,
         main_content_type=main_content_type,
         extra_content_types=extra_content_types,
+        deadline=deadline,
     )
     return llm_query
 
 
-async def fetch_initial_serp_results(*, query: str, mode: str) -> Tuple[Optional[dict], Optional[dict]]:
-    timeout = serp_timeout()
-    async with httpx.AsyncClient(timeout=timeout) as http:
-        tasks = []
-        if mode in ("active", "both"):
-            tasks.append(serp_search(http, q=query, sold=False))
-        if mode == "sold" and mode != "both":
-            tasks.append(serp_search(http, q=query, sold=True))
-        results = await asyncio.gather(*tasks)
+async def fetch_initial_serp_results(
+    *,
+    query: str,
+    mode: str,
+    deadline: RequestDeadline,
+) -> Tuple[Optional[dict], Optional[dict]]:
+    timeout = serp_timeout(deadline)
+    http = http_pool.get_client("serp")
+    tasks = []
+    if mode in ("active", "both"):
+        tasks.append(serp_search(http, q=query, sold=False, timeout=timeout))
+    if mode == "sold" and mode != "both":
+        tasks.append(serp_search(http, q=query, sold=True, timeout=timeout))
+    results = await asyncio.gather(*tasks)
     if mode in ("active", "both"):
         return results[0], None
     if mode == "sold":
@@ -160,6 +234,7 @@ async def rerank_initial_for_signal(
     sold_items: List[dict],
     main_vecs: List[List[float]],
     mode: str,
+    deadline: RequestDeadline,
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     active_ranked = None
     sold_ranked = None
@@ -171,17 +246,20 @@ async def rerank_initial_for_signal(
             threshold=SIMILARITY_MIN,
             keep_top_k=None,
         )
-        await image_processing.enrich_top_items_with_multicrop(
+        enriched = await image_processing.enrich_top_items_with_multicrop(
             active_items,
             top_n=image_processing.MULTICROP_RERANK_TOP_N,
             concurrency=image_processing.THUMB_CONCURRENCY,
+            deadline=deadline,
+            stage="multicrop_initial_active",
         )
-        active_ranked = image_ranking.rerank_items_by_image_similarity(
-            active_items,
-            main_vecs,
-            threshold=SIMILARITY_MIN,
-            keep_top_k=None,
-        )
+        if enriched:
+            active_ranked = image_ranking.rerank_items_by_image_similarity(
+                active_items,
+                main_vecs,
+                threshold=SIMILARITY_MIN,
+                keep_top_k=None,
+            )
 
     if mode in ("sold", "both") and sold_items:
         sold_ranked = image_ranking.rerank_items_by_image_similarity(
@@ -190,17 +268,20 @@ async def rerank_initial_for_signal(
             threshold=SIMILARITY_MIN,
             keep_top_k=None,
         )
-        await image_processing.enrich_top_items_with_multicrop(
+        enriched = await image_processing.enrich_top_items_with_multicrop(
             sold_items,
             top_n=image_processing.MULTICROP_RERANK_TOP_N,
             concurrency=image_processing.THUMB_CONCURRENCY,
+            deadline=deadline,
+            stage="multicrop_initial_sold",
         )
-        sold_ranked = image_ranking.rerank_items_by_image_similarity(
-            sold_items,
-            main_vecs,
-            threshold=SIMILARITY_MIN,
-            keep_top_k=None,
-        )
+        if enriched:
+            sold_ranked = image_ranking.rerank_items_by_image_similarity(
+                sold_items,
+                main_vecs,
+                threshold=SIMILARITY_MIN,
+                keep_top_k=None,
+            )
 
     return active_ranked, sold_ranked
 
@@ -212,6 +293,7 @@ async def fetch_final_candidates(
     initial_active_items: List[dict],
     initial_sold_items: List[dict],
     main_vecs: List[List[float]],
+    deadline: RequestDeadline,
 ) -> Dict[str, Any]:
     before = datetime.now()
     if not refined_query:
@@ -234,14 +316,14 @@ async def fetch_final_candidates(
         }
 
     before = datetime.now()
-    timeout = serp_timeout()
-    async with httpx.AsyncClient(timeout=timeout) as http:
-        tasks = []
-        if mode in ("active", "both"):
-            tasks.append(serp_search(http, q=refined_query, sold=False))
-        if mode in ("sold", "both"):
-            tasks.append(serp_search(http, q=refined_query, sold=True))
-        results = await asyncio.gather(*tasks)
+    timeout = serp_timeout(deadline)
+    http = http_pool.get_client("serp")
+    tasks = []
+    if mode in ("active", "both"):
+        tasks.append(serp_search(http, q=refined_query, sold=False, timeout=timeout))
+    if mode in ("sold", "both"):
+        tasks.append(serp_search(http, q=refined_query, sold=True, timeout=timeout))
+    results = await asyncio.gather(*tasks)
     print(f"Getting marketplace results {datetime.now() - before}")
 
     if mode == "active":
@@ -263,6 +345,7 @@ async def fetch_final_candidates(
             max_items=image_processing.EMBED_MAX_INITIAL,
             concurrency=image_processing.THUMB_CONCURRENCY,
             crops=image_processing.FAST_CROPS,
+            deadline=deadline,
         )
         active_ranked_final = image_ranking.rerank_items_by_image_similarity(
             active_items_ref,
@@ -274,6 +357,8 @@ async def fetch_final_candidates(
             active_items_ref,
             top_n=image_processing.MULTICROP_RERANK_TOP_N,
             concurrency=image_processing.THUMB_CONCURRENCY,
+            deadline=deadline,
+            stage="multicrop_final_active",
         )
         active_ranked_final = image_ranking.rerank_items_by_image_similarity(
             active_items_ref,
@@ -288,6 +373,7 @@ async def fetch_final_candidates(
             max_items=image_processing.EMBED_MAX_INITIAL,
             concurrency=image_processing.THUMB_CONCURRENCY,
             crops=image_processing.FAST_CROPS,
+            deadline=deadline,
         )
         sold_ranked_final = image_ranking.rerank_items_by_image_similarity(
             sold_items_ref,
@@ -299,6 +385,8 @@ async def fetch_final_candidates(
             sold_items_ref,
             top_n=image_processing.MULTICROP_RERANK_TOP_N,
             concurrency=image_processing.THUMB_CONCURRENCY,
+            deadline=deadline,
+            stage="multicrop_final_sold",
         )
         sold_ranked_final = image_ranking.rerank_items_by_image_similarity(
             sold_items_ref,
@@ -316,52 +404,47 @@ async def fetch_final_candidates(
     }
 
 
-def _ndjson(obj: Any) -> str:
-    return json.dumps(output_builder.json_sanitize(obj)) + "\n"
+def _ndjson(obj: Any) -> bytes:
+    return serialization.ndjson_line(obj)
 
 
 async def _step_1_generate_marketplace_query(
     *,
     openai_client: OpenAI,
-    main_image: UploadFile,
-    files: List[UploadFile],
+    main_bytes: bytes,
+    extra_bytes: List[bytes],
+    main_content_type: str,
+    extra_content_types: List[str],
     itemName: Optional[str],
     text: Optional[str],
-) -> Tuple[bytes, List[bytes], str, List[str], List[List[float]], str, bool, bool]:
-    print("[extract] step1 start: prepare images + initial query")
-    main_bytes, extra_bytes, main_content_type, extra_content_types = await image_processing.read_images(
-        main_image, files
-    )
+    deadline: RequestDeadline,
+) -> Tuple[List[List[float]], str, bool, bool]:
+    print("[extract] step1 start: embed main image + initial query")
     main_vecs = await image_processing.embed_main_image(main_bytes)
 
     query, used_llm, _extracted = await get_initial_query(
         openai_client=openai_client,
         itemName=itemName,
         text=text,
-        main_image=main_image,
         main_bytes=main_bytes,
-        files=files,
         extra_bytes=extra_bytes,
         main_content_type=main_content_type,
         extra_content_types=extra_content_types,
+        deadline=deadline,
     )
     print("[extract] step1 done: initial query ready")
     direct_final = bool(itemName and itemName.strip())
-    return (
-        main_bytes,
-        extra_bytes,
-        main_content_type,
-        extra_content_types,
-        main_vecs,
-        query,
-        used_llm,
-        direct_final,
-    )
+    return main_vecs, query, used_llm, direct_final
 
 
-async def _step_2_query_initial_marketplaces(*, query: str, mode: str) -> Tuple[List[dict], List[dict]]:
+async def _step_2_query_initial_marketplaces(
+    *,
+    query: str,
+    mode: str,
+    deadline: RequestDeadline,
+) -> Tuple[List[dict], List[dict]]:
     print(f"[extract] step2 start: initial marketplace query mode={mode}")
-    serp_active, serp_sold = await fetch_initial_serp_results(query=query, mode=mode)
+    serp_active, serp_sold = await fetch_initial_serp_results(query=query, mode=mode, deadline=deadline)
     active_items = extract_items(serp_active)
     sold_items = extract_items(serp_sold)
     print("[extract] step2 done: initial marketplace results fetched")
@@ -374,12 +457,14 @@ async def _step_3_process_item_images(
     sold_items: List[dict],
     mode: str,
     main_vecs: List[List[float]],
+    deadline: RequestDeadline,
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     print("[extract] step3 start: embed thumbnails + rerank")
     await image_processing.embed_initial_thumbnails_if_needed(
         active_items=active_items,
         sold_items=sold_items,
         mode=mode,
+        deadline=deadline,
     )
     print("[extract] step3 mid: initial thumbnail embedding complete")
     active_ranked, sold_ranked = await rerank_initial_for_signal(
@@ -387,6 +472,7 @@ async def _step_3_process_item_images(
         sold_items=sold_items,
         main_vecs=main_vecs,
         mode=mode,
+        deadline=deadline,
     )
     print("[extract] step3 done: initial rerank complete")
     return active_ranked, sold_ranked
@@ -398,9 +484,7 @@ async def _step_4_refine_query_with_optional_fallback(
     query: str,
     used_llm: bool,
     text: Optional[str],
-    main_image: UploadFile,
     main_bytes: bytes,
-    files: List[UploadFile],
     extra_bytes: List[bytes],
     main_content_type: str,
     extra_content_types: List[str],
@@ -408,6 +492,7 @@ async def _step_4_refine_query_with_optional_fallback(
     sold_items: List[dict],
     main_vecs: List[List[float]],
     mode: str,
+    deadline: RequestDeadline,
 ) -> Tuple[str, bool, Optional[str], List[dict], List[dict], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     print("[extract] step4 start: refine query")
     refined_query = await query_refining.refine_query_if_confident(
@@ -421,12 +506,11 @@ async def _step_4_refine_query_with_optional_fallback(
         openai_client=openai_client,
         original_text=text,
         refined_query=refined_query,
-        main_image=main_image,
         main_bytes=main_bytes,
-        files=files,
         extra_bytes=extra_bytes,
         main_content_type=main_content_type,
         extra_content_types=extra_content_types,
+        deadline=deadline,
     )
     print("[extract] step4 mid: fallback decision evaluated")
 
@@ -437,19 +521,21 @@ async def _step_4_refine_query_with_optional_fallback(
         print("[extract] step4 fallback: running llm fallback flow")
         query = fallback_llm_query
         used_llm = True
-        serp_active, serp_sold = await fetch_initial_serp_results(query=query, mode=mode)
+        serp_active, serp_sold = await fetch_initial_serp_results(query=query, mode=mode, deadline=deadline)
         active_items = extract_items(serp_active)
         sold_items = extract_items(serp_sold)
         await image_processing.embed_initial_thumbnails_if_needed(
             active_items=active_items,
             sold_items=sold_items,
             mode=mode,
+            deadline=deadline,
         )
         active_ranked_from_fallback, sold_ranked_from_fallback = await rerank_initial_for_signal(
             active_items=active_items,
             sold_items=sold_items,
             main_vecs=main_vecs,
             mode=mode,
+            deadline=deadline,
         )
         refined_query = await query_refining.refine_query_if_confident(
             original_query=query,
@@ -477,6 +563,21 @@ def _step_5_get_final_step_message(*, direct_final: bool) -> str:
     return "Re-querying marketplaces"
 
 
+def _step_5_drop_requery_if_over_budget(
+    *,
+    refined_query: Optional[str],
+    direct_final: bool,
+    deadline: RequestDeadline,
+) -> Optional[str]:
+    # With an explicit itemName the "requery" is the only marketplace query, so it always runs.
+    if not refined_query or direct_final:
+        return refined_query
+    if deadline.allows(deadline_budget.REQUERY_MIN_SEC):
+        return refined_query
+    deadline.degrade("requery", "skipped", detail=refined_query)
+    return None
+
+
 async def _step_6_fetch_final_candidates(
     *,
     mode: str,
@@ -484,6 +585,7 @@ async def _step_6_fetch_final_candidates(
     active_items: List[dict],
     sold_items: List[dict],
     main_vecs: List[List[float]],
+    deadline: RequestDeadline,
 ) -> Dict[str, Any]:
     print("[extract] step6 start: fetch final candidates")
     final_candidates = await fetch_final_candidates(
@@ -492,6 +594,7 @@ async def _step_6_fetch_final_candidates(
         initial_active_items=active_items,
         initial_sold_items=sold_items,
         main_vecs=main_vecs,
+        deadline=deadline,
     )
     print("[extract] step6 done: final candidates ready")
     return final_candidates
@@ -543,6 +646,7 @@ def _step_9_build_frontend_result(
     active_ranked: Optional[Dict[str, Any]],
     sold_ranked: Optional[Dict[str, Any]],
     t0: float,
+    deadline: RequestDeadline,
 ) -> Dict[str, Any]:
     print("[extract] step9 start: build frontend payload")
     frontend = output_builder.build_frontend_payload(
@@ -554,9 +658,317 @@ def _step_9_build_frontend_result(
     )
     print("[extract] step9 done: frontend payload built")
     frontend["timing_sec"] = round(time.time() - t0, 3)
+    frontend["budget_sec"] = deadline.budget_sec
+    frontend["degraded_stages"] = list(deadline.degraded)
+    ledger = call_ledger.current()
+    if ledger is not None:
+        frontend["external_calls"] = ledger.summary()
+    if EXTRACT_TIMING_BREAKDOWN:
+        frontend["stage_timings_sec"] = dict(deadline.stage_timings)
     return frontend
 
 
+@functools.lru_cache(maxsize=128)
+def _step_event(
+    step_id: str,
+    label: str,
+    status: str,
+    pct: Optional[float] = None,
+    detail: Optional[str] = None,
+) -> Dict[str, Any]:
+    # Step events come from a fixed set of arguments, so each is built and encoded once
+    # per process; callers must copy before changing one.
+    payload: Dict[str, Any] = {
+        "type": "step",
+        "step_id": step_id,
+        "label": label,
+        "status": status,
+    }
+    if pct is not None:
+        payload["pct"] = pct
+    if detail:
+        payload["detail"] = detail
+    return serialization.precomputed(payload)
+
+
+def _error_event(e: Exception) -> Dict[str, Any]:
+    if isinstance(e, HTTPException):
+        return {
+            "type": "error",
+            "error": e.detail if isinstance(e.detail, dict) else {"error": str(e.detail)},
+        }
+    if isinstance(e, httpx.TimeoutException):
+        return {"type": "error", "error": {"error": "Timeout during marketplace query", "detail": str(e)}}
+    if isinstance(e, httpx.HTTPError):
+        return {"type": "error", "error": {"error": "HTTP error during marketplace query", "detail": str(e)}}
+    return {"type": "error", "error": {"error": "Unhandled server error", "detail": str(e)}}
+
+
+async def run_extract_pipeline(
+    *,
+    openai_client: OpenAI,
+    main_bytes: bytes,
+    extra_bytes: List[bytes],
+    main_content_type: str,
+    extra_content_types: List[str],
+    itemName: Optional[str],
+    text: Optional[str],
+    mode: str,
+    deadline: RequestDeadline,
+    t0: float,
+    outcome: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Runs steps 1-9 on already-read image bytes and yields the stream events as dicts.
+    Exceptions propagate to the caller, which turns them into an error event.
+    If `outcome` is given it receives the final queries and ranked lists.
+    """
+
+    step_started: Dict[str, float] = {}
+
+    def emit(step_id: str, label: str, status: str, pct: Optional[float] = None, detail: Optional[str] = None):
+        if status == "start":
+            deadline.current_stage = step_id
+            step_started[step_id] = time.perf_counter()
+            memory.stage_started(deadline, step_id)
+        elif step_id in step_started:
+            elapsed = time.perf_counter() - step_started.pop(step_id)
+            metrics.STEP_SECONDS.observe(elapsed, step=step_id)
+            deadline.record_stage(step_id, elapsed)
+            memory.stage_finished(deadline, step_id)
+        return _step_event(step_id, label, status, pct, detail)
+
+    yield emit("gen_query", "Generating marketplace query", "start", 0.02)
+    main_vecs, query, used_llm, direct_final = await _step_1_generate_marketplace_query(
+        openai_client=openai_client,
+        main_bytes=main_bytes,
+        extra_bytes=extra_bytes,
+        main_content_type=main_content_type,
+        extra_content_types=extra_content_types,
+        itemName=itemName,
+        text=text,
+        deadline=deadline,
+    )
+    yield emit("gen_query", "Generating marketplace query", "done", 0.18)
+
+    if direct_final:
+        print("[extract] direct itemName mode: skipping initial query/refine image steps")
+        active_items = []
+        sold_items = []
+        active_ranked = None
+        sold_ranked = None
+        refined_query = query
+        yield emit("query_mkt", "Querying marketplaces", "done", 0.20, detail="skipped")
+        yield emit("proc_imgs", "Processing item images", "done", 0.65, detail="skipped")
+        yield emit("refine", "Refining search query", "done", 0.80, detail="skipped")
+    else:
+        print("[extract] full flow mode: running initial query/image/refine pipeline")
+        yield emit("query_mkt", "Querying marketplaces", "start", 0.20)
+        active_items, sold_items = await _step_2_query_initial_marketplaces(
+            query=query,
+            mode=mode,
+            deadline=deadline,
+        )
+        yield emit("query_mkt", "Querying marketplaces", "done", 0.0)
+
+        yield emit("proc_imgs", "Processing item images", "start", 0.32)
+        active_ranked, sold_ranked = await _step_3_process_item_images(
+            active_items=active_items,
+            sold_items=sold_items,
+            mode=mode,
+            main_vecs=main_vecs,
+            deadline=deadline,
+        )
+        yield emit("proc_imgs", "Processing item images", "done", 0.65)
+
+        yield emit("refine", "Refining search query", "start", 0.67)
+        (
+            query,
+            used_llm,
+            refined_query,
+            active_items,
+            sold_items,
+            active_ranked_from_fallback,
+            sold_ranked_from_fallback,
+        ) = await _step_4_refine_query_with_optional_fallback(
+            openai_client=openai_client,
+            query=query,
+            used_llm=used_llm,
+            text=text,
+            main_bytes=main_bytes,
+            extra_bytes=extra_bytes,
+            main_content_type=main_content_type,
+            extra_content_types=extra_content_types,
+            active_items=active_items,
+            sold_items=sold_items,
+            main_vecs=main_vecs,
+            mode=mode,
+            deadline=deadline,
+        )
+        if active_ranked_from_fallback is not None:
+            active_ranked = active_ranked_from_fallback
+        if sold_ranked_from_fallback is not None:
+            sold_ranked = sold_ranked_from_fallback
+        yield emit("refine", "Refining search query", "done", 0.80)
+
+    final_step_message = _step_5_get_final_step_message(direct_final=direct_final)
+    planned_refined_query = refined_query
+    refined_query = _step_5_drop_requery_if_over_budget(
+        refined_query=refined_query,
+        direct_final=direct_final,
+        deadline=deadline,
+    )
+    if refined_query:
+        print("[extract] requery start: refined query present")
+        yield emit("requery", final_step_message, "start", 0.82)
+    final_candidates = await _step_6_fetch_final_candidates(
+        mode=mode,
+        refined_query=refined_query,
+        active_items=active_items,
+        sold_items=sold_items,
+        main_vecs=main_vecs,
+        deadline=deadline,
+    )
+
+    if refined_query:
+        yield emit("requery", "Re-querying marketplaces", "done", 0.98)
+        active_ranked, sold_ranked, active_items, sold_items = _step_7_apply_final_candidate_state(
+            refined_query=refined_query,
+            final_candidates=final_candidates,
+            active_ranked=active_ranked,
+            sold_ranked=sold_ranked,
+            active_items=active_items,
+            sold_items=sold_items,
+        )
+    else:
+        print("[extract] requery skipped: no refined query")
+        skip_detail = "skipped (time budget)" if planned_refined_query else "skipped (no refined query)"
+        yield emit("requery", "Re-querying marketplaces", "done", 0.98, detail=skip_detail)
+
+    build_started = time.perf_counter()
+    memory.stage_started(deadline, "build_result")
+    _step_8_strip_heavy_fields(
+        active_items=active_items,
+        sold_items=sold_items,
+        active_ranked=active_ranked,
+        sold_ranked=sold_ranked,
+    )
+    frontend = _step_9_build_frontend_result(
+        mode=mode,
+        query=query,
+        refined_query=refined_query,
+        active_ranked=active_ranked,
+        sold_ranked=sold_ranked,
+        t0=t0,
+        deadline=deadline,
+    )
+    metrics.STEP_SECONDS.observe(time.perf_counter() - build_started, step="build_result")
+    memory.stage_finished(deadline, "build_result")
+    if outcome is not None:
+        outcome.update(
+            {
+                "initial_query": query,
+                "refined_query": refined_query,
+                "active_ranked": active_ranked,
+                "sold_ranked": sold_ranked,
+            }
+        )
+    yield {"type": "result", "data": frontend}
+
+
+async def run_extract_events(
+    *,
+    openai_client: OpenAI,
+    main_bytes: bytes,
+    extra_bytes: List[bytes],
+    main_content_type: str,
+    extra_content_types: List[str],
+    itemName: Optional[str],
+    text: Optional[str],
+    mode: str,
+    deadline: RequestDeadline,
+    t0: float,
+    request: Optional[Request] = None,
+    view: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Result-cache aware wrapper around run_extract_pipeline.
+    Pipeline failures are yielded as an error event rather than raised.
+    `view` (parse_result_view) projects the result event's listings.
+    """
+    started = time.perf_counter()
+    outcome_label = "error"
+    metrics.EXTRACT_IN_FLIGHT.inc()
+    memory_tracker = memory.start_stage_tracking(deadline)
+    trace = trace_recorder.maybe_start_trace(request, flow="extract")
+    if trace is not None:
+        trace.set_inputs(
+            images=[main_bytes, *extra_bytes],
+            content_types=[main_content_type, *extra_content_types],
+            mode=mode,
+            text=text,
+            itemName=itemName,
+            budget_sec=deadline.budget_sec,
+        )
+    ledger, ledger_token = call_ledger.start_ledger(deadline, capture=trace is not None)
+    try:
+        content_key = result_cache.content_key(
+            main_bytes=main_bytes,
+            extra_bytes=extra_bytes,
+            itemName=itemName,
+            text=text,
+        )
+        cached = result_cache.lookup(content_key, mode=mode)
+        if cached is not None:
+            print(f"[extract] result cache hit: stored_mode={cached['mode']} mode={mode}")
+            outcome_label = "cached"
+            for event in result_cache.replay_events(cached, mode=mode, t0=t0):
+                if event.get("type") == "result":
+                    event["data"]["external_calls"] = ledger.summary()
+                yield _project_event(event, view)
+            return
+
+        events: List[Dict[str, Any]] = []
+        outcome: Dict[str, Any] = {}
+        async for event in run_extract_pipeline(
+            openai_client=openai_client,
+            main_bytes=main_bytes,
+            extra_bytes=extra_bytes,
+            main_content_type=main_content_type,
+            extra_content_types=extra_content_types,
+            itemName=itemName,
+            text=text,
+            mode=mode,
+            deadline=deadline,
+            t0=t0,
+            outcome=outcome,
+        ):
+            events.append(event)
+            if event.get("type") == "result":
+                outcome_label = "degraded" if deadline.degraded else "ok"
+            yield _project_event(event, view)
+
+        if deadline.degraded:
+            print("[extract] result not cached: degraded by time budget")
+        else:
+            result_cache.store(content_key, mode=mode, events=events, outcome=outcome)
+
+    except Exception as e:
+        yield _error_event(e)
+    except BaseException:
+        outcome_label = "cancelled"
+        raise
+    finally:
+        if memory_tracker is not None:
+            memory.finish_stage_tracking(memory_tracker)
+        metrics.REQUEST_NETWORK_CALLS.observe(ledger.summary()["network_calls"])
+        if trace is not None:
+            trace.finish(ledger=ledger, deadline=deadline, outcome=outcome_label)
+        call_ledger.end_ledger(ledger_token)
+        metrics.EXTRACT_IN_FLIGHT.dec()
+        metrics.EXTRACT_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome=outcome_label)
+
+
 async def build_extract_file_stream_response(
     *,
     openai_client: OpenAI,
@@ -565,174 +977,80 @@ async def build_extract_file_stream_response(
     itemName: Optional[str],
     text: Optional[str],
     mode: str,
+    budget_sec: Optional[float] = None,
+    request: Optional[Request] = None,
+    fields: Optional[str] = None,
+    listing_limit: Optional[int] = None,
+    listing_format: Optional[str] = None,
 ) -> StreamingResponse:
     t0 = time.time()
     print("[extract] request start")
     mode = normalize_mode(mode)
+    view = parse_result_view(fields, listing_limit, listing_format)
     validate_image_uploads(main_image, files)
+    # Shed load before the stream starts so overloaded callers get a real 429 + Retry-After.
+    EXTRACT_ADMISSION.check()
+    deadline = deadline_from_budget(budget_sec)
+    print(f"[extract] time budget {deadline.budget_sec}s")
 
     async def gen():
-        async def emit(step_id: str, label: str, status: str, pct: Optional[float] = None, detail: Optional[str] = None):
-            payload = {
-                "type": "step",
-                "step_id": step_id,
-                "label": label,
-                "status": status,
-            }
-            if pct is not None:
-                payload["pct"] = pct
-            if detail:
-                payload["detail"] = detail
-            yield _ndjson(payload)
-
+        print("[extract] stream start")
         try:
-            print("[extract] stream start")
-            async for chunk in emit("gen_query", "Generating marketplace query", "start", 0.02):
-                yield chunk
-            (
-                main_bytes,
-                extra_bytes,
-                main_content_type,
-                extra_content_types,
-                main_vecs,
-                query,
-                used_llm,
-                direct_final,
-            ) = await _step_1_generate_marketplace_query(
+            ticket = EXTRACT_ADMISSION.enqueue()
+        except HTTPException as e:
+            yield _ndjson(_error_event(e))
+            return
+        profile = None
+        try:
+            deadline.current_stage = "queued"
+            async for event in ticket.wait_events():
+                yield _ndjson(event)
+            # Time spent waiting in line does not count against the pipeline budget.
+            deadline.restart()
+            if ticket.admitted_at is not None:
+                deadline.record_stage("queued", ticket.admitted_at - ticket.enqueued_at)
+            profile = profiler.maybe_start_profile(request, deadline)
+
+            try:
+                main_bytes, extra_bytes, main_content_type, extra_content_types = await image_processing.read_images(
+                    main_image, files
+                )
+            except Exception as e:
+                yield _ndjson(_error_event(e))
+                return
+
+            async for event in run_extract_events(
                 openai_client=openai_client,
-                main_image=main_image,
-                files=files,
+                main_bytes=main_bytes,
+                extra_bytes=extra_bytes,
+                main_content_type=main_content_type,
+                extra_content_types=extra_content_types,
                 itemName=itemName,
                 text=text,
-            )
-            async for chunk in emit("gen_query", "Generating marketplace query", "done", 0.18):
-                yield chunk
-
-            if direct_final:
-                print("[extract] direct itemName mode: skipping initial query/refine image steps")
-                active_items = []
-                sold_items = []
-                active_ranked = None
-                sold_ranked = None
-                refined_query = query
-                async for chunk in emit("query_mkt", "Querying marketplaces", "done", 0.20, detail="skipped"):
-                    yield chunk
-                async for chunk in emit("proc_imgs", "Processing item images", "done", 0.65, detail="skipped"):
-                    yield chunk
-                async for chunk in emit("refine", "Refining search query", "done", 0.80, detail="skipped"):
-                    yield chunk
-            else:
-                print("[extract] full flow mode: running initial query/image/refine pipeline")
-                async for chunk in emit("query_mkt", "Querying marketplaces", "start", 0.20):
-                    yield chunk
-                active_items, sold_items = await _step_2_query_initial_marketplaces(query=query, mode=mode)
-                async for chunk in emit("query_mkt", "Querying marketplaces", "done", 0.0):
-                    yield chunk
-
-                async for chunk in emit("proc_imgs", "Processing item images", "start", 0.32):
-                    yield chunk
-                active_ranked, sold_ranked = await _step_3_process_item_images(
-                    active_items=active_items,
-                    sold_items=sold_items,
-                    mode=mode,
-                    main_vecs=main_vecs,
-                )
-                async for chunk in emit("proc_imgs", "Processing item images", "done", 0.65):
-                    yield chunk
-
-                async for chunk in emit("refine", "Refining search query", "start", 0.67):
-                    yield chunk
-                (
-                    query,
-                    used_llm,
-                    refined_query,
-                    active_items,
-                    sold_items,
-                    active_ranked_from_fallback,
-                    sold_ranked_from_fallback,
-                ) = await _step_4_refine_query_with_optional_fallback(
-                    openai_client=openai_client,
-                    query=query,
-                    used_llm=used_llm,
-                    text=text,
-                    main_image=main_image,
-                    main_bytes=main_bytes,
-                    files=files,
-                    extra_bytes=extra_bytes,
-                    main_content_type=main_content_type,
-                    extra_content_types=extra_content_types,
-                    active_items=active_items,
-                    sold_items=sold_items,
-                    main_vecs=main_vecs,
-                    mode=mode,
-                )
-                if active_ranked_from_fallback is not None:
-                    active_ranked = active_ranked_from_fallback
-                if sold_ranked_from_fallback is not None:
-                    sold_ranked = sold_ranked_from_fallback
-                async for chunk in emit("refine", "Refining search query", "done", 0.80):
-                    yield chunk
-
-            final_step_message = _step_5_get_final_step_message(direct_final=direct_final)
-            if refined_query:
-                print("[extract] requery start: refined query present")
-                async for chunk in emit("requery", final_step_message, "start", 0.82):
-                    yield chunk
-            final_candidates = await _step_6_fetch_final_candidates(
                 mode=mode,
-                refined_query=refined_query,
-                active_items=active_items,
-                sold_items=sold_items,
-                main_vecs=main_vecs,
-            )
-
-            if refined_query:
-                async for chunk in emit("requery", "Re-querying marketplaces", "done", 0.98):
-                    yield chunk
-                active_ranked, sold_ranked, active_items, sold_items = _step_7_apply_final_candidate_state(
-                    refined_query=refined_query,
-                    final_candidates=final_candidates,
-                    active_ranked=active_ranked,
-                    sold_ranked=sold_ranked,
-                    active_items=active_items,
-                    sold_items=sold_items,
-                )
-            else:
-                print("[extract] requery skipped: no refined query")
-                async for chunk in emit(
-                    "requery", "Re-querying marketplaces", "done", 0.98, detail="skipped (no refined query)"
-                ):
-                    yield chunk
-
-            _step_8_strip_heavy_fields(
-                active_items=active_items,
-                sold_items=sold_items,
-                active_ranked=active_ranked,
-                sold_ranked=sold_ranked,
-            )
-            frontend = _step_9_build_frontend_result(
-                mode=mode,
-                query=query,
-                refined_query=refined_query,
-                active_ranked=active_ranked,
-                sold_ranked=sold_ranked,
+                deadline=deadline,
                 t0=t0,
-            )
-            yield _ndjson({"type": "result", "data": frontend})
-            print("[extract] request done")
-
-        except HTTPException as e:
-            yield _ndjson(
-                {
-                    "type": "error",
-                    "error": e.detail if isinstance(e.detail, dict) else {"error": str(e.detail)},
-                }
-            )
-        except httpx.TimeoutException as e:
-            yield _ndjson({"type": "error", "error": {"error": "Timeout during marketplace query", "detail": str(e)}})
-        except httpx.HTTPError as e:
-            yield _ndjson({"type": "error", "error": {"error": "HTTP error during marketplace query", "detail": str(e)}})
-        except Exception as e:
-            yield _ndjson({"type": "error", "error": {"error": "Unhandled server error", "detail": str(e)}})
-
-    return StreamingResponse(gen(), media_type="application/x-ndjson")
+                request=request,
+                view=view,
+            ):
+                yield _ndjson(event)
+
+            if profile is not None:
+                session, profile = profile, None
+                path = await asyncio.to_thread(profiler.finish_profile, session)
+                if path is not None and session.reason == "admin":
+                    yield _ndjson({"type": "profile", "profile_id": session.profile_id})
+        finally:
+            try:
+                if profile is not None:
+                    # Writing the flame graph is blocking file I/O; keep it off the event loop.
+                    await asyncio.to_thread(profiler.finish_profile, profile)
+            finally:
+                ticket.release()
+        print("[extract] request done")
+
+    return stream_compression.ndjson_response(
+        stream_until_disconnect(gen(), request=request, deadline=deadline, label="extract"),
+        request=request,
+        label="extract",
+    )
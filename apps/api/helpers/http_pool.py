@@ -0,0 +1,44 @@
+import asyncio
+import os
+from typing import Dict, Optional
+
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "32"))
+
+# One pooled client per purpose so SerpAPI keep-alives are not starved by thumbnail downloads.
+_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+_CLIENTS_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_client(name: str = "default") -> httpx.AsyncClient:
+    """
+    Shared AsyncClient for the running event loop.
+    Callers pass per-request timeouts on each call instead of configuring the client.
+    """
+    global _CLIENTS_LOOP
+    loop = asyncio.get_running_loop()
+    if _CLIENTS_LOOP is not loop:
+        # Clients are bound to the loop that created them (tests, worker processes).
+        _CLIENTS.clear()
+        _CLIENTS_LOOP = loop
+
+    client = _CLIENTS.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            ),
+            follow_redirects=True,
+        )
+        _CLIENTS[name] = client
+    return client
+
+
+async def close_clients() -> None:
+    clients = list(_CLIENTS.values())
+    _CLIENTS.clear()
+    for client in clients:
+        await client.aclose()
@@ -1,11 +1,19 @@
+import importlib.util
 from io import BytesIO
+from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 import asyncio
+import time
+
 import httpx
 from fastapi import HTTPException, UploadFile
 from PIL import Image, UnidentifiedImageError
 
+from helpers import deadline as deadline_budget
+from helpers import embed_batcher, http_pool, metrics, subsystems
+from helpers.deadline import RequestDeadline
+
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
 
 MAIN_CROPS = [1.0, 0.85]
@@ -13,6 +21,7 @@ FAST_CROPS = [1.0]
 EMBED_MAX_INITIAL = 25
 MULTICROP_RERANK_TOP_N = 20
 THUMB_CONCURRENCY = 6
+THUMB_FETCH_TIMEOUT_SEC = 10.0
 
 _CLIP_SERVICE = None
 
@@ -21,15 +30,52 @@ _CLIP_SERVICE = None
 _THUMB_EMBED_CACHE: Dict[str, Dict[str, List[List[float]]]] = {}
 
 
+def load_clip_service_module() -> Any:
+    # clip-service/ is not an importable package name, so load it by path.
+    clip_path = Path(__file__).resolve().parent.parent / "clip-service" / "clip_service.py"
+    spec = importlib.util.spec_from_file_location("api_clip_service", str(clip_path))
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Unable to load clip service module at {clip_path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
 def set_clip_service(clip_service_module: Any) -> None:
     global _CLIP_SERVICE
     _CLIP_SERVICE = clip_service_module
 
 
-def _get_clip_service() -> Any:
-    if _CLIP_SERVICE is None:
-        raise RuntimeError("CLIP service is not initialized. Ensure startup hook sets it.")
-    return _CLIP_SERVICE
+def _init_clip_service() -> Any:
+    # Importing the module pulls in torch/open_clip; warm_model loads weights and runs a dummy inference.
+    clip_service = _CLIP_SERVICE or load_clip_service_module()
+    clip_service.warm_model()
+    set_clip_service(clip_service)
+    return clip_service
+
+
+CLIP = subsystems.Subsystem("clip", _init_clip_service)
+
+
+async def _get_clip_service() -> Any:
+    if _CLIP_SERVICE is not None and CLIP.state == "pending":
+        return _CLIP_SERVICE  # Set directly (worker, benchmarks) without going through warmup.
+    return await CLIP.aget()
+
+
+def thumb_cache_stats() -> Dict[str, int]:
+    vectors = 0
+    floats = 0
+    for bucket in list(_THUMB_EMBED_CACHE.values()):
+        for vecs in bucket.values():
+            vectors += len(vecs)
+            floats += sum(len(v) for v in vecs)
+    # CPython list of floats: 8-byte slot + 24-byte float object per value, ~56 bytes per list.
+    return {
+        "entries": len(_THUMB_EMBED_CACHE),
+        "vectors": vectors,
+        "approx_bytes": floats * 32 + vectors * 56,
+    }
 
 
 def _crops_key(crops: List[float]) -> str:
@@ -78,6 +124,7 @@ async def embed_initial_thumbnails_if_needed(
     active_items: List[dict],
     sold_items: List[dict],
     mode: str,
+    deadline: Optional[RequestDeadline] = None,
 ) -> None:
     if mode in ("active", "both") and active_items:
         await embed_thumbnails_for_items(
@@ -85,6 +132,7 @@ async def embed_initial_thumbnails_if_needed(
             max_items=EMBED_MAX_INITIAL,
             concurrency=THUMB_CONCURRENCY,
             crops=FAST_CROPS,
+            deadline=deadline,
         )
     if mode in ("sold", "both") and sold_items:
         await embed_thumbnails_for_items(
@@ -92,6 +140,7 @@ async def embed_initial_thumbnails_if_needed(
             max_items=EMBED_MAX_INITIAL,
             concurrency=THUMB_CONCURRENCY,
             crops=FAST_CROPS,
+            deadline=deadline,
         )
 
 
@@ -157,61 +206,44 @@ async def embed_thumbnails_for_items(
     *,
     max_items: int = EMBED_MAX_INITIAL,
     concurrency: int = THUMB_CONCURRENCY,
-    batch_size: int = 24,
     crops: Optional[List[float]] = None,
+    deadline: Optional[RequestDeadline] = None,
 ) -> Dict[str, Any]:
     use_crops = crops or MAIN_CROPS
     target_items = items[:max_items]
     sem = asyncio.Semaphore(concurrency)
-
-    async with httpx.AsyncClient() as http:
-        async def download_one(it: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[bytes], Optional[str]]:
-            cache_key = _cache_key_for_item(it)
-            if not cache_key:
-                it["_thumb_embed_status"] = "no_thumbnail"
-                return it, None, None
-
-            cached = _cache_get(cache_key, use_crops)
-            if cached is not None:
-                _apply_embedding_to_item(it, cached, use_crops)
-                it["_thumb_embed_status"] = "ok_cached"
-                return it, None, cache_key
-
-            async with sem:
-                img_bytes = await fetch_image_bytes(it["thumbnail"], http)
-            if img_bytes is None:
-                it["_thumb_embed_status"] = "download_failed"
-                return it, None, cache_key
-            return it, img_bytes, cache_key
-
-        downloaded = await asyncio.gather(*(download_one(it) for it in target_items))
-
-        to_embed_items: List[Dict[str, Any]] = []
-        to_embed_bytes: List[bytes] = []
-        to_embed_keys: List[str] = []
-
-        for it, b, cache_key in downloaded:
-            if b is None:
-                continue
-            if not cache_key:
-                it["_thumb_embed_status"] = "embed_failed"
-                continue
-            to_embed_items.append(it)
-            to_embed_bytes.append(b)
-            to_embed_keys.append(cache_key)
-
-        embeds = await clip_embed_batch_bytes(
-            to_embed_bytes,
-            crops=use_crops,
-            batch_size=batch_size,
-        )
-
-        for it, cache_key, vecs in zip(to_embed_items, to_embed_keys, embeds):
-            if vecs is None:
-                it["_thumb_embed_status"] = "embed_failed"
-                continue
-            _cache_put(cache_key, use_crops, vecs)
-            _apply_embedding_to_item(it, vecs, use_crops)
+    fetch_timeout = deadline.timeout(THUMB_FETCH_TIMEOUT_SEC) if deadline else THUMB_FETCH_TIMEOUT_SEC
+    http = http_pool.get_client("thumbs")
+
+    async def embed_one(it: Dict[str, Any]) -> None:
+        cache_key = _cache_key_for_item(it)
+        if not cache_key:
+            it["_thumb_embed_status"] = "no_thumbnail"
+            return
+
+        cached = _cache_get(cache_key, use_crops)
+        if cached is not None:
+            _apply_embedding_to_item(it, cached, use_crops)
+            it["_thumb_embed_status"] = "ok_cached"
+            metrics.record_cached_call("thumbnail_cdn", cache="hit")
+            return
+
+        async with sem:
+            img_bytes = await fetch_image_bytes(it["thumbnail"], http, timeout=fetch_timeout)
+        if img_bytes is None:
+            it["_thumb_embed_status"] = "download_failed"
+            return
+
+        # Submitted as soon as the download lands; the shared batcher groups it with
+        # other thumbnails (from this and other requests) into one model batch.
+        vecs = (await clip_embed_batch_bytes([img_bytes], crops=use_crops))[0]
+        if vecs is None:
+            it["_thumb_embed_status"] = "embed_failed"
+            return
+        _cache_put(cache_key, use_crops, vecs)
+        _apply_embedding_to_item(it, vecs, use_crops)
+
+    await asyncio.gather(*(embed_one(it) for it in target_items))
 
     counts: Dict[str, int] = {}
     for it in target_items:
@@ -225,24 +257,49 @@ async def enrich_top_items_with_multicrop(
     *,
     top_n: int = MULTICROP_RERANK_TOP_N,
     concurrency: int = THUMB_CONCURRENCY,
-) -> None:
+    deadline: Optional[RequestDeadline] = None,
+    stage: str = "multicrop",
+) -> bool:
+    """
+    Re-embeds the current top items with MAIN_CROPS.
+    Returns False when the time budget forced the enrichment to be skipped.
+    """
+    if deadline is not None:
+        if not deadline.allows(deadline_budget.MULTICROP_MIN_SEC):
+            deadline.degrade(stage, "skipped")
+            return False
+        if not deadline.allows(deadline_budget.MULTICROP_FULL_SEC):
+            top_n = max(1, top_n // 2)
+            deadline.degrade(stage, "shortened", detail=f"top_n={top_n}")
+
     ranked = [it for it in items if it.get("_image_similarity") is not None]
     ranked.sort(key=lambda it: it.get("_image_similarity") or -1.0, reverse=True)
     top_items = ranked[:top_n]
     if not top_items:
-        return
+        return True
     await embed_thumbnails_for_items(
         top_items,
         max_items=top_n,
         concurrency=concurrency,
         crops=MAIN_CROPS,
+        deadline=deadline,
     )
+    return True
 
 
-async def fetch_image_bytes(url: str, http: httpx.AsyncClient) -> Optional[bytes]:
+async def fetch_image_bytes(
+    url: str,
+    http: httpx.AsyncClient,
+    *,
+    timeout: float = THUMB_FETCH_TIMEOUT_SEC,
+) -> Optional[bytes]:
     try:
-        r = await http.get(url, timeout=10.0, follow_redirects=True)
-        r.raise_for_status()
+        with metrics.track_call("thumbnail_cdn") as call:
+            call["key"] = url
+            r = await http.get(url, timeout=timeout, follow_redirects=True)
+            r.raise_for_status()
+            call["bytes_in"] = len(r.content)
+            call["body"] = r.content
         if not r.content or len(r.content) < 50:
             return None
         return r.content
@@ -251,26 +308,19 @@ async def fetch_image_bytes(url: str, http: httpx.AsyncClient) -> Optional[bytes
 
 
 async def clip_embed_bytes(img_bytes: bytes, *, crops: List[float]) -> List[List[float]]:
-    clip_service = _get_clip_service()
-    return await asyncio.to_thread(clip_service.image_bytes_to_embeddings_multicrop, img_bytes, crops)
+    clip_service = await _get_clip_service()
+    start = time.perf_counter()
+    vecs = await asyncio.to_thread(clip_service.image_bytes_to_embeddings_multicrop, img_bytes, crops)
+    metrics.CLIP_BATCH_SECONDS.observe(time.perf_counter() - start, kind="single")
+    metrics.CLIP_BATCH_IMAGES.observe(1, kind="single")
+    return vecs
 
 
 async def clip_embed_batch_bytes(
     images: List[bytes],
     *,
     crops: List[float],
-    batch_size: int = 24,
 ) -> List[Optional[List[List[float]]]]:
-    clip_service = _get_clip_service()
-    out: List[Optional[List[List[float]]]] = []
-
-    for i in range(0, len(images), batch_size):
-        chunk = images[i : i + batch_size]
-        batch_result = await asyncio.to_thread(
-            clip_service.image_bytes_batch_to_embeddings,
-            chunk,
-            crops,
-        )
-        out.extend(batch_result)
-
-    return out
+    clip_service = await _get_clip_service()
+    batcher = embed_batcher.get_batcher(clip_service.image_bytes_batch_to_embeddings)
+    return await batcher.embed(images, crops)
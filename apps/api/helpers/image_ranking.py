@@ -1,5 +1,7 @@
 from typing import Any, Dict, List, Optional
 
+import numpy as np
+
 def _cosine_sim(u: List[float], v: List[float]) -> float:
     """
     Cosine similarity for already-normalized vectors.
@@ -25,6 +27,33 @@ def best_multicrop_similarity(
                 best = s
     return best
 
+def best_similarities(
+    main_vecs: List[List[float]],
+    vec_lists: List[Optional[List[List[float]]]],
+) -> List[Optional[float]]:
+    """
+    best_multicrop_similarity for many candidates in one matrix product.
+    Returns one score per entry of `vec_lists`; None where it has no usable vector.
+    """
+    out: List[Optional[float]] = [None] * len(vec_lists)
+    dim = len(main_vecs[0]) if main_vecs and main_vecs[0] else 0
+    rows: List[List[float]] = []
+    owners: List[int] = []
+    for i, vecs in enumerate(vec_lists):
+        for v in vecs or []:
+            if v and len(v) == dim:
+                rows.append(v)
+                owners.append(i)
+    if not rows:
+        return out
+
+    sims = np.asarray(main_vecs, dtype=np.float32) @ np.asarray(rows, dtype=np.float32).T
+    for owner, sim in zip(owners, sims.max(axis=0).tolist()):
+        if out[owner] is None or sim > out[owner]:
+            out[owner] = sim
+    return out
+
+
 def rerank_items_by_image_similarity(
     items: List[Dict[str, Any]],
     main_vecs: List[List[float]],
@@ -0,0 +1,306 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from helpers import serialization
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+# A running job whose worker has not heartbeated for this long is handed to another worker.
+JOB_STALE_SEC = float(os.getenv("JOB_STALE_SEC", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_RETENTION_SEC = float(os.getenv("JOB_RETENTION_SEC", str(24 * 3600)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_images (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    content_type TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+_INITIALIZED_PATHS: set[str] = set()
+
+FINISHED_STATUSES = ("done", "error")
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    One short-lived connection per call: these functions run in worker threads
+    and may be shared by several processes (web tier + standalone workers).
+    """
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if JOB_DB_PATH not in _INITIALIZED_PATHS:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _INITIALIZED_PATHS.add(JOB_DB_PATH)
+    return conn
+
+
+def enqueue_job(
+    *,
+    main_bytes: bytes,
+    main_content_type: str,
+    extra_bytes: List[bytes],
+    extra_content_types: List[str],
+    params: Dict[str, Any],
+) -> str:
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+            (job_id, json.dumps(params), time.time()),
+        )
+        images = [(main_content_type, main_bytes)] + list(zip(extra_content_types, extra_bytes))
+        conn.executemany(
+            "INSERT INTO job_images (job_id, idx, content_type, data) VALUES (?, ?, ?, ?)",
+            [(job_id, i, ctype, data) for i, (ctype, data) in enumerate(images)],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return job_id
+
+
+def claim_next_job(worker_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Atomically moves the oldest queued job (or a stale running one) to `running`
+    for this worker. Returns the job with its images, or None if the queue is empty.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """
+            UPDATE jobs SET status = 'error', finished_at = ?, result = ?
+            WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?
+            """,
+            (now, json.dumps({"error": "Job abandoned by its worker"}), now - JOB_STALE_SEC, JOB_MAX_ATTEMPTS),
+        )
+        row = conn.execute(
+            """
+            SELECT id, attempts FROM jobs
+            WHERE status = 'queued'
+               OR (status = 'running' AND heartbeat_at < ? AND attempts < ?)
+            ORDER BY created_at
+            LIMIT 1
+            """,
+            (now - JOB_STALE_SEC, JOB_MAX_ATTEMPTS),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        job_id = row["id"]
+        conn.execute(
+            """
+            UPDATE jobs
+            SET status = 'running', worker = ?, attempts = attempts + 1,
+                started_at = ?, heartbeat_at = ?
+            WHERE id = ?
+            """,
+            (worker_id, now, now, job_id),
+        )
+        # A retry keeps the earlier attempt's events and numbers its own after them, so
+        # followers holding a seq from that attempt still receive everything new.
+        next_seq = conn.execute(
+            "SELECT COALESCE(MAX(seq) + 1, 0) FROM job_events WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        conn.execute("COMMIT")
+
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        images = conn.execute(
+            "SELECT content_type, data FROM job_images WHERE job_id = ? ORDER BY idx",
+            (job_id,),
+        ).fetchall()
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    return {
+        "id": job_id,
+        "attempts": job["attempts"],
+        "next_seq": next_seq,
+        "params": json.loads(job["params"]),
+        "main_content_type": images[0]["content_type"],
+        "main_bytes": bytes(images[0]["data"]),
+        "extra_content_types": [r["content_type"] for r in images[1:]],
+        "extra_bytes": [bytes(r["data"]) for r in images[1:]],
+    }
+
+
+def heartbeat(job_id: str, worker_id: str) -> bool:
+    """Refreshes the job's heartbeat; False once another worker has reclaimed it (or it finished)."""
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time(), job_id, worker_id),
+        )
+        return cur.rowcount > 0
+    finally:
+        conn.close()
+
+
+def append_event(job_id: str, worker_id: str, seq: int, line: str) -> bool:
+    """Appends one event if `worker_id` still owns the job; returns False (and writes nothing) otherwise."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time(), job_id, worker_id),
+        )
+        if cur.rowcount == 0:
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute("INSERT INTO job_events (job_id, seq, line) VALUES (?, ?, ?)", (job_id, seq, line))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def finish_job(job_id: str, worker_id: str, *, status: str, result: Optional[Dict[str, Any]] = None) -> bool:
+    """Records the outcome if `worker_id` still owns the job; a reclaimed job is left to its new worker."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(
+            """
+            UPDATE jobs SET status = ?, finished_at = ?, result = ?
+            WHERE id = ? AND worker = ? AND status = 'running'
+            """,
+            (
+                status,
+                time.time(),
+                serialization.dumps(result).decode("utf-8") if result is not None else None,
+                job_id,
+                worker_id,
+            ),
+        )
+        if cur.rowcount == 0:
+            conn.execute("ROLLBACK")
+            return False
+        # Images are only needed to run the job.
+        conn.execute("DELETE FROM job_images WHERE job_id = ?", (job_id,))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        n_events = conn.execute("SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        position = None
+        if row["status"] == "queued":
+            position = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+                (row["created_at"],),
+            ).fetchone()[0]
+    finally:
+        conn.close()
+
+    return {
+        "job_id": row["id"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "queue_position": position,
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "events": n_events,
+        "result": json.loads(row["result"]) if row["result"] else None,
+    }
+
+
+def get_events(job_id: str, *, after_seq: int = -1) -> Tuple[List[Tuple[int, str]], Optional[str]]:
+    """Returns ([(seq, line), ...] with seq > after_seq, current job status)."""
+    conn = _connect()
+    try:
+        status_row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        rows = conn.execute(
+            "SELECT seq, line FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after_seq),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(r["seq"], r["line"]) for r in rows], (status_row["status"] if status_row else None)
+
+
+def queue_depth() -> Dict[str, int]:
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    return {r["status"]: r["n"] for r in rows}
+
+
+def purge_finished_jobs(*, older_than_sec: float = JOB_RETENTION_SEC) -> int:
+    cutoff = time.time() - older_than_sec
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        ids = [
+            r["id"]
+            for r in conn.execute(
+                f"SELECT id FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+                (*FINISHED_STATUSES, cutoff),
+            ).fetchall()
+        ]
+        for table, column in (("job_events", "job_id"), ("job_images", "job_id"), ("jobs", "id")):
+            conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", [(i,) for i in ids])
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return len(ids)
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from openai import OpenAI
+
+from helpers import image_processing, job_queue, stream_compression
+from helpers.deadline import deadline_from_budget
+from helpers.extract_stream_service import (
+    _error_event,
+    _ndjson,
+    normalize_mode,
+    parse_result_view,
+    run_extract_events,
+    validate_image_uploads,
+)
+
+# In-process workers started with the web app; set to 0 when workers run separately (worker.py).
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SEC = float(os.getenv("JOB_POLL_SEC", "0.5"))
+JOB_EVENTS_POLL_SEC = float(os.getenv("JOB_EVENTS_POLL_SEC", "0.25"))
+JOB_PURGE_INTERVAL_SEC = 600.0
+# Well inside JOB_STALE_SEC, so a long stage with no events is never mistaken for a dead worker.
+JOB_HEARTBEAT_SEC = float(os.getenv("JOB_HEARTBEAT_SEC", str(job_queue.JOB_STALE_SEC / 4)))
+
+_WORKER_TASKS: List[asyncio.Task] = []
+_WAKEUP: Optional[asyncio.Event] = None
+
+
+async def submit_job(
+    *,
+    main_image: UploadFile,
+    files: List[UploadFile],
+    itemName: Optional[str],
+    text: Optional[str],
+    mode: str,
+    budget_sec: Optional[float] = None,
+    fields: Optional[str] = None,
+    listing_limit: Optional[int] = None,
+    listing_format: Optional[str] = None,
+) -> Dict[str, Any]:
+    mode = normalize_mode(mode)
+    view = parse_result_view(fields, listing_limit, listing_format)
+    validate_image_uploads(main_image, files)
+    main_bytes, extra_bytes, main_content_type, extra_content_types = await image_processing.read_images(
+        main_image, files
+    )
+    job_id = await asyncio.to_thread(
+        job_queue.enqueue_job,
+        main_bytes=main_bytes,
+        main_content_type=main_content_type,
+        extra_bytes=extra_bytes,
+        extra_content_types=extra_content_types,
+        params={"itemName": itemName, "text": text, "mode": mode, "budget_sec": budget_sec, "view": view},
+    )
+    print(f"[jobs] queued job={job_id} mode={mode}")
+    if _WAKEUP is not None:
+        _WAKEUP.set()
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+    }
+
+
+async def get_job_status(job_id: str) -> Dict[str, Any]:
+    job = await asyncio.to_thread(job_queue.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+async def stream_job_events(job_id: str, *, request: Request, after_seq: int = -1) -> StreamingResponse:
+    """
+    Replays the job's events after `after_seq`, then follows new ones until the job finishes.
+    Clients can attach (or re-attach after a dropped connection) at any point; a
+    retried job keeps numbering after a `retry` event, so `after_seq` stays valid.
+    """
+    job = await get_job_status(job_id)
+
+    async def gen():
+        yield _ndjson(
+            {
+                "type": "job",
+                "job_id": job_id,
+                "status": job["status"],
+                "queue_position": job["queue_position"],
+            }
+        )
+        last_seq = after_seq
+        while True:
+            rows, status = await asyncio.to_thread(job_queue.get_events, job_id, after_seq=last_seq)
+            for seq, line in rows:
+                last_seq = seq
+                yield line
+            # Status is read before the events, so a finished job has no events left to send.
+            if status is None or status in job_queue.FINISHED_STATUSES:
+                break
+            if await request.is_disconnected():
+                break
+            await asyncio.sleep(JOB_EVENTS_POLL_SEC)
+
+    return stream_compression.ndjson_response(gen(), request=request, label="job_events")
+
+
+async def _heartbeat(job_id: str, worker_id: str) -> None:
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SEC)
+        try:
+            owned = await asyncio.to_thread(job_queue.heartbeat, job_id, worker_id)
+        except Exception as e:
+            print(f"[jobs] heartbeat failed for job={job_id}: {e}")
+            continue
+        if not owned:
+            print(f"[jobs] {worker_id} lost job={job_id}")
+            return
+
+
+async def _run_job(job: Dict[str, Any], *, openai_client: OpenAI, worker_id: str) -> None:
+    params = job["params"]
+    deadline = deadline_from_budget(params.get("budget_sec"))
+    t0 = time.time()
+    seq = job["next_seq"]
+    status = "error"
+    result = None
+    if job["attempts"] > 1:
+        # Tells followers that the steps after this start over; earlier events stay in the log.
+        retry = _ndjson({"type": "retry", "attempt": job["attempts"]}).decode("utf-8")
+        if not await asyncio.to_thread(job_queue.append_event, job["id"], worker_id, seq, retry):
+            return
+        seq += 1
+    heartbeat = asyncio.create_task(_heartbeat(job["id"], worker_id))
+    events = run_extract_events(
+        openai_client=openai_client,
+        main_bytes=job["main_bytes"],
+        extra_bytes=job["extra_bytes"],
+        main_content_type=job["main_content_type"],
+        extra_content_types=job["extra_content_types"],
+        itemName=params.get("itemName"),
+        text=params.get("text"),
+        mode=params.get("mode") or "active",
+        deadline=deadline,
+        t0=t0,
+        view=params.get("view"),
+    )
+    try:
+        async for event in events:
+            line = _ndjson(event).decode("utf-8")
+            if not await asyncio.to_thread(job_queue.append_event, job["id"], worker_id, seq, line):
+                # Reclaimed by another worker: its attempt owns the event log now.
+                print(f"[jobs] {worker_id} dropped job={job['id']}: reclaimed by another worker")
+                return
+            seq += 1
+            if event.get("type") == "result":
+                status = "done"
+                result = event["data"]
+            elif event.get("type") == "error":
+                result = event["error"]
+    finally:
+        heartbeat.cancel()
+        await events.aclose()
+    if await asyncio.to_thread(job_queue.finish_job, job["id"], worker_id, status=status, result=result):
+        print(f"[jobs] finished job={job['id']} status={status} in {time.time() - t0:.2f}s")
+
+
+async def run_worker(*, openai_client: OpenAI, worker_id: str, purge: bool = False) -> None:
+    global _WAKEUP
+    if _WAKEUP is None:
+        _WAKEUP = asyncio.Event()
+    wakeup = _WAKEUP
+    last_purge = 0.0
+    print(f"[jobs] worker start: {worker_id}")
+    while True:
+        try:
+            job = await asyncio.to_thread(job_queue.claim_next_job, worker_id)
+        except Exception as e:
+            print(f"[jobs] claim failed on {worker_id}: {e}")
+            await asyncio.sleep(JOB_POLL_SEC)
+            continue
+
+        if job is None:
+            if purge and time.time() - last_purge > JOB_PURGE_INTERVAL_SEC:
+                last_purge = time.time()
+                removed = await asyncio.to_thread(job_queue.purge_finished_jobs)
+                if removed:
+                    print(f"[jobs] purged {removed} finished jobs")
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), JOB_POLL_SEC)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        print(f"[jobs] {worker_id} claimed job={job['id']} attempt={job['attempts']}")
+        try:
+            await _run_job(job, openai_client=openai_client, worker_id=worker_id)
+        except Exception as e:
+            # Failures inside the pipeline are already events; this covers the queue itself.
+            print(f"[jobs] job={job['id']} failed: {e}")
+            try:
+                await asyncio.to_thread(
+                    job_queue.finish_job,
+                    job["id"],
+                    worker_id,
+                    status="error",
+                    result=_error_event(e)["error"],
+                )
+            except Exception:
+                pass
+
+
+def start_workers(*, openai_client: OpenAI, count: int = JOB_WORKERS) -> None:
+    host = socket.gethostname()
+    for i in range(count):
+        worker_id = f"{host}:{os.getpid()}:{i}"
+        _WORKER_TASKS.append(
+            asyncio.create_task(run_worker(openai_client=openai_client, worker_id=worker_id, purge=(i == 0)))
+        )
+
+
+async def stop_workers() -> None:
+    # A job interrupted here stays `running` until JOB_STALE_SEC, then another worker retries it.
+    tasks = list(_WORKER_TASKS)
+    _WORKER_TASKS.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
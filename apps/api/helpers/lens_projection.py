@@ -0,0 +1,149 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Serialized Lens JSON in the discern prompt is trimmed until it fits this many tokens.
+LENS_PROMPT_TOKEN_BUDGET = int(os.getenv("LENS_PROMPT_TOKEN_BUDGET", "1500"))
+# Highest-signal section first (see LENS_ITEM_EXTRACTION_PROMPT); over budget, the tail of the last goes first.
+LENS_SECTION_CAPS = {"exact_matches": 10, "products": 10, "visual_matches": 20}
+# Titles whose word sets overlap at least this much count as the same listing.
+TITLE_DUP_JACCARD = 0.85
+TITLE_MAX_CHARS = 160
+
+_TOKENIZER: Any = None
+# A trailing " - Store" / " | Site" / " at Shop": spaced separator, and no digits in the
+# tail, so hyphenated model numbers and "- 128GB" / "- Size 10" variants stay in the title.
+_TITLE_FLUFF_RE = re.compile(r"\s+(?:[|\-–—]|at)\s+(?:[^\W\d_]|[ .'&]){2,40}$")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _encoding() -> Any:
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        try:
+            import tiktoken
+
+            _TOKENIZER = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _TOKENIZER = False  # Not installed (or no BPE file): fall back to the estimate.
+    return _TOKENIZER
+
+
+def count_tokens(text: str) -> int:
+    """tiktoken count when available, else ~4 characters per token."""
+    enc = _encoding()
+    if enc:
+        return len(enc.encode(text))
+    return (len(text) + 3) // 4
+
+
+def title_words(title: str) -> frozenset:
+    """Lowercased title words, minus a trailing " - Store" / " | Site" suffix."""
+    return frozenset(_WORD_RE.findall(_TITLE_FLUFF_RE.sub("", title.lower())))
+
+
+def _model_tokens(words: frozenset) -> frozenset:
+    return frozenset(w for w in words if any(ch.isdigit() for ch in w))
+
+
+def find_duplicate(words: frozenset, kept: List[frozenset]) -> Optional[int]:
+    """
+    Index of the first kept title at least TITLE_DUP_JACCARD similar, else None.
+    Titles whose digit-bearing words differ (XM4/XM5, 128gb/256gb, size 10/12) never match.
+    """
+    models = _model_tokens(words)
+    for i, other in enumerate(kept):
+        union = len(words | other)
+        if union and len(words & other) / union >= TITLE_DUP_JACCARD and _model_tokens(other) == models:
+            return i
+    return None
+
+
+def _price(item: Dict[str, Any]) -> Optional[str]:
+    price = item.get("price")
+    if isinstance(price, dict):
+        return price.get("value") or (str(price["extracted_value"]) if price.get("extracted_value") is not None else None)
+    return str(price) if price else None
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def project_lens_json(
+    lens_json: Dict[str, Any],
+    *,
+    similarities: Optional[Dict[str, float]] = None,
+    token_budget: int = LENS_PROMPT_TOKEN_BUDGET,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Lens response reduced to what the discern prompt uses: per section, entries of
+    title, source and price (the section is the match type). Near-identical titles
+    collapse into one entry with a `dups` count, so corroboration survives. Entries
+    are ordered by CLIP similarity (`similarities`, keyed by title) where known,
+    sections are capped, then the lowest-priority tail is dropped until the JSON
+    fits `token_budget`. Returns (projection, stats with token counts).
+    """
+    similarities = similarities or {}
+    kept_words: List[frozenset] = []
+    kept_entries: List[Dict[str, Any]] = []
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    entries_before = dupes = 0
+
+    def rank(pair: Tuple[int, Dict[str, Any]]) -> Tuple[bool, float, int]:
+        # Scored entries by similarity; the rest keep Lens order after them.
+        sim = similarities.get((pair[1].get("title") or "").strip())
+        return sim is None, -(sim or 0.0), pair[0]
+
+    for section, cap in LENS_SECTION_CAPS.items():
+        items = [it for it in lens_json.get(section) or [] if isinstance(it, dict)]
+        entries_before += len(items)
+        ranked = sorted(enumerate(items), key=rank)
+        entries: List[Dict[str, Any]] = []
+        for _, item in ranked:
+            title = " ".join((item.get("title") or item.get("name") or "").split())[:TITLE_MAX_CHARS]
+            if not title:
+                continue
+            words = title_words(title)
+            dup_of = find_duplicate(words, kept_words)
+            if dup_of is not None:
+                kept_entries[dup_of]["dups"] = kept_entries[dup_of].get("dups", 1) + 1
+                dupes += 1
+                continue
+            if len(entries) >= cap:
+                continue
+            entry: Dict[str, Any] = {"title": title}
+            if item.get("source"):
+                entry["source"] = item["source"]
+            price = _price(item)
+            if price:
+                entry["price"] = price
+            entries.append(entry)
+            kept_words.append(words)
+            kept_entries.append(entry)
+        if entries:
+            out[section] = entries
+
+    trimmed = 0
+    tokens = count_tokens(_dumps(out))
+    for section in reversed(list(LENS_SECTION_CAPS)):
+        while tokens > token_budget and out.get(section):
+            out[section].pop()
+            trimmed += 1
+            if not out[section]:
+                out.pop(section)
+            tokens = count_tokens(_dumps(out))
+
+    stats = {
+        # As the prompt embedded it before: the full response, default separators.
+        "tokens_before": count_tokens(json.dumps(lens_json, ensure_ascii=False)),
+        "tokens_after": tokens,
+        "token_budget": token_budget,
+        "entries_before": entries_before,
+        "entries_after": sum(len(v) for v in out.values()),
+        "duplicates_merged": dupes,
+        "trimmed_for_budget": trimmed,
+        "tokenizer": "tiktoken" if _encoding() else "estimate",
+    }
+    return out, stats
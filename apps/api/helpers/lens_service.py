@@ -1,39 +1,90 @@
 import asyncio
+import hashlib
 import json
-from typing import Any, Dict, List, Optional
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional
 
 import httpx
-from fastapi import HTTPException, UploadFile
+from fastapi import HTTPException, Request, UploadFile
 from fastapi.responses import JSONResponse
 from openai import OpenAI
 
-from helpers import LLM_Helper, output_builder
-from helpers.marketplace_client import serp_lens_search, serp_search, serp_timeout
-from helpers.r2_storage import upload_uploadfile_and_get_url
+from helpers import (
+    LLM_Helper,
+    call_ledger,
+    http_pool,
+    image_processing,
+    image_ranking,
+    lens_projection,
+    metrics,
+    output_builder,
+    serialization,
+    stream_compression,
+    trace_recorder,
+)
+from helpers.admission import LENS_ADMISSION
+from helpers.deadline import RequestDeadline
+from helpers.extract_stream_service import LLM_TIMEOUT_SEC, validate_image_uploads
+from helpers.marketplace_client import lens_cache_get, serp_lens_search, serp_search, serp_timeout
+from helpers.r2_storage import upload_bytes_and_get_url
 
+LENS_CANDIDATE_LIMIT = 20
+# All candidate downloads run at once; the shared batcher groups them into model batches.
+LENS_ANCHOR_CONCURRENCY = int(os.getenv("LENS_ANCHOR_CONCURRENCY", str(LENS_CANDIDATE_LIMIT)))
+LENS_ANCHOR_CROPS = image_processing.FAST_CROPS
+# Uploaded views searched per request (main image first); each is one Lens call on a cold cache.
+LENS_MAX_VIEWS = int(os.getenv("LENS_MAX_VIEWS", "4"))
 
-async def fetch_google_lens_results(*, image_url: str, q: Optional[str] = None) -> dict:
+
+async def fetch_google_lens_results(*, image_url: str, q: Optional[str] = None, image_sha: Optional[str] = None) -> dict:
     print("[lens] fetch start: google lens")
-    timeout = serp_timeout()
-    async with httpx.AsyncClient(timeout=timeout) as http:
-        out = await serp_lens_search(http, image_url=image_url, q=q)
+    # Pooled: parallel view searches reuse SerpAPI keep-alive connections instead of a TLS handshake each.
+    http = http_pool.get_client("serp")
+    out = await serp_lens_search(http, image_url=image_url, q=q, image_sha=image_sha, timeout=serp_timeout())
     print("[lens] fetch done: google lens")
     return out
 
 
-async def gpt_discern_item_from_lens(*, openai_client: OpenAI, lens_json: Dict[str, Any]) -> Dict[str, Any]:
+async def gpt_discern_item_from_lens(
+    *,
+    openai_client: OpenAI,
+    lens_json: Dict[str, Any],
+    anchor_title: Optional[str] = None,
+    candidates: Optional[List[Dict[str, Any]]] = None,
+    deadline: Optional[RequestDeadline] = None,
+) -> Dict[str, Any]:
+    # Not called by any route yet: the lens endpoint returns ranked candidates for the
+    # client to pick from, so this (and the Lens JSON projection) only runs when wired in.
     print("[lens] gpt discern start")
+    # Scored candidates (score_lens_candidates) order the projected entries by CLIP similarity.
+    similarities = {c["title"]: c["similarity"] for c in candidates or [] if c.get("similarity") is not None}
+    projected, projection_stats = lens_projection.project_lens_json(lens_json, similarities=similarities)
+    print(
+        f"[lens] projection: tokens {projection_stats['tokens_before']} -> {projection_stats['tokens_after']} "
+        f"entries {projection_stats['entries_before']} -> {projection_stats['entries_after']} "
+        f"({projection_stats['tokenizer']})"
+    )
     prompt = LLM_Helper.LENS_ITEM_EXTRACTION_PROMPT.replace(
+        "{{ANCHOR_TITLE}}",
+        anchor_title or "(none)",
+    ).replace(
         "{{LENS_JSON}}",
-        json.dumps(lens_json, ensure_ascii=False),
+        json.dumps(projected, ensure_ascii=False, separators=(",", ":")),
     )
 
     try:
-        resp = openai_client.responses.create(
-            model="gpt-4.1-mini",
-            input=prompt,
-            temperature=0.0,
-        )
+        with metrics.track_call("openai") as call:
+            call["bytes_out"] = len(prompt.encode("utf-8"))
+            resp = await asyncio.to_thread(
+                openai_client.responses.create,
+                model="gpt-4.1-mini",
+                input=prompt,
+                temperature=0.0,
+                timeout=deadline.timeout(LLM_TIMEOUT_SEC) if deadline is not None else LLM_TIMEOUT_SEC,
+            )
+            call.update(metrics.openai_usage(resp))
+            call["body"] = (resp.output_text or "").encode("utf-8")
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -52,23 +103,25 @@ async def gpt_discern_item_from_lens(*, openai_client: OpenAI, lens_json: Dict[s
             },
         )
     print("[lens] gpt discern done")
+    if isinstance(item_data, dict):
+        item_data["lens_projection"] = projection_stats
     return item_data
 
 
 async def fetch_serp_results_lens(*, query: str, mode: str):
     print(f"[lens] serp fetch start: mode={mode}")
     timeout = serp_timeout()
-    async with httpx.AsyncClient(timeout=timeout) as http:
-        tasks = []
-        if mode in ("active", "both"):
-            tasks.append(("active", serp_search(http, q=query, sold=False)))
-        if mode in ("sold", "both"):
-            tasks.append(("sold", serp_search(http, q=query, sold=True)))
-
-        out = {"active": None, "sold": None}
-        results = await asyncio.gather(*(t[1] for t in tasks))
-        for (kind, _), res in zip(tasks, results):
-            out[kind] = res
+    http = http_pool.get_client("serp")
+    tasks = []
+    if mode in ("active", "both"):
+        tasks.append(("active", serp_search(http, q=query, sold=False, timeout=timeout)))
+    if mode in ("sold", "both"):
+        tasks.append(("sold", serp_search(http, q=query, sold=True, timeout=timeout)))
+
+    out = {"active": None, "sold": None}
+    results = await asyncio.gather(*(t[1] for t in tasks))
+    for (kind, _), res in zip(tasks, results):
+        out[kind] = res
 
     print("[lens] serp fetch done")
     return out["active"], out["sold"]
@@ -90,6 +143,53 @@ ANCHOR_TITLE:
     return anchor_block + "\n\n" + base
 
 
+def merge_view_candidates(view_results: List[Dict[str, Any]], *, limit: int = LENS_CANDIDATE_LIMIT) -> List[Dict[str, Any]]:
+    """
+    One candidate list from every view's Lens matches. A listing found from several
+    views (same image URL or link, else a near-identical title with the same model
+    numbers) is kept once, with `views` naming them and `votes` counting them; more
+    votes rank first, then the best Lens rank.
+    """
+    merged: List[Dict[str, Any]] = []
+    kept_words: List[frozenset] = []
+    by_image: Dict[str, int] = {}
+    by_link: Dict[str, int] = {}
+    for res in view_results:
+        # Only match entries from other views, so one view's own list stays as Lens built it.
+        other_views = [w if res["view"] not in e["views"] else frozenset() for w, e in zip(kept_words, merged)]
+        for rank, c in enumerate(res["candidates"]):
+            words = lens_projection.title_words(c["title"])
+            i = None
+            for index, key in ((by_image, c["image"]), (by_link, c.get("link"))):
+                j = index.get(key) if key else None
+                if j is not None and res["view"] not in merged[j]["views"]:
+                    i = j
+                    break
+            if i is None:
+                i = lens_projection.find_duplicate(words, other_views)
+            if i is None:
+                i = len(merged)
+                merged.append({**c, "views": [], "lens_rank": rank})
+                kept_words.append(words)
+                by_image.setdefault(c["image"], i)
+                if c.get("link"):
+                    by_link.setdefault(c["link"], i)
+            entry = merged[i]
+            if res["view"] not in entry["views"]:
+                entry["views"].append(res["view"])
+            if i < len(other_views):
+                other_views[i] = frozenset()  # Claimed by this view now.
+            entry["lens_rank"] = min(entry["lens_rank"], rank)
+
+    for entry in merged:
+        entry["votes"] = len(entry["views"])
+    merged.sort(key=lambda c: (-c["votes"], c["lens_rank"]))
+    out = merged[:limit]
+    for n, c in enumerate(out):
+        c["id"] = f"lens_{n}"
+    return out
+
+
 def build_lens_candidates(lens_json: Dict[str, Any], *, limit: int = 20) -> List[Dict[str, Any]]:
     print(f"[lens] build candidates start: limit={limit}")
     candidates: List[Dict[str, Any]] = []
@@ -130,37 +230,271 @@ def build_lens_candidates(lens_json: Dict[str, Any], *, limit: int = 20) -> List
     return out
 
 
-async def build_extract_file_stream_lens_guided_response(
+async def score_lens_candidates(
+    candidates: List[Dict[str, Any]],
     *,
-    main_image: UploadFile,
-    files: List[UploadFile],
-    text: Optional[str],
-) -> JSONResponse:
-    print("[lens] request start")
+    main_vecs: Awaitable[List[List[float]]],
+) -> Dict[str, Any]:
+    """
+    Embeds every candidate image (through the thumbnail embedding cache, keyed by
+    image URL) while `main_vecs` finishes, sets candidate["similarity"] and sorts
+    candidates best-first. The most similar candidate is the ANCHOR_TITLE.
+    """
+    print(f"[lens] anchor scoring start: candidates={len(candidates)}")
+    started = time.perf_counter()
+    items = [{"thumbnail": c["image"]} for c in candidates]
+    vecs, embed_stats = await asyncio.gather(
+        main_vecs,
+        image_processing.embed_thumbnails_for_items(
+            items,
+            max_items=len(items),
+            concurrency=LENS_ANCHOR_CONCURRENCY,
+            crops=LENS_ANCHOR_CROPS,
+        ),
+    )
+    sims = image_ranking.best_similarities(vecs, [it.get("_thumb_embedding") for it in items])
+    for c, sim in zip(candidates, sims):
+        c["similarity"] = round(sim, 4) if sim is not None else None
+    # Listings found from more views rank first; similarity orders within a vote count.
+    candidates.sort(
+        key=lambda c: (c.get("votes", 1), c["similarity"] if c["similarity"] is not None else -2.0),
+        reverse=True,
+    )
+
+    scored = [c for c in candidates if c["similarity"] is not None]
+    anchor = max(scored, key=lambda c: c["similarity"]) if scored else None
+    stats = {
+        "scored": sum(1 for s in sims if s is not None),
+        "status_counts": embed_stats["status_counts"],
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+    }
+    print(
+        f"[lens] anchor scoring done: scored={stats['scored']}/{len(candidates)} "
+        f"best={anchor['similarity'] if anchor else None} elapsed={stats['elapsed_sec']}s"
+    )
+    return {"anchor": anchor, "stats": stats}
+
+
+def _lens_http_error(e: Exception) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, httpx.TimeoutException):
+        return HTTPException(status_code=504, detail={"error": "Timeout during Google Lens query", "detail": str(e)})
+    if isinstance(e, httpx.HTTPError):
+        return HTTPException(status_code=502, detail={"error": "HTTP error during Google Lens query", "detail": str(e)})
+    return HTTPException(status_code=500, detail={"error": "Unhandled server error", "detail": str(e)})
+
+
+def _error_event(e: HTTPException) -> Dict[str, Any]:
+    return {"type": "error", "error": e.detail if isinstance(e.detail, dict) else {"error": str(e.detail)}}
+
+
+async def _read_views(main_image: UploadFile, files: List[UploadFile]) -> List[Dict[str, Any]]:
+    """
+    Reads and normalizes each view (see image_processing.read_images); only the
+    normalized bytes and content type are uploaded to public storage or embedded.
+    """
+    uploads = [main_image, *files]
+    if len(uploads) > LENS_MAX_VIEWS:
+        print(f"[lens] {len(uploads)} views uploaded, searching the first {LENS_MAX_VIEWS}")
+        uploads = uploads[:LENS_MAX_VIEWS]
+
+    async def read(index: int, upload: UploadFile) -> Dict[str, Any]:
+        raw = await upload.read()
+        # Conversion of non-web formats is PIL work; keep it off the event loop.
+        data, content_type = await asyncio.to_thread(image_processing._normalize_image_bytes, raw, upload.content_type)
+        return {
+            "index": index,
+            "data": data,
+            "sha": hashlib.sha256(data).hexdigest(),
+            "content_type": content_type,
+            "filename": upload.filename,
+        }
+
+    return list(await asyncio.gather(*(read(i, u) for i, u in enumerate(uploads))))
+
+
+async def _embed_views(views: List[Dict[str, Any]], phases: Dict[str, float]) -> List[List[float]]:
+    """Crop embeddings of every view; a candidate scores by its best match to any of them."""
+    started = time.perf_counter()
+
+    per_view = await asyncio.gather(*(image_processing.embed_main_image(v["data"]) for v in views), return_exceptions=True)
+    phases["main_embed"] = round(time.perf_counter() - started, 3)
+    errors = [r for r in per_view if isinstance(r, BaseException)]
+    if len(errors) == len(per_view):
+        raise errors[0]
+    if errors:
+        print(f"[lens] {len(errors)} view(s) failed to embed: {errors[0]}")
+    return [vec for vecs in per_view if not isinstance(vecs, BaseException) for vec in vecs]
+
+
+async def _search_view(view: Dict[str, Any], q: Optional[str]) -> Dict[str, Any]:
+    """Lens candidates for one view: cache, else upload then search. Errors come back as a result."""
+    started = time.perf_counter()
+    out: Dict[str, Any] = {"view": view["index"]}
+    try:
+        cached = lens_cache_get(view["sha"], q)
+        if cached is not None:
+            # Same photo and query as a recent lookup: no upload and no Lens call.
+            image_url, lens_json = cached
+        else:
+            image_url = await upload_bytes_and_get_url(
+                view["data"],
+                content_type=view["content_type"],
+                filename=view["filename"],
+                prefix="tmp",
+            )
+            out["upload_sec"] = round(time.perf_counter() - started, 3)
+            lens_json = await fetch_google_lens_results(image_url=image_url, q=q, image_sha=view["sha"])
+            out["lens_sec"] = round(time.perf_counter() - started - out["upload_sec"], 3)
+        out.update(
+            image_url=image_url,
+            cached=cached is not None,
+            candidates=build_lens_candidates(lens_json, limit=LENS_CANDIDATE_LIMIT),
+        )
+    except Exception as e:
+        out["exception"] = _lens_http_error(e)
+    out["elapsed_sec"] = round(time.perf_counter() - started, 3)
+    return out
+
+
+def _view_summary(res: Dict[str, Any]) -> Dict[str, Any]:
+    if "exception" in res:
+        return {"view": res["view"], "error": _error_event(res["exception"])["error"], "elapsed_sec": res["elapsed_sec"]}
+    summary = {k: v for k, v in res.items() if k != "candidates"}
+    summary["candidates"] = len(res["candidates"])
+    return summary
+
+
+async def _lens_events(views: List[Dict[str, Any]], text: Optional[str], started: float) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Searches every view at once (each through the Lens cache and the SerpAPI limiter)
+    while the views are embedded. Yields a "view" event as each search finishes, then
+    one "result" event with the merged, scored candidates, so the request costs the
+    slowest view rather than the sum. Fails only if every view's search failed.
+    """
+    phases: Dict[str, float] = {"read": round(time.perf_counter() - started, 3)}
+    lens_query = text.strip() if text and text.strip() else None
+    embed_task = asyncio.create_task(_embed_views(views, phases))
+    search_tasks = [asyncio.create_task(_search_view(v, lens_query)) for v in views]
+    mark = time.perf_counter()
     try:
-        print("[lens] upload start")
-        image_url = await upload_uploadfile_and_get_url(main_image, prefix="tmp")
-        print("[lens] upload done")
+        results: List[Dict[str, Any]] = []
+        for next_done in asyncio.as_completed(search_tasks):
+            res = await next_done
+            results.append(res)
+            summary = _view_summary(res)
+            print(f"[lens] view {res['view']} done: {summary}")
+            yield {"type": "view", **summary, "candidates": res.get("candidates", [])}
+        phases["lens_views"] = round(time.perf_counter() - mark, 3)
+        mark = time.perf_counter()
 
-        lens_query = text.strip() if text and text.strip() else None
-        lens_json_full = await fetch_google_lens_results(image_url=image_url, q=lens_query)
-        candidates = build_lens_candidates(lens_json_full, limit=20)
+        ok = sorted((r for r in results if "exception" not in r), key=lambda r: r["view"])
+        if not ok:
+            raise min(results, key=lambda r: r["view"])["exception"]
+        candidates = merge_view_candidates(ok)
         if not candidates:
             raise HTTPException(status_code=400, detail={"error": "No usable Google Lens matches"})
 
-        print("[lens] request done")
-        return JSONResponse(
-            {
-                "image_url": image_url,
+        try:
+            scoring = await score_lens_candidates(candidates, main_vecs=embed_task)
+        except HTTPException as e:
+            if e.status_code != 503:
+                raise
+            # CLIP unavailable: votes and Lens order still rank, just without an anchor.
+            print(f"[lens] anchor scoring skipped: {e.detail}")
+            scoring = {"anchor": None, "stats": {"skipped": str(e.detail)}}
+        phases["anchor_scoring"] = round(time.perf_counter() - mark, 3)
+        phases["total"] = round(time.perf_counter() - started, 3)
+        for name, seconds in phases.items():
+            metrics.LENS_PHASE_SECONDS.observe(seconds, phase=name)
+
+        print(f"[lens] request done: views={len(ok)}/{len(views)} phases={phases}")
+        main = next((r for r in ok if r["view"] == 0), None)
+        yield {
+            "type": "result",
+            "data": {
+                "image_url": main["image_url"] if main else None,
                 "total": len(candidates),
+                "lens_cached": all(r["cached"] for r in ok),
+                "views": [_view_summary(r) for r in sorted(results, key=lambda r: r["view"])],
+                "anchor_title": scoring["anchor"]["title"] if scoring["anchor"] else None,
+                "anchor_scoring": scoring["stats"],
+                "phase_timings_sec": phases,
                 "candidates": candidates,
-            }
-        )
-    except HTTPException:
-        raise
-    except httpx.TimeoutException as e:
-        raise HTTPException(status_code=504, detail={"error": "Timeout during Google Lens query", "detail": str(e)})
-    except httpx.HTTPError as e:
-        raise HTTPException(status_code=502, detail={"error": "HTTP error during Google Lens query", "detail": str(e)})
+            },
+        }
     except Exception as e:
-        raise HTTPException(status_code=500, detail={"error": "Unhandled server error", "detail": str(e)})
+        raise _lens_http_error(e)
+    finally:
+        for task in search_tasks:
+            task.cancel()
+        if not embed_task.done():
+            embed_task.cancel()
+        elif not embed_task.cancelled():
+            embed_task.exception()  # Mark retrieved when the request failed before scoring.
+
+
+async def _traced_lens_events(
+    views: List[Dict[str, Any]],
+    text: Optional[str],
+    started: float,
+    request: Optional[Request],
+) -> AsyncIterator[Dict[str, Any]]:
+    trace = trace_recorder.maybe_start_trace(request, flow="lens")
+    if trace is None:
+        async for event in _lens_events(views, text, started):
+            yield event
+        return
+
+    trace.set_inputs(images=[v["data"] for v in views], content_types=[v["content_type"] for v in views], text=text)
+    ledger, ledger_token = call_ledger.start_ledger(None, capture=True)
+    outcome = "error"
+    try:
+        async for event in _lens_events(views, text, started):
+            yield event
+        outcome = "ok"
+    finally:
+        trace.finish(ledger=ledger, deadline=None, outcome=outcome)
+        call_ledger.end_ledger(ledger_token)
+
+
+async def build_extract_file_stream_lens_guided_response(
+    *,
+    main_image: UploadFile,
+    files: List[UploadFile],
+    text: Optional[str],
+    request: Optional[Request] = None,
+    stream: bool = False,
+):
+    """
+    Lens candidates for the main image and every extra view. By default one JSON body
+    once everything is merged; with `stream`, NDJSON "view" events as each view's
+    search lands, then the "result" event (the JSON body) or an "error" event.
+    """
+    print("[lens] request start")
+    started = time.perf_counter()
+    validate_image_uploads(main_image, files)
+    views = await _read_views(main_image, files)
+
+    if not stream:
+        result: Dict[str, Any] = {}
+        async with LENS_ADMISSION.slot():
+            # Drained to the end so the trace and ledger close before responding.
+            async for event in _traced_lens_events(views, text, started, request):
+                if event["type"] == "result":
+                    result = event["data"]
+        return JSONResponse(result)
+
+    # Shed load before the stream starts so overloaded callers get a real 429 + Retry-After.
+    LENS_ADMISSION.check()
+
+    async def gen():
+        try:
+            async with LENS_ADMISSION.slot():
+                async for event in _traced_lens_events(views, text, started, request):
+                    yield serialization.ndjson_line(event)
+        except HTTPException as e:
+            yield serialization.ndjson_line(_error_event(e))
+
+    return stream_compression.ndjson_response(gen(), request=request, label="lens")
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from helpers import metrics
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "0") == "1"
+LOOP_MONITOR_INTERVAL_SEC = float(os.getenv("LOOP_MONITOR_INTERVAL_SEC", "0.1"))
+LOOP_STALL_THRESHOLD_SEC = float(os.getenv("LOOP_STALL_THRESHOLD_SEC", "0.25"))
+LOOP_STALL_HISTORY = 50
+STACK_DEPTH = 15
+
+_API_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _stall_site(stack: List[traceback.FrameSummary]) -> str:
+    """Innermost frame in our own code (helpers/, main.py, clip-service), else the innermost frame."""
+    for frame in reversed(stack):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(_API_ROOT) and "site-packages" not in path:
+            return f"{os.path.basename(path)}:{frame.name}"
+    if stack:
+        return f"{os.path.basename(stack[-1].filename)}:{stack[-1].name}"
+    return "unknown"
+
+
+class LoopMonitor:
+    """
+    Measures event loop scheduling delay with a short sleep loop, and runs a watchdog
+    thread that grabs the loop thread's stack once a tick is overdue by the threshold.
+    When the loop catches up, the stall is recorded with that stack, so blocking calls
+    (sync SDK calls, PIL work, pure-Python ranking) show up by call site.
+    """
+
+    def __init__(self, *, interval_sec: float, threshold_sec: float):
+        self.interval_sec = interval_sec
+        self.threshold_sec = threshold_sec
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=LOOP_STALL_HISTORY)
+        self._tick = 0
+        self._tick_started = time.monotonic()
+        self._captured: Tuple[int, Optional[List[traceback.FrameSummary]]] = (-1, None)
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._tick_started = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+        print(f"[loop] monitor start: interval={self.interval_sec}s threshold={self.threshold_sec}s")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._tick += 1
+            tick = self._tick
+            self._tick_started = time.monotonic()
+            await asyncio.sleep(self.interval_sec)
+            lag = max(0.0, time.monotonic() - self._tick_started - self.interval_sec)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self.threshold_sec:
+                captured_tick, stack = self._captured
+                self._record_stall(lag, stack if captured_tick == tick else None)
+
+    def _watch(self) -> None:
+        poll = max(0.01, min(self.interval_sec, self.threshold_sec / 2))
+        while not self._stop.wait(poll):
+            tick = self._tick
+            overdue = time.monotonic() - self._tick_started - self.interval_sec
+            if overdue < self.threshold_sec or self._captured[0] == tick:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.extract_stack(frame) if frame is not None else None
+            self._captured = (tick, stack)
+
+    def _record_stall(self, lag: float, stack: Optional[List[traceback.FrameSummary]]) -> None:
+        site = _stall_site(stack) if stack else "unknown"
+        metrics.LOOP_STALLS.inc(site=site)
+        metrics.LOOP_STALL_SECONDS.observe(lag, site=site)
+        frames = traceback.format_list(stack[-STACK_DEPTH:]) if stack else []
+        self.stalls.append(
+            {
+                "at": time.time(),
+                "duration_sec": round(lag, 3),
+                "site": site,
+                "stack": [f.rstrip() for f in frames],
+            }
+        )
+        print(f"[loop] stall {lag:.3f}s at {site}")
+        for line in frames[-5:]:
+            print(f"[loop]   {line.strip().splitlines()[0]}")
+
+
+_MONITOR: Optional[LoopMonitor] = None
+
+
+def start_loop_monitor() -> Optional[LoopMonitor]:
+    global _MONITOR
+    if not LOOP_MONITOR_ENABLED or _MONITOR is not None:
+        return _MONITOR
+    _MONITOR = LoopMonitor(interval_sec=LOOP_MONITOR_INTERVAL_SEC, threshold_sec=LOOP_STALL_THRESHOLD_SEC)
+    _MONITOR.start()
+    return _MONITOR
+
+
+async def stop_loop_monitor() -> None:
+    global _MONITOR
+    if _MONITOR is not None:
+        await _MONITOR.stop()
+        _MONITOR = None
+
+
+def recent_stalls(limit: int = LOOP_STALL_HISTORY) -> List[Dict[str, Any]]:
+    """Newest first, each with the loop thread's stack at the time of the stall."""
+    stalls = list(_MONITOR.stalls) if _MONITOR is not None else []
+    return stalls[::-1][: max(0, limit)]
@@ -1,29 +1,177 @@
+import asyncio
+import json
 import os
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 from fastapi import HTTPException
 
+from helpers import metrics
+from helpers.deadline import RequestDeadline
 
-SERPAPI_ENDPOINT = "https://serpapi.com/search.json"
 
+SERPAPI_ENDPOINT = os.getenv("SERPAPI_ENDPOINT", "https://serpapi.com/search.json")
+SERP_CACHE_TTL_SEC = int(os.getenv("SERP_CACHE_TTL_SEC", "600"))
+SERP_CACHE_MAX_ENTRIES = int(os.getenv("SERP_CACHE_MAX_ENTRIES", "512"))
 
-def serp_timeout() -> httpx.Timeout:
-    return httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=5.0)
+# Keyed by (normalized query, sold). Raw response bytes are stored so every caller
+# gets its own parsed dict: the pipeline annotates and sorts items in place.
+_SERP_CACHE: Dict[Tuple[str, bool], Tuple[float, bytes]] = {}
+# Identical searches already on the wire: key -> [task, waiter count].
+_SERP_INFLIGHT: Dict[Tuple[str, bool], List[Any]] = {}
 
+# Lens results for a photo barely change within the hour; keep this at or below the
+# R2 object lifetime, since a hit reuses the image URL from the original upload.
+LENS_CACHE_TTL_SEC = int(os.getenv("LENS_CACHE_TTL_SEC", "3600"))
+LENS_CACHE_MAX_ENTRIES = int(os.getenv("LENS_CACHE_MAX_ENTRIES", "256"))
+# Keyed by (image sha256, normalized q): (expires_at, image url, raw response bytes).
+_LENS_CACHE: Dict[Tuple[str, str], Tuple[float, str, bytes]] = {}
+# Process-wide cap on concurrent Lens searches (multi-view requests fan out).
+SERPAPI_LENS_CONCURRENCY = int(os.getenv("SERPAPI_LENS_CONCURRENCY", "8"))
+_LENS_LIMITER: Optional[asyncio.Semaphore] = None
 
-async def serp_search(http: httpx.AsyncClient, *, q: str, sold: bool) -> dict:
+
+def serp_cache_stats() -> Dict[str, int]:
+    return {
+        "entries": len(_SERP_CACHE),
+        "approx_bytes": sum(len(content) for _, content in list(_SERP_CACHE.values())),
+        "inflight": len(_SERP_INFLIGHT),
+    }
+
+
+def lens_cache_stats() -> Dict[str, int]:
+    return {
+        "entries": len(_LENS_CACHE),
+        "approx_bytes": sum(len(content) for _, _, content in list(_LENS_CACHE.values())),
+    }
+
+
+def serp_timeout(deadline: Optional[RequestDeadline] = None) -> httpx.Timeout:
+    if deadline is None:
+        return httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=5.0)
+    return httpx.Timeout(
+        connect=deadline.timeout(5.0),
+        read=deadline.timeout(30.0),
+        write=deadline.timeout(10.0),
+        pool=deadline.timeout(5.0),
+    )
+
+
+def _serp_cache_key(q: str, sold: bool) -> Tuple[str, bool]:
+    return " ".join((q or "").lower().split()), bool(sold)
+
+
+def serp_trace_key(q: str, sold: bool) -> str:
+    norm, sold = _serp_cache_key(q, sold)
+    return f"{norm}|{'sold' if sold else 'active'}"
+
+
+def _bounded_put(cache: Dict[Any, Tuple], max_entries: int, key: Any, entry: Tuple) -> None:
+    # entry[0] is the expiry time; expired entries go first, then the oldest.
+    if len(cache) >= max_entries:
+        now = time.time()
+        for k in [k for k, e in cache.items() if e[0] <= now]:
+            cache.pop(k, None)
+    while cache and len(cache) >= max_entries:
+        cache.pop(next(iter(cache)))
+    if max_entries > 0:
+        cache[key] = entry
+
+
+def _serp_cache_put(key: Tuple[str, bool], content: bytes) -> None:
+    _bounded_put(_SERP_CACHE, SERP_CACHE_MAX_ENTRIES, key, (time.time() + SERP_CACHE_TTL_SEC, content))
+
+
+def _lens_cache_key(image_sha: str, q: Optional[str]) -> Tuple[str, str]:
+    return image_sha, " ".join((q or "").lower().split())
+
+
+def lens_cache_get(image_sha: str, q: Optional[str]) -> Optional[Tuple[str, dict]]:
+    """(image url, Lens response) from an earlier lookup of the same photo and `q`, if still fresh."""
+    cached = _LENS_CACHE.get(_lens_cache_key(image_sha, q))
+    if cached is None or cached[0] <= time.time():
+        return None
+    metrics.record_cached_call("serpapi_lens", cache="hit", key=image_sha, body=cached[2])
+    return cached[1], json.loads(cached[2])
+
+
+async def _fetch_serp_bytes(
+    http: httpx.AsyncClient,
+    params: Dict[str, Any],
+    timeout: Optional[httpx.Timeout],
+) -> bytes:
+    with metrics.track_call("serpapi") as call:
+        call["cache"] = "miss"
+        call["key"] = serp_trace_key(params["_nkw"], "show_only" in params)
+        if timeout is not None:
+            r = await http.get(SERPAPI_ENDPOINT, params=params, timeout=timeout)
+        else:
+            r = await http.get(SERPAPI_ENDPOINT, params=params)
+        r.raise_for_status()
+        call["bytes_in"] = len(r.content)
+        call["body"] = r.content
+    return r.content
+
+
+async def serp_search(
+    http: httpx.AsyncClient,
+    *,
+    q: str,
+    sold: bool,
+    timeout: Optional[httpx.Timeout] = None,
+) -> dict:
     api_key = os.getenv("SERPAPI_API_KEY")
     if not api_key:
         raise HTTPException(status_code=500, detail="SERPAPI_API_KEY is not set")
 
+    key = _serp_cache_key(q, sold)
+    cached = _SERP_CACHE.get(key)
+    if cached is not None and cached[0] > time.time():
+        metrics.SERP_CACHE_LOOKUPS.inc(result="hit")
+        metrics.record_cached_call("serpapi", cache="hit", key=serp_trace_key(q, sold), body=cached[1])
+        return json.loads(cached[1])
+
     params = {"engine": "ebay", "_nkw": q, "_ipg": 50, "api_key": api_key}
     if sold:
         params["show_only"] = "Sold"
 
-    r = await http.get(SERPAPI_ENDPOINT, params=params)
-    r.raise_for_status()
-    return r.json()
+    # Concurrent requests for the same search (batch items, parallel users) share one call.
+    inflight = _SERP_INFLIGHT.get(key)
+    if inflight is not None and inflight[0].cancelled():
+        inflight = None  # Cancelled by its last caller; `_done` has not run yet.
+    metrics.SERP_CACHE_LOOKUPS.inc(result="miss" if inflight is None else "shared")
+    if inflight is not None:
+        metrics.record_cached_call("serpapi", cache="shared", key=serp_trace_key(q, sold))
+    if inflight is None:
+        task = asyncio.ensure_future(_fetch_serp_bytes(http, params, timeout))
+        inflight = [task, 0]
+        _SERP_INFLIGHT[key] = inflight
+
+        def _done(t: asyncio.Task, key: Tuple[str, bool] = key) -> None:
+            if _SERP_INFLIGHT.get(key, [None])[0] is t:
+                _SERP_INFLIGHT.pop(key, None)
+            if not t.cancelled() and t.exception() is None:
+                _serp_cache_put(key, t.result())
+
+        task.add_done_callback(_done)
+
+    task = inflight[0]
+    inflight[1] += 1
+    try:
+        content = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # Last interested caller went away: stop the shared call too.
+        if inflight[1] == 1 and not task.done():
+            # Unlisted first, so a caller arriving before `_done` runs starts a fresh call
+            # instead of joining one that will raise CancelledError into it.
+            if _SERP_INFLIGHT.get(key) is inflight:
+                _SERP_INFLIGHT.pop(key, None)
+            task.cancel()
+        raise
+    finally:
+        inflight[1] -= 1
+    return json.loads(content)
 
 
 def extract_items(serp_json: Optional[dict]) -> list[dict]:
@@ -38,7 +186,10 @@ async def serp_lens_search(
     image_url: str,
     type: str = "all",
     q: str | None = None,
+    image_sha: str | None = None,
+    timeout: Optional[httpx.Timeout] = None,
 ) -> dict:
+    """Google Lens via SerpAPI; with `image_sha` the response is cached for lens_cache_get."""
     api_key = os.getenv("SERPAPI_API_KEY")
     if not api_key:
         raise HTTPException(status_code=500, detail="SERPAPI_API_KEY is not set")
@@ -52,6 +203,20 @@ async def serp_lens_search(
     if q:
         params["q"] = q
 
-    r = await http.get(SERPAPI_ENDPOINT, params=params)
-    r.raise_for_status()
+    global _LENS_LIMITER
+    if _LENS_LIMITER is None:
+        _LENS_LIMITER = asyncio.Semaphore(SERPAPI_LENS_CONCURRENCY)
+    async with _LENS_LIMITER:
+        with metrics.track_call("serpapi_lens") as call:
+            call["key"] = image_sha
+            if timeout is not None:
+                r = await http.get(SERPAPI_ENDPOINT, params=params, timeout=timeout)
+            else:
+                r = await http.get(SERPAPI_ENDPOINT, params=params)
+            r.raise_for_status()
+            call["bytes_in"] = len(r.content)
+            call["body"] = r.content
+    if image_sha and type == "all":
+        key = _lens_cache_key(image_sha, q)
+        _bounded_put(_LENS_CACHE, LENS_CACHE_MAX_ENTRIES, key, (time.time() + LENS_CACHE_TTL_SEC, image_url, r.content))
     return r.json()
@@ -0,0 +1,187 @@
+import os
+import random
+import resource
+import threading
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from helpers import metrics
+from helpers.deadline import RequestDeadline
+
+# Fraction of pipeline runs whose per-stage peak allocation is measured (0.01 = 1%).
+MEMORY_STAGE_SAMPLE_RATE = float(os.getenv("MEMORY_STAGE_SAMPLE_RATE", "0"))
+# Frames kept per allocation for heap snapshots; 1 is cheapest, more gives call paths.
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+HEAP_DIFF_LIMIT = 25
+
+ALLOC_BUCKETS = tuple(float(2**n) for n in range(16, 32, 2))  # 64 KiB .. 1 GiB
+
+STAGE_PEAK_ALLOC_BYTES = metrics.Histogram(
+    "thriftbuddy_stage_peak_alloc_bytes",
+    "Peak traced allocation above the stage's starting point, for sampled pipeline runs.",
+    ("step",),
+    buckets=ALLOC_BUCKETS,
+)
+
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+_LOCK = threading.Lock()
+_ACTIVE: Optional["StageMemoryTracker"] = None
+# Heap tracing started from the admin endpoint; sampled runs then leave tracemalloc running.
+_HEAP_TRACING = False
+_BASELINE: Optional[tracemalloc.Snapshot] = None
+
+
+def smaps_rollup(pid: Any = "self") -> Dict[str, int]:
+    """Byte counts from /proc/<pid>/smaps_rollup (Linux 4.14+); empty when unavailable."""
+    out: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    out[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return out
+
+
+def process_memory_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {}
+    try:
+        with open("/proc/self/statm") as f:
+            stats["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the high-water mark, in KiB on Linux.
+        stats["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    rollup = smaps_rollup()
+    if rollup:
+        # Pages shared copy-on-write with a preloading parent (serve.py) count in rss but not fully in pss.
+        stats["pss_bytes"] = rollup.get("Pss", 0)
+        stats["shared_bytes"] = rollup.get("Shared_Clean", 0) + rollup.get("Shared_Dirty", 0)
+        stats["private_bytes"] = rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats["traced_bytes"] = current
+        stats["traced_peak_bytes"] = peak
+    stats["heap_tracing"] = 1 if _HEAP_TRACING else 0
+    return stats
+
+
+class StageMemoryTracker:
+    """
+    Peak allocation per pipeline stage for one sampled run.
+    tracemalloc's peak is process-wide, so only one run is tracked at a time and
+    concurrent requests inflate the numbers; treat them as upper bounds.
+    """
+
+    def __init__(self, deadline: RequestDeadline):
+        self.deadline = deadline
+        self.stage_peaks: Dict[str, int] = {}
+        self._stage_base: Dict[str, int] = {}
+
+    def stage_started(self, stage: str) -> None:
+        tracemalloc.reset_peak()
+        self._stage_base[stage] = tracemalloc.get_traced_memory()[0]
+
+    def stage_finished(self, stage: str) -> None:
+        base = self._stage_base.pop(stage, None)
+        if base is None:
+            return
+        peak = max(0, tracemalloc.get_traced_memory()[1] - base)
+        self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), peak)
+        STAGE_PEAK_ALLOC_BYTES.observe(peak, step=stage)
+
+
+def start_stage_tracking(deadline: RequestDeadline) -> Optional[StageMemoryTracker]:
+    global _ACTIVE
+    if MEMORY_STAGE_SAMPLE_RATE <= 0 or random.random() >= MEMORY_STAGE_SAMPLE_RATE:
+        return None
+    with _LOCK:
+        if _ACTIVE is not None:
+            return None
+        if not tracemalloc.is_tracing():
+            # One frame is enough for sizes and keeps the sampled run cheap.
+            tracemalloc.start(1)
+        _ACTIVE = StageMemoryTracker(deadline)
+        return _ACTIVE
+
+
+def finish_stage_tracking(tracker: StageMemoryTracker) -> Dict[str, int]:
+    global _ACTIVE
+    with _LOCK:
+        if _ACTIVE is tracker:
+            _ACTIVE = None
+        if not _HEAP_TRACING and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    if tracker.stage_peaks:
+        peaks = " ".join(f"{k}={v / 1e6:.1f}MB" for k, v in tracker.stage_peaks.items())
+        print(f"[memory] stage peaks: {peaks}")
+    return dict(tracker.stage_peaks)
+
+
+def stage_started(deadline: RequestDeadline, stage: str) -> None:
+    tracker = _ACTIVE
+    if tracker is not None and tracker.deadline is deadline:
+        tracker.stage_started(stage)
+
+
+def stage_finished(deadline: RequestDeadline, stage: str) -> None:
+    tracker = _ACTIVE
+    if tracker is not None and tracker.deadline is deadline:
+        tracker.stage_finished(stage)
+
+
+def _site(stat: Any) -> str:
+    frames = stat.traceback
+    return " <- ".join(f"{os.path.basename(f.filename)}:{f.lineno}" for f in list(frames)[-3:][::-1]) if frames else "?"
+
+
+def heap_diff(*, start: bool = False, stop: bool = False, rebase: bool = True, limit: int = HEAP_DIFF_LIMIT) -> Dict[str, Any]:
+    """
+    Admin heap inspection. `start` begins tracing and takes the baseline; later calls
+    diff a fresh snapshot against the baseline by allocation site (and move the
+    baseline forward unless rebase=False). `stop` ends tracing.
+    """
+    global _HEAP_TRACING, _BASELINE
+    with _LOCK:
+        if stop:
+            _HEAP_TRACING = False
+            _BASELINE = None
+            if _ACTIVE is None and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            return {"tracing": False}
+
+        if not _HEAP_TRACING:
+            if not start:
+                return {"tracing": False, "hint": "POST /debug/heap?action=start to begin heap tracing"}
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(MEMORY_TRACE_FRAMES)
+            _HEAP_TRACING = True
+            _BASELINE = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            return {"tracing": True, "baseline": "taken", **process_memory_stats()}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        baseline = _BASELINE
+        if rebase or baseline is None:
+            _BASELINE = snapshot
+
+    top: List[Dict[str, Any]] = []
+    if baseline is not None:
+        for stat in snapshot.compare_to(baseline, "traceback")[:limit]:
+            top.append(
+                {
+                    "site": _site(stat),
+                    "size_diff_bytes": stat.size_diff,
+                    "size_bytes": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                }
+            )
+    total = sum(s.size for s in snapshot.statistics("filename"))
+    return {"tracing": True, "traced_total_bytes": total, "top_growth": top, **process_memory_stats()}
@@ -0,0 +1,296 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from helpers import call_ledger
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_LOCK = threading.Lock()
+_REGISTRY: List["_Metric"] = []
+# (metric prefix, stats function, constant labels) rendered as gauges on every scrape.
+_STATS_SOURCES: List[Tuple[str, Callable[[], Dict[str, Any]], Dict[str, str]]] = []
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, Any]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with _LOCK:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        with _LOCK:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with _LOCK:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (non-cumulative), sum, count]
+                state = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with _LOCK:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._values.items()]
+        for key, (counts, total, count) in items:
+            base = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(base + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(base + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(base)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {count}")
+        return lines
+
+
+EXTRACT_REQUEST_SECONDS = Histogram(
+    "thriftbuddy_extract_request_seconds",
+    "End-to-end extract pipeline duration.",
+    ("outcome",),
+)
+LENS_PHASE_SECONDS = Histogram(
+    "thriftbuddy_lens_phase_seconds",
+    "Duration of each lens-guided request phase; main_embed overlaps upload and lens.",
+    ("phase",),
+)
+EXTRACT_IN_FLIGHT = Gauge("thriftbuddy_extract_in_flight", "Extract pipelines currently running.")
+STEP_SECONDS = Histogram("thriftbuddy_step_seconds", "Duration of each extract pipeline step.", ("step",))
+EXTERNAL_CALL_SECONDS = Histogram(
+    "thriftbuddy_external_call_seconds",
+    "Duration of calls to SerpAPI, OpenAI, R2 and the thumbnail CDN.",
+    ("service", "outcome"),
+)
+EXTERNAL_IN_FLIGHT = Gauge("thriftbuddy_external_calls_in_flight", "External calls currently awaiting a response.", ("service",))
+EXTERNAL_BYTES = Counter(
+    "thriftbuddy_external_bytes_total",
+    "Bytes sent to and received from external services.",
+    ("service", "direction"),
+)
+EXTERNAL_CALLS_BY_STAGE = Counter(
+    "thriftbuddy_external_calls_by_stage_total",
+    "External network calls by the pipeline stage that made them.",
+    ("service", "stage"),
+)
+OPENAI_TOKENS = Counter("thriftbuddy_openai_tokens_total", "OpenAI tokens used.", ("kind",))
+REQUEST_NETWORK_CALLS = Histogram(
+    "thriftbuddy_request_network_calls",
+    "External network calls made by one pipeline run.",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 200),
+)
+SERP_CACHE_LOOKUPS = Counter(
+    "thriftbuddy_serp_cache_lookups_total",
+    "SerpAPI searches by how they were served (hit, shared in-flight call, or miss).",
+    ("result",),
+)
+CLIP_BATCH_SECONDS = Histogram("thriftbuddy_clip_batch_seconds", "CLIP forward pass duration per batch.", ("kind",))
+CLIP_BATCH_IMAGES = Histogram(
+    "thriftbuddy_clip_batch_images",
+    "Images per CLIP batch.",
+    ("kind",),
+    buckets=BATCH_SIZE_BUCKETS,
+)
+
+LOOP_LAG_SECONDS = Histogram(
+    "thriftbuddy_loop_lag_seconds",
+    "Event loop scheduling delay measured by the loop monitor.",
+    buckets=LOOP_LAG_BUCKETS,
+)
+LOOP_STALLS = Counter(
+    "thriftbuddy_loop_stalls_total",
+    "Event loop stalls over the threshold, by the code that was running.",
+    ("site",),
+)
+LOOP_STALL_SECONDS = Histogram(
+    "thriftbuddy_loop_stall_seconds",
+    "Duration of event loop stalls over the threshold.",
+    ("site",),
+    buckets=LOOP_LAG_BUCKETS,
+)
+
+
+def _outcome_for(e: BaseException) -> str:
+    if isinstance(e, asyncio.CancelledError):
+        return "cancelled"
+    # httpx.TimeoutException, openai.APITimeoutError, asyncio.TimeoutError, botocore timeouts
+    if "Timeout" in type(e).__name__:
+        return "timeout"
+    return "error"
+
+
+@contextmanager
+def track_call(service: str) -> Iterator[Dict[str, Any]]:
+    """
+    Times one external call and keeps the in-flight gauge for `service` up to date.
+    The yielded dict takes optional bytes_in/bytes_out/tokens_in/tokens_out/cache
+    fields; the call is also recorded in the current request's call ledger. `key`
+    and `body` (response bytes) are only kept when the ledger captures a trace.
+    """
+    start = time.perf_counter()
+    call: Dict[str, Any] = {"outcome": "ok"}
+    EXTERNAL_IN_FLIGHT.inc(service=service)
+    try:
+        yield call
+    except BaseException as e:
+        call["outcome"] = _outcome_for(e)
+        raise
+    finally:
+        latency = time.perf_counter() - start
+        EXTERNAL_IN_FLIGHT.dec(service=service)
+        EXTERNAL_CALL_SECONDS.observe(latency, service=service, outcome=call["outcome"])
+        _record_call(service, latency_sec=round(latency, 4), **call)
+
+
+def record_cached_call(service: str, *, cache: str, key: Optional[str] = None, body: Optional[bytes] = None) -> None:
+    """A call answered without the network (cache hit, or shared with another request's call)."""
+    _record_call(service, cache=cache, key=key, body=body)
+
+
+def _record_call(service: str, **fields: Any) -> None:
+    if fields.get("bytes_in"):
+        EXTERNAL_BYTES.inc(fields["bytes_in"], service=service, direction="in")
+    if fields.get("bytes_out"):
+        EXTERNAL_BYTES.inc(fields["bytes_out"], service=service, direction="out")
+    if fields.get("tokens_in"):
+        OPENAI_TOKENS.inc(fields["tokens_in"], kind="input")
+    if fields.get("tokens_out"):
+        OPENAI_TOKENS.inc(fields["tokens_out"], kind="output")
+    ledger = call_ledger.current()
+    if ledger is None:
+        return
+    entry = ledger.record(service, **fields)
+    if fields.get("cache") not in ("hit", "shared"):
+        EXTERNAL_CALLS_BY_STAGE.inc(service=service, stage=entry["stage"])
+
+
+def openai_usage(resp: Any) -> Dict[str, Optional[int]]:
+    """Ledger fields from an OpenAI Responses API result."""
+    usage = getattr(resp, "usage", None)
+    return {
+        "bytes_in": len((getattr(resp, "output_text", None) or "").encode("utf-8")),
+        "tokens_in": getattr(usage, "input_tokens", None),
+        "tokens_out": getattr(usage, "output_tokens", None),
+    }
+
+
+def register_stats(prefix: str, fn: Callable[[], Dict[str, Any]], **labels: str) -> None:
+    """
+    Exposes an existing stats dict as gauges: numbers become `<prefix>_<key>`, and a
+    dict of numbers becomes `<prefix>_<key>{group="<inner key>"}`.
+    """
+    _STATS_SOURCES.append((prefix, fn, labels))
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _stats_samples(prefix: str, stats: Dict[str, Any], labels: Dict[str, str]) -> Iterator[Tuple[str, List[Tuple[str, Any]], float]]:
+    base = list(labels.items())
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if _is_number(value):
+            yield name, base, value
+        elif isinstance(value, dict):
+            for group, inner in value.items():
+                if _is_number(inner):
+                    yield name, base + [("group", group)], inner
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in list(_REGISTRY):
+        lines.extend(metric.render())
+
+    # Sources sharing a prefix (one per admission controller, say) must render as one family.
+    families: Dict[str, List[str]] = {}
+    for prefix, fn, labels in list(_STATS_SOURCES):
+        try:
+            for name, sample_labels, value in _stats_samples(prefix, fn(), labels):
+                families.setdefault(name, []).append(f"{name}{_format_labels(sample_labels)} {_format_value(value)}")
+        except Exception as e:
+            print(f"[metrics] stats source {prefix} failed: {e}")
+    for name, samples in families.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
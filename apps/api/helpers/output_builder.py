@@ -1,10 +1,39 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import math
 import re
 
+import numpy as np
+
 TOPK_SIGNAL = 10
+CONDITION_BUCKETS = ("new", "used", "other", "unknown")
 
 _EBAY_SIZE_RE = re.compile(r"(s-l)(\d+)(?=[./?]|$)")
+_MONEY_RE = re.compile(r"([\d,]+(\.\d+)?)")
+_CONDITION_CODES = {"new": 0, "used": 1, "other": 2, None: 3}
+_SUMMARY_KEYS = ("min_price", "q1_price", "median_price", "q3_price", "max_price")
+_SUMMARY_QUANTILES = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+
+# Keys of slim_item, i.e. of every entry in active_listings/sold_listings.
+LISTING_FIELDS = (
+    "product_id",
+    "title",
+    "link",
+    "thumbnail",
+    "image",
+    "condition",
+    "price",
+    "shipping",
+    "location",
+    "image_similarity",
+)
+LISTING_LIMIT_MAX = 50
+URL_FIELDS = ("link", "thumbnail", "image")
+# Shared by most listing URLs; columnar listings send an index instead of repeating them.
+URL_PREFIXES = (
+    "https://i.ebayimg.com/images/g/",
+    "https://i.ebayimg.com/thumbs/images/g/",
+    "https://www.ebay.com/itm/",
+)
 
 def normalize_ebay_image_url(url: Optional[str], *, target_size: int = 800) -> Optional[str]:
     if not isinstance(url, str) or not url:
@@ -37,36 +66,16 @@ def _get_condition(item: Dict[str, Any]) -> Optional[str]:
     return "other"
 
 def compute_segmented_summaries(items: List[Dict[str, Any]]) -> Dict[str, Any]:
-    def summarize(label_items: List[Dict[str, Any]]) -> Dict[str, Any]:
-        out = filter_outliers_iqr(label_items)
-        filtered_items = out["filtered_items"]
-        return {
-            "raw": compute_price_summary(label_items),
-            "filtered": compute_price_summary(filtered_items),
-            "outliers_removed": out["outliers_removed"],
-            "iqr_bounds": out["bounds"],
-        }
-
-    buckets = {"new": [], "used": [], "other": [], "unknown": []}
-    for it in items:
-        c = _get_condition(it)
-        if c == "new":
-            buckets["new"].append(it)
-        elif c == "used":
-            buckets["used"].append(it)
-        elif c == "other":
-            buckets["other"].append(it)
-        else:
-            buckets["unknown"].append(it)
-
+    pv = price_vector(items)
+    conditions = pv["conditions"]
+    # Row 0 is every listing, then one row per condition bucket; all summarized together.
+    masks = np.vstack(
+        [np.ones(len(items), dtype=bool)] + [conditions == code for code in range(len(CONDITION_BUCKETS))]
+    )
+    stats = _bucket_stats(pv["prices"], masks)
     return {
-        "all": summarize(items),
-        "by_condition": {
-            "new": summarize(buckets["new"]),
-            "used": summarize(buckets["used"]),
-            "other": summarize(buckets["other"]),
-            "unknown": summarize(buckets["unknown"]),
-        },
+        "all": stats[0],
+        "by_condition": dict(zip(CONDITION_BUCKETS, stats[1:])),
     }
 
 
@@ -93,6 +102,58 @@ def slim_item(it: Dict[str, Any]) -> Dict[str, Any]:
         "image_similarity": it.get("_image_similarity"),
     }
 
+def _split_url(url: Any) -> Tuple[Optional[int], Any]:
+    if isinstance(url, str):
+        for i, prefix in enumerate(URL_PREFIXES):
+            if url.startswith(prefix):
+                return i, url[len(prefix):]
+    return None, url
+
+def columnar_listings(listings: List[Dict[str, Any]], fields: Tuple[str, ...]) -> Dict[str, Any]:
+    """
+    Listings as parallel arrays, one per field. URL fields are split into `<field>`
+    (the rest of the URL) and `<field>_prefix` (index into URL_PREFIXES, null when
+    none matched). A `thumbnail` equal to the listing's `image` is sent as null.
+    """
+    columns: Dict[str, List[Any]] = {}
+    for field in fields:
+        values = [it.get(field) for it in listings]
+        if field == "thumbnail" and "image" in fields:
+            values = [None if v == it.get("image") else v for v, it in zip(values, listings)]
+        if field in URL_FIELDS:
+            split = [_split_url(v) for v in values]
+            columns[f"{field}_prefix"] = [i for i, _ in split]
+            values = [rest for _, rest in split]
+        columns[field] = values
+    return {"n": len(listings), "columns": columns}
+
+def project_result(
+    data: Dict[str, Any],
+    *,
+    fields: Optional[Tuple[str, ...]] = None,
+    limit: Optional[int] = None,
+    listing_format: str = "rows",
+) -> Dict[str, Any]:
+    """
+    Copy of a build_frontend_payload result keeping `limit` listings per side with
+    only `fields` (all of LISTING_FIELDS when None), as rows or columnar_listings.
+    The input is not modified, so cached results stay whole.
+    """
+    fields = LISTING_FIELDS if fields is None else tuple(fields)
+    out = dict(data)
+    for key in ("active_listings", "sold_listings"):
+        listings = (data.get(key) or [])[:limit]
+        if listing_format == "columnar":
+            out[key] = columnar_listings(listings, fields)
+        elif fields == LISTING_FIELDS:
+            out[key] = listings
+        else:
+            out[key] = [{f: it.get(f) for f in fields} for it in listings]
+    if listing_format == "columnar":
+        out["listing_format"] = "columnar"
+        out["url_prefixes"] = list(URL_PREFIXES)
+    return out
+
 def json_sanitize(obj: Any) -> Any:
     if obj is None or isinstance(obj, (str, int, float, bool)):
         return obj
@@ -145,7 +206,7 @@ def build_response(
 def _parse_money_str(s: str) -> Optional[float]:
     if not isinstance(s, str):
         return None
-    m = re.search(r"([\d,]+(\.\d+)?)", s)
+    m = _MONEY_RE.search(s)
     if not m:
         return None
     return float(m.group(1).replace(",", ""))
@@ -175,69 +236,115 @@ def _to_float_price(item: Dict[str, Any]) -> Optional[float]:
 
     return None
 
-def _percentile(sorted_vals: List[float], p: float) -> Optional[float]:
-    n = len(sorted_vals)
-    if n == 0:
-        return None
-    if n == 1:
-        return sorted_vals[0]
-
-    idx = (n - 1) * p
-    lo = math.floor(idx)
-    hi = math.ceil(idx)
-    if lo == hi:
-        return sorted_vals[lo]
+def price_vector(items: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Every listing's price (NaN when it has none) and condition bucket index
+    (into CONDITION_BUCKETS), parsed once so the statistics below never re-parse.
+    """
+    prices: List[float] = []
+    conditions: List[int] = []
+    codes: Dict[Any, int] = {}  # Listings repeat a handful of condition strings.
+    for it in items:
+        price = it.get("price")
+        extracted = price.get("extracted") if isinstance(price, dict) else None
+        if isinstance(extracted, (int, float)):
+            prices.append(float(extracted))
+        else:
+            p = _to_float_price(it)
+            prices.append(math.nan if p is None else p)
+        c = it.get("condition")
+        c = c if isinstance(c, str) else None
+        code = codes.get(c)
+        if code is None:
+            code = codes[c] = _CONDITION_CODES[_get_condition(it)]
+        conditions.append(code)
+    return {
+        "prices": np.array(prices, dtype=np.float64),
+        "conditions": np.array(conditions, dtype=np.int8),
+    }
+
+def _quantile_rows(rows: np.ndarray, start: np.ndarray, count: np.ndarray) -> np.ndarray:
+    # min, q1, median, q3 and max of rows[i, start[i]:start[i] + count[i]] as one
+    # (bucket x 5) gather; linear interpolation between closest ranks, NaN for empty slices.
+    idx = start[:, None] + (count[:, None] - 1) * _SUMMARY_QUANTILES
+    lo = np.floor(idx)
     weight = idx - lo
-    return sorted_vals[lo] * (1 - weight) + sorted_vals[hi] * weight
+    last = rows.shape[1] - 1
+    row_ids = np.arange(rows.shape[0])[:, None]
+    lo_vals = rows[row_ids, np.minimum(np.maximum(lo, 0), last).astype(np.intp)]
+    hi_vals = rows[row_ids, np.minimum(np.maximum(np.ceil(idx), 0), last).astype(np.intp)]
+    vals = lo_vals * (1 - weight) + hi_vals * weight
+    vals[count == 0] = np.nan
+    return vals
+
+def _summaries(vals: np.ndarray, count: np.ndarray, total: np.ndarray) -> List[Dict[str, Any]]:
+    return [
+        {
+            "n_items_total": t,
+            "n_items_with_price": c,
+            **{k: None if math.isnan(v) else v for k, v in zip(_SUMMARY_KEYS, row)},
+        }
+        for row, c, t in zip(vals.tolist(), count.tolist(), total.tolist())
+    ]
 
-def _iqr_bounds(sorted_vals: List[float]) -> Optional[Dict[str, float]]:
-    if len(sorted_vals) < 4:
-        return None
-    q1 = _percentile(sorted_vals, 0.25)
-    q3 = _percentile(sorted_vals, 0.75)
-    if q1 is None or q3 is None:
-        return None
+def _bucket_stats(prices: np.ndarray, masks: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Raw and IQR-filtered price summaries for every row of `masks` (bucket x listing)
+    with a single sort: each row's in-bounds prices are a contiguous slice of it.
+    """
+    totals = masks.sum(axis=1)
+    if prices.size == 0:
+        rows = np.full((masks.shape[0], 1), np.nan)
+    else:
+        rows = np.where(masks, prices, np.nan)
+        rows.sort(axis=1)  # NaN (no price or other bucket) sorts last.
+    priced = (~np.isnan(rows)).sum(axis=1)
+
+    raw = _quantile_rows(rows, np.zeros_like(priced), priced)
+    q1, q3 = raw[:, 1], raw[:, 3]
     iqr = q3 - q1
-    low = max(0.0, q1 - 1.5 * iqr)
+    has_bounds = priced >= 4
+    low = np.maximum(0.0, q1 - 1.5 * iqr)
     high = q3 + 1.5 * iqr
-    return {"q1": q1, "q3": q3, "iqr": iqr, "low": low, "high": high}
+    kept_start = np.where(has_bounds, (rows < low[:, None]).sum(axis=1), 0)
+    kept = np.where(has_bounds, (rows <= high[:, None]).sum(axis=1), priced) - kept_start
+    removed = priced - kept
+    filtered = _quantile_rows(rows, kept_start, kept)
 
-def filter_outliers_iqr(items: List[Dict[str, Any]]) -> Dict[str, Any]:
-    prices = [p for p in (_to_float_price(x) for x in items) if p is not None]
-    prices.sort()
+    bounds = np.stack([q1, q3, iqr, low, high], axis=1).tolist()
+    return [
+        {
+            "raw": r,
+            "filtered": f,
+            "outliers_removed": n_removed,
+            "iqr_bounds": dict(zip(("q1", "q3", "iqr", "low", "high"), b)) if ok else None,
+        }
+        for r, f, n_removed, b, ok in zip(
+            _summaries(raw, priced, totals),
+            _summaries(filtered, kept, totals - removed),
+            removed.tolist(),
+            bounds,
+            has_bounds.tolist(),
+        )
+    ]
+
+def _all_stats(items: List[Dict[str, Any]]) -> Tuple[np.ndarray, Dict[str, Any]]:
+    prices = price_vector(items)["prices"]
+    return prices, _bucket_stats(prices, np.ones((1, len(items)), dtype=bool))[0]
 
-    bounds = _iqr_bounds(prices)
+def filter_outliers_iqr(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    prices, stats = _all_stats(items)
+    bounds = stats["iqr_bounds"]
     if not bounds:
         return {"filtered_items": items, "outliers_removed": 0, "bounds": None}
 
-    low, high = bounds["low"], bounds["high"]
-    filtered: List[Dict[str, Any]] = []
-    removed = 0
-
-    for it in items:
-        p = _to_float_price(it)
-        if p is None:
-            filtered.append(it)
-        elif low <= p <= high:
-            filtered.append(it)
-        else:
-            removed += 1
-
-    return {"filtered_items": filtered, "outliers_removed": removed, "bounds": bounds}
+    # Listings without a price are kept; NaN fails both comparisons.
+    drop = (prices < bounds["low"]) | (prices > bounds["high"])
+    filtered = [it for it, d in zip(items, drop.tolist()) if not d]
+    return {"filtered_items": filtered, "outliers_removed": stats["outliers_removed"], "bounds": bounds}
 
 def compute_price_summary(items: List[Dict[str, Any]]) -> Dict[str, Any]:
-    prices = [p for p in (_to_float_price(x) for x in items) if p is not None]
-    prices.sort()
-
-    return {
-        "n_items_total": len(items),
-        "n_items_with_price": len(prices),
-        "min_price": prices[0] if prices else None,
-        "q1_price": _percentile(prices, 0.25),
-        "median_price": _percentile(prices, 0.50),
-        "q3_price": _percentile(prices, 0.75),
-        "max_price": prices[-1] if prices else None,
-    }
+    return _all_stats(items)[1]["raw"]
 
 def _safe_round_money(x: Optional[float]) -> Optional[float]:
     if x is None:
@@ -330,17 +437,15 @@ def build_frontend_payload(
     active_matches = (active_ranked or {}).get("filtered_items") or []
     sold_matches = (sold_ranked or {}).get("filtered_items") or []
 
-    active_filtered = filter_outliers_iqr(active_matches)["filtered_items"] if active_matches else []
-    sold_filtered = filter_outliers_iqr(sold_matches)["filtered_items"] if sold_matches else []
-
-    active_range = _price_range_from_summary(compute_price_summary(active_filtered)) if active_filtered else None
-    sold_range = _price_range_from_summary(compute_price_summary(sold_filtered)) if sold_filtered else None
+    # Price range after outlier filtering, from one parse of each list.
+    active_range = _price_range_from_summary(_all_stats(active_matches)[1]["filtered"]) if active_matches else None
+    sold_range = _price_range_from_summary(_all_stats(sold_matches)[1]["filtered"]) if sold_matches else None
 
     active_n = len(active_matches)
     sold_n = len(sold_matches)
 
-    active_listings = _pick_example_listings(active_matches, k=50)
-    sold_listings = _pick_example_listings(sold_matches, k=50)
+    active_listings = _pick_example_listings(active_matches, k=LISTING_LIMIT_MAX)
+    sold_listings = _pick_example_listings(sold_matches, k=LISTING_LIMIT_MAX)
 
     category = _infer_category_hint(refined_query or initial_query, active_listings)
     advice = _legit_advice(category)
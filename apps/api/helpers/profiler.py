@@ -0,0 +1,165 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, List, Optional
+
+from fastapi import Request
+
+from helpers import metrics
+from helpers.admin import is_admin_request
+from helpers.deadline import RequestDeadline
+
+# Fraction of extract requests profiled without the admin header (0.01 = 1%).
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = "X-Profile"
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_INTERVAL_SEC = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000.0
+PROFILE_MAX_SEC = 90.0
+MAX_STACK_DEPTH = 80
+
+PROFILES_WRITTEN = metrics.Counter(
+    "thriftbuddy_profiles_written_total",
+    "Sampling profiles written, by what triggered them.",
+    ("reason",),
+)
+
+# One session at a time keeps overhead bounded no matter the sample rate.
+_ACTIVE_LOCK = threading.Lock()
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def _fold(frame: Any) -> str:
+    labels: List[str] = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class ProfileSession:
+    """
+    Wall-clock stack sampler for one request.
+    Samples the event loop thread and the `asyncio` executor threads (CLIP,
+    OpenAI, SQLite) every PROFILE_INTERVAL_SEC and folds the stacks into the
+    collapsed format read by flamegraph.pl and speedscope. Each stack is rooted at
+    the request's stage at sample time. The loop is shared, so requests running
+    concurrently show up too; their frames sit under the same stage roots.
+    """
+
+    def __init__(self, *, reason: str, deadline: RequestDeadline):
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.reason = reason
+        self.deadline = deadline
+        self.samples: Counter = Counter()
+        self.n_samples = 0
+        self.started_at = time.time()
+        self._loop_thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        print(f"[profile] start id={self.profile_id} reason={self.reason}")
+
+    def _run(self) -> None:
+        started = time.monotonic()
+        while not self._stop.wait(PROFILE_INTERVAL_SEC):
+            if time.monotonic() - started > PROFILE_MAX_SEC:
+                break
+            self._sample()
+
+    def _sample(self) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stage = self.deadline.current_stage or "none"
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self._loop_thread_id:
+                role = "loop"
+            elif names.get(thread_id, "").startswith("asyncio"):
+                # Idle pool threads sit in ThreadPoolExecutor._worker waiting on the work queue.
+                if frame.f_code.co_name == "_worker":
+                    continue
+                role = "executor"
+            else:
+                continue
+            self.samples[f"stage:{stage};thread:{role};{_fold(frame)}"] += 1
+        self.n_samples += 1
+
+    def stop(self) -> Optional[Path]:
+        """Stops sampling and writes `<id>.folded` plus a `<id>.json` sidecar. Returns the folded path."""
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        try:
+            return self._write()
+        except Exception as e:
+            print(f"[profile] write failed id={self.profile_id}: {e}")
+            return None
+
+    def _write(self) -> Path:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        folded_path = PROFILE_DIR / f"{self.profile_id}.folded"
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        meta = {
+            "profile_id": self.profile_id,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_sec": round(time.time() - self.started_at, 3),
+            "interval_sec": PROFILE_INTERVAL_SEC,
+            "samples": self.n_samples,
+            "stage_timings_sec": dict(self.deadline.stage_timings),
+            "degraded_stages": list(self.deadline.degraded),
+            "cancel_reason": self.deadline.cancel_reason,
+        }
+        (PROFILE_DIR / f"{self.profile_id}.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        PROFILES_WRITTEN.inc(reason=self.reason)
+        print(f"[profile] wrote {folded_path} samples={self.n_samples}")
+        _enforce_retention()
+        return folded_path
+
+
+def _enforce_retention() -> None:
+    folded = sorted(PROFILE_DIR.glob("*.folded"), key=lambda p: p.stat().st_mtime)
+    for path in folded[: max(0, len(folded) - PROFILE_MAX_FILES)]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".json").unlink(missing_ok=True)
+
+
+def maybe_start_profile(request: Optional[Request], deadline: RequestDeadline) -> Optional[ProfileSession]:
+    """
+    Starts a session when the request carries `X-Profile: 1` with a valid admin
+    token, or when it is picked by PROFILE_SAMPLE_RATE. Returns None otherwise,
+    or if another request is already being profiled.
+    """
+    if request is not None and request.headers.get(PROFILE_HEADER) == "1" and is_admin_request(request):
+        reason = "admin"
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        reason = "sampled"
+    else:
+        return None
+
+    if not _ACTIVE_LOCK.acquire(blocking=False):
+        print(f"[profile] skipped ({reason}): another request is being profiled")
+        return None
+    session = ProfileSession(reason=reason, deadline=deadline)
+    session.start()
+    return session
+
+
+def finish_profile(session: ProfileSession) -> Optional[Path]:
+    try:
+        return session.stop()
+    finally:
+        _ACTIVE_LOCK.release()
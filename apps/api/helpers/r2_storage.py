@@ -1,21 +1,49 @@
-import os, uuid
-import boto3
-from botocore.config import Config
+import asyncio
+import hashlib
+import os
+import time
+from typing import Dict
+
+from helpers import metrics, subsystems
 
 from dotenv import load_dotenv
 load_dotenv()
 
-s3 = boto3.client(
-    "s3",
-    endpoint_url=f"https://{os.environ['R2_ACCOUNT_ID']}.r2.cloudflarestorage.com",
-    aws_access_key_id=os.environ["R2_ACCESS_KEY_ID"],
-    aws_secret_access_key=os.environ["R2_SECRET_ACCESS_KEY"],
-    region_name="auto",
-    config=Config(signature_version="s3v4"),
-)
-
 R2_BUCKET = os.environ.get("R2_BUCKET", "thriftbuddy-temp")
-PUBLIC_BASE = os.environ["R2_PUBLIC_IMG_BASE"]  # your Worker URL
+# Connections kept by the shared client; uploads run on worker threads and reuse them.
+R2_MAX_POOL_CONNECTIONS = int(os.getenv("R2_MAX_POOL_CONNECTIONS", "20"))
+# How long a key this process uploaded is trusted to still exist without a HEAD;
+# keep it under the bucket's lifecycle expiry for the tmp/ prefix.
+R2_KNOWN_KEY_TTL_SEC = int(os.getenv("R2_KNOWN_KEY_TTL_SEC", "3600"))
+R2_KNOWN_KEYS_MAX = 4096
+
+# Object key -> time it was last confirmed to exist.
+_KNOWN_KEYS: Dict[str, float] = {}
+
+
+def _make_client():
+    # Built on first use (or by warmup) so a missing R2 setting only takes down uploads.
+    missing = [k for k in ("R2_ACCESS_KEY_ID", "R2_SECRET_ACCESS_KEY", "R2_PUBLIC_IMG_BASE") if not os.environ.get(k)]
+    if not (os.environ.get("R2_ENDPOINT_URL") or os.environ.get("R2_ACCOUNT_ID")):
+        missing.append("R2_ACCOUNT_ID")
+    if missing:
+        raise RuntimeError(f"missing {', '.join(missing)}")
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        # R2_ENDPOINT_URL points uploads at another S3-compatible endpoint (benchmarks, local dev).
+        endpoint_url=os.environ.get("R2_ENDPOINT_URL") or f"https://{os.environ['R2_ACCOUNT_ID']}.r2.cloudflarestorage.com",
+        aws_access_key_id=os.environ["R2_ACCESS_KEY_ID"],
+        aws_secret_access_key=os.environ["R2_SECRET_ACCESS_KEY"],
+        region_name="auto",
+        config=Config(signature_version="s3v4", max_pool_connections=R2_MAX_POOL_CONNECTIONS),
+    )
+
+
+R2 = subsystems.Subsystem("r2", _make_client)
+
 
 def _safe_ext(filename: str | None) -> str:
     if not filename or "." not in filename:
@@ -23,16 +51,72 @@ def _safe_ext(filename: str | None) -> str:
     ext = filename.rsplit(".", 1)[-1].lower()
     return ext if ext in ("jpg", "jpeg", "png", "webp") else "jpg"
 
+
+def content_key(data: bytes, *, filename: str | None = None, prefix: str = "tmp") -> str:
+    # Same bytes, same key: repeat uploads are skipped and downstream caches keyed by URL hit.
+    return f"{prefix}/{hashlib.sha256(data).hexdigest()}.{_safe_ext(filename)}"
+
+
+def public_url(key: str) -> str:
+    return f"{os.environ['R2_PUBLIC_IMG_BASE']}/{key}"  # your Worker URL
+
+
+def _remember(key: str) -> None:
+    if len(_KNOWN_KEYS) >= R2_KNOWN_KEYS_MAX:
+        _KNOWN_KEYS.pop(next(iter(_KNOWN_KEYS)))
+    _KNOWN_KEYS[key] = time.time()
+
+
+def _object_exists(s3, key: str) -> bool:
+    from botocore.exceptions import ClientError
+
+    try:
+        s3.head_object(Bucket=R2_BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+async def upload_bytes_and_get_url(
+    data: bytes,
+    *,
+    content_type: str,
+    filename: str | None = None,
+    prefix: str = "tmp",
+) -> str:
+    key = content_key(data, filename=filename, prefix=prefix)
+    seen_at = _KNOWN_KEYS.get(key)
+    if seen_at is not None and time.time() - seen_at < R2_KNOWN_KEY_TTL_SEC:
+        metrics.record_cached_call("r2", cache="hit", key=key)
+        return public_url(key)
+
+    s3 = await R2.aget()
+    # boto3 blocks; the client is thread-safe, so worker threads keep the event loop free.
+    with metrics.track_call("r2_head") as call:
+        call["key"] = key
+        exists = await asyncio.to_thread(_object_exists, s3, key)
+    if not exists:
+        with metrics.track_call("r2") as call:
+            call["bytes_out"] = len(data)
+            call["key"] = key
+            await asyncio.to_thread(
+                s3.put_object,
+                Bucket=R2_BUCKET,
+                Key=key,
+                Body=data,
+                ContentType=content_type,
+            )
+    _remember(key)
+    return public_url(key)
+
+
 async def upload_uploadfile_and_get_url(upload_file, prefix="tmp") -> str:
     data = await upload_file.read()
-    ext = _safe_ext(getattr(upload_file, "filename", None))
-    key = f"{prefix}/{uuid.uuid4().hex}.{ext}"
-
-    s3.put_object(
-        Bucket=R2_BUCKET,
-        Key=key,
-        Body=data,
-        ContentType=getattr(upload_file, "content_type", None) or "image/jpeg",
+    return await upload_bytes_and_get_url(
+        data,
+        content_type=getattr(upload_file, "content_type", None) or "image/jpeg",
+        filename=getattr(upload_file, "filename", None),
+        prefix=prefix,
     )
-
-    return f"{PUBLIC_BASE}/{key}"
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from helpers import output_builder
+
+# Sold prices move slowly; active listings come and go within the hour.
+RESULT_CACHE_ACTIVE_TTL_SEC = int(os.getenv("RESULT_CACHE_ACTIVE_TTL_SEC", "900"))
+RESULT_CACHE_SOLD_TTL_SEC = int(os.getenv("RESULT_CACHE_SOLD_TTL_SEC", "21600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+
+# Keyed by "<content hash>:<mode>", oldest first.
+_RESULT_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def ttl_for_mode(mode: str) -> int:
+    if mode == "active":
+        return RESULT_CACHE_ACTIVE_TTL_SEC
+    if mode == "sold":
+        return RESULT_CACHE_SOLD_TTL_SEC
+    return min(RESULT_CACHE_ACTIVE_TTL_SEC, RESULT_CACHE_SOLD_TTL_SEC)
+
+
+def _retention_for_mode(mode: str) -> int:
+    # `both` entries also answer active and sold requests, each under its own TTL.
+    if mode == "both":
+        return max(RESULT_CACHE_ACTIVE_TTL_SEC, RESULT_CACHE_SOLD_TTL_SEC)
+    return ttl_for_mode(mode)
+
+
+def content_key(
+    *,
+    main_bytes: bytes,
+    extra_bytes: List[bytes],
+    itemName: Optional[str],
+    text: Optional[str],
+) -> str:
+    """
+    Hash of everything that determines a result except `mode`.
+    Expects the normalized image bytes from image_processing.read_images.
+    """
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(main_bytes).digest())
+    for b in extra_bytes:
+        h.update(hashlib.sha256(b).digest())
+    params = {
+        "itemName": (itemName or "").strip(),
+        "text": (text or "").strip(),
+    }
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _compact_ranked(ranked: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # Keep what build_frontend_payload reads; drop the embedding vectors.
+    if not ranked:
+        return ranked
+    out = {k: v for k, v in ranked.items() if k != "filtered_items"}
+    out["filtered_items"] = [
+        {k: v for k, v in it.items() if not k.startswith("_thumb")}
+        for it in ranked.get("filtered_items") or []
+    ]
+    return out
+
+
+def result_cache_stats() -> Dict[str, int]:
+    entries = list(_RESULT_CACHE.values())
+    return {
+        "entries": len(entries),
+        "approx_bytes": sum(e.get("size_bytes", 0) for e in entries),
+    }
+
+
+def _evict_expired(now: float) -> None:
+    for key in [k for k, entry in _RESULT_CACHE.items() if entry["expires_at"] <= now]:
+        _RESULT_CACHE.pop(key, None)
+
+
+def store(key: str, *, mode: str, events: List[Dict[str, Any]], outcome: Dict[str, Any]) -> None:
+    steps = [e for e in events if e.get("type") == "step"]
+    results = [e for e in events if e.get("type") == "result"]
+    if not results:
+        return
+
+    now = time.time()
+    _evict_expired(now)
+    cache_key = f"{key}:{mode}"
+    _RESULT_CACHE.pop(cache_key, None)
+    entry = {
+        "mode": mode,
+        "steps": steps,
+        "result": results[-1]["data"],
+        "initial_query": outcome.get("initial_query"),
+        "refined_query": outcome.get("refined_query"),
+        "active_ranked": _compact_ranked(outcome.get("active_ranked")),
+        "sold_ranked": _compact_ranked(outcome.get("sold_ranked")),
+        "stored_at": now,
+        "expires_at": now + _retention_for_mode(mode),
+    }
+    # Serialized size as a stand-in for the in-memory footprint; computed once per store.
+    entry["size_bytes"] = len(json.dumps(entry, default=str))
+    _RESULT_CACHE[cache_key] = entry
+    while len(_RESULT_CACHE) > RESULT_CACHE_MAX_ENTRIES:
+        _RESULT_CACHE.popitem(last=False)
+
+
+def lookup(key: str, *, mode: str) -> Optional[Dict[str, Any]]:
+    """
+    Exact-mode entry first; an active or sold request can also be answered
+    from a `both` entry that ranked the side asked about.
+    """
+    now = time.time()
+    candidates = [mode] if mode == "both" else [mode, "both"]
+    for stored_mode in candidates:
+        cache_key = f"{key}:{stored_mode}"
+        entry = _RESULT_CACHE.get(cache_key)
+        if entry is None:
+            continue
+        if entry["expires_at"] <= now:
+            _RESULT_CACHE.pop(cache_key, None)
+            continue
+        # A `both` run without a refined query never fetches sold results; its
+        # missing side must come from a real run, not an empty cached one.
+        if stored_mode != mode and entry.get(f"{mode}_ranked") is None:
+            continue
+        # A `both` entry is kept for the longer TTL; each request checks its own side's.
+        if entry["stored_at"] + ttl_for_mode(mode) <= now:
+            continue
+        _RESULT_CACHE.move_to_end(cache_key)
+        return entry
+    return None
+
+
+def replay_events(entry: Dict[str, Any], *, mode: str, t0: float) -> List[Dict[str, Any]]:
+    events = [{**e, "cached": True} for e in entry["steps"]]
+
+    if entry["mode"] == mode:
+        data = dict(entry["result"])
+    else:
+        data = output_builder.build_frontend_payload(
+            mode=mode,
+            initial_query=entry["initial_query"],
+            refined_query=entry["refined_query"],
+            active_ranked=entry["active_ranked"] if mode in ("active", "both") else None,
+            sold_ranked=entry["sold_ranked"] if mode in ("sold", "both") else None,
+        )
+        data["budget_sec"] = entry["result"].get("budget_sec")
+        data["degraded_stages"] = []
+
+    data.pop("stage_timings_sec", None)
+    data.pop("external_calls", None)
+    data["timing_sec"] = round(time.time() - t0, 3)
+    data["cached"] = True
+    data["cache_age_sec"] = round(time.time() - entry["stored_at"], 3)
+    events.append({"type": "result", "data": data})
+    return events
@@ -0,0 +1,76 @@
+import json
+import math
+from typing import Any, Dict
+
+from helpers import output_builder
+
+try:
+    import orjson
+except ImportError:  # Optional: the stdlib fallback writes the same compact lines, just slower.
+    orjson = None
+
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class EncodedEvent(dict):
+    """An event dict that carries its NDJSON line, encoded once up front."""
+
+    __slots__ = ("line",)
+
+
+def _default(obj: Any) -> Any:
+    # Only reached for types the encoder does not know; mirrors json_sanitize.
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, "tolist"):  # numpy values the encoder could not take natively
+        return obj.tolist()
+    return str(obj)
+
+
+def _encode(obj: Any, *, newline: bool) -> bytes:
+    if orjson is not None:
+        option = _ORJSON_OPTS if newline else _ORJSON_OPTS & ~orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(obj, default=_default, option=option)
+    try:
+        text = json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+    except ValueError:
+        # NaN/Infinity: orjson writes null, where json.dumps would emit invalid JSON.
+        text = json.dumps(_finite(obj), default=_default, ensure_ascii=False, separators=(",", ":"))
+    data = text.encode("utf-8")
+    return data + b"\n" if newline else data
+
+
+def _finite(obj: Any) -> Any:
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_finite(x) for x in obj]
+    if hasattr(obj, "tolist") and not isinstance(obj, (str, bytes)):
+        return _finite(obj.tolist())
+    return obj
+
+
+def dumps(obj: Any, *, newline: bool = False) -> bytes:
+    """JSON bytes without a pre-walk of `obj`; unknown types go through `_default`."""
+    try:
+        return _encode(obj, newline=newline)
+    except TypeError:
+        # Keys the encoder rejects (tuples, objects) or ints beyond 64 bits: take the slow path.
+        return _encode(output_builder.json_sanitize(obj), newline=newline)
+
+
+def ndjson_line(obj: Any) -> bytes:
+    """One NDJSON line (with trailing newline); precomputed events reuse their bytes."""
+    if isinstance(obj, EncodedEvent):
+        return obj.line
+    return dumps(obj, newline=True)
+
+
+def precomputed(event: Dict[str, Any]) -> EncodedEvent:
+    """Encodes a static event once; reuse the returned object instead of rebuilding it."""
+    out = EncodedEvent(event)
+    out.line = ndjson_line(event)
+    return out
@@ -0,0 +1,128 @@
+import os
+import zlib
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+try:
+    import brotli
+except ImportError:  # Optional: without it, clients that accept br get gzip.
+    brotli = None
+
+# 0 sends NDJSON streams uncompressed whatever the client accepts.
+NDJSON_COMPRESSION = os.getenv("NDJSON_COMPRESSION", "1") == "1"
+NDJSON_GZIP_LEVEL = int(os.getenv("NDJSON_GZIP_LEVEL", "6"))
+# Brotli quality 0-11; above ~6 costs a lot of CPU per event for little gain.
+NDJSON_BROTLI_QUALITY = int(os.getenv("NDJSON_BROTLI_QUALITY", "5"))
+
+_ENCODINGS = ("br", "gzip", "identity")
+_STATS: Dict[str, Dict[str, float]] = {
+    "streams": {e: 0 for e in _ENCODINGS},
+    "raw_bytes": {e: 0 for e in _ENCODINGS},
+    "sent_bytes": {e: 0 for e in _ENCODINGS},
+}
+
+
+def compression_stats() -> Dict[str, Any]:
+    ratio = {
+        e: round(_STATS["raw_bytes"][e] / _STATS["sent_bytes"][e], 3)
+        for e in _ENCODINGS
+        if _STATS["sent_bytes"][e]
+    }
+    return {**{k: dict(v) for k, v in _STATS.items()}, "ratio": ratio}
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """br or gzip if the Accept-Encoding header allows it (br preferred at equal q), else None."""
+    if not NDJSON_COMPRESSION or not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    wildcard = weights.get("*", 0.0)
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(offered, key=lambda e: weights.get(e, wildcard))
+    return best if weights.get(best, wildcard) > 0 else None
+
+
+class _Gzip:
+    def __init__(self) -> None:
+        self._z = zlib.compressobj(NDJSON_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        # Z_SYNC_FLUSH ends the event on a byte boundary the client can decode right away;
+        # the window (and so the ratio across repeated URLs) carries over to the next event.
+        return self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self) -> None:
+        self._c = brotli.Compressor(mode=brotli.MODE_TEXT, quality=NDJSON_BROTLI_QUALITY)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.process(data) + self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+async def _compressed(chunks: AsyncIterator[Any], encoding: str, label: str) -> AsyncIterator[bytes]:
+    compressor = _Brotli() if encoding == "br" else _Gzip()
+    raw = sent = 0
+    try:
+        async for chunk in chunks:
+            data = chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+            out = compressor.chunk(data)
+            raw += len(data)
+            sent += len(out)
+            yield out
+        tail = compressor.finish()
+        sent += len(tail)
+        yield tail
+    finally:
+        _record(encoding, raw, sent)
+        if sent:
+            print(f"[compress] {label} {encoding}: {raw} -> {sent} bytes ({raw / sent:.1f}x)")
+
+
+async def _counted(chunks: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    raw = 0
+    try:
+        async for chunk in chunks:
+            raw += len(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+            yield chunk
+    finally:
+        _record("identity", raw, raw)
+
+
+def _record(encoding: str, raw: int, sent: int) -> None:
+    _STATS["streams"][encoding] += 1
+    _STATS["raw_bytes"][encoding] += raw
+    _STATS["sent_bytes"][encoding] += sent
+
+
+def ndjson_response(chunks: AsyncIterator[Any], *, request: Optional[Request], label: str) -> StreamingResponse:
+    """
+    StreamingResponse for an NDJSON stream, compressed with whatever the client
+    negotiated. Every chunk (one event) is flushed through the compressor as it is
+    yielded, so progress events are never held back waiting for more output.
+    """
+    encoding = negotiate_encoding(request.headers.get("accept-encoding") if request is not None else None)
+    headers = {"Vary": "Accept-Encoding"} if NDJSON_COMPRESSION else {}
+    if encoding is None:
+        return StreamingResponse(_counted(chunks), media_type="application/x-ndjson", headers=headers)
+    headers["Content-Encoding"] = encoding
+    return StreamingResponse(_compressed(chunks, encoding, label), media_type="application/x-ndjson", headers=headers)
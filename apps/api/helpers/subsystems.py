@@ -0,0 +1,181 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+# Subsystems that must be ready for /ready to return 200; the rest are reported only.
+READY_REQUIRED = [s.strip() for s in os.getenv("READY_REQUIRED", "clip").split(",") if s.strip()]
+# A failed init is retried on use, at most this often.
+INIT_RETRY_SEC = float(os.getenv("SUBSYSTEM_INIT_RETRY_SEC", "30"))
+# Set to 0 to skip background warmup; subsystems then initialize on first use.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+
+
+def _process_start_time() -> float:
+    # Linux: derive the exec time from /proc so interpreter startup and imports count too.
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+_PROCESS_START = _process_start_time()
+_STARTUP: Dict[str, Optional[float]] = {"app_import_sec": None, "first_request_sec": None}
+
+
+class Subsystem:
+    """
+    A dependency (model, storage client, DB engine) built on first use or by
+    background warmup, whichever comes first. Initialization happens once under a
+    lock; a failure is kept and reported on /ready, and retried on a later use
+    after INIT_RETRY_SEC so one misconfigured subsystem never blocks the others.
+    """
+
+    def __init__(self, name: str, init: Callable[[], Any]):
+        self.name = name
+        self._init = init
+        self._lock = threading.Lock()
+        self._value: Any = None
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.init_sec: Optional[float] = None
+        self.ready_at_sec: Optional[float] = None
+        self._failed_at = 0.0
+        # The one in-flight `aget` initialization, shared by every async caller.
+        self._waiter: Optional[asyncio.Task] = None
+        _REGISTRY[name] = self
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def get(self) -> Any:
+        """Returns the initialized value, initializing it if needed. Blocks; call from a thread."""
+        if self.state == "ready":
+            return self._value
+        with self._lock:
+            if self.state == "ready":
+                return self._value
+            if self.state == "failed" and time.monotonic() - self._failed_at < INIT_RETRY_SEC:
+                raise HTTPException(status_code=503, detail=f"{self.name} is unavailable: {self.error}")
+            self.state = "initializing"
+            start = time.perf_counter()
+            try:
+                value = self._init()
+            except Exception as e:
+                self.state = "failed"
+                self.error = f"{type(e).__name__}: {e}"
+                self._failed_at = time.monotonic()
+                print(f"[startup] {self.name} failed after {time.perf_counter() - start:.2f}s: {self.error}")
+                raise HTTPException(status_code=503, detail=f"{self.name} is unavailable: {self.error}") from e
+            self._value = value
+            self.init_sec = time.perf_counter() - start
+            self.ready_at_sec = time.time() - _PROCESS_START
+            self.error = None
+            self.state = "ready"
+            print(f"[startup] {self.name} ready in {self.init_sec:.2f}s ({self.ready_at_sec:.2f}s after process start)")
+            return value
+
+    async def aget(self) -> Any:
+        """`get` for async callers; only leaves the event loop when initialization is still needed."""
+        if self.state == "ready":
+            return self._value
+        # A single executor thread waits on the init for all async callers; parking one
+        # thread per request during warmup would starve the pool other work runs on.
+        waiter = self._waiter
+        if waiter is None or waiter.get_loop() is not asyncio.get_running_loop():
+            waiter = self._waiter = asyncio.ensure_future(asyncio.to_thread(self.get))
+            waiter.add_done_callback(self._waiter_done)
+        # Shielded: a cancelled caller must not cancel the wait the others share.
+        return await asyncio.shield(waiter)
+
+    def _waiter_done(self, waiter: "asyncio.Task") -> None:
+        if self._waiter is waiter:
+            self._waiter = None
+        if not waiter.cancelled():
+            waiter.exception()  # Retrieved here in case every caller was cancelled.
+
+    def reset(self) -> None:
+        """Forgets a failed init so the next `get` retries immediately (e.g. in a freshly forked worker)."""
+        with self._lock:
+            if self.state == "failed":
+                self.state = "pending"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "init_sec": round(self.init_sec, 3) if self.init_sec is not None else None,
+            "ready_at_sec": round(self.ready_at_sec, 3) if self.ready_at_sec is not None else None,
+        }
+
+
+_REGISTRY: Dict[str, Subsystem] = {}
+
+
+def start_warmup(names: Optional[List[str]] = None) -> None:
+    """Initializes subsystems on daemon threads, one per subsystem, so startup never waits on them."""
+    if not WARMUP_ON_STARTUP:
+        return
+    for name, subsystem in _REGISTRY.items():
+        if names is not None and name not in names:
+            continue
+        threading.Thread(target=_warm, args=(subsystem,), name=f"warmup-{name}", daemon=True).start()
+
+
+def _warm(subsystem: Subsystem) -> None:
+    try:
+        subsystem.get()
+    except HTTPException:
+        pass  # Already logged and recorded on the subsystem.
+
+
+def readiness() -> Dict[str, Any]:
+    subsystems = {name: s.status() for name, s in _REGISTRY.items()}
+    ready = all(name in _REGISTRY and _REGISTRY[name].ready for name in READY_REQUIRED)
+    return {"ready": ready, "required": READY_REQUIRED, "subsystems": subsystems, "startup": startup_stats()}
+
+
+def mark_app_imported() -> None:
+    _STARTUP["app_import_sec"] = time.time() - _PROCESS_START
+    print(f"[startup] app imported {_STARTUP['app_import_sec']:.2f}s after process start")
+
+
+def startup_stats() -> Dict[str, Any]:
+    return {
+        **{k: round(v, 3) for k, v in _STARTUP.items() if v is not None},
+        "subsystem_ready": {name: int(s.ready) for name, s in _REGISTRY.items()},
+        "subsystem_init_sec": {name: round(s.init_sec, 3) for name, s in _REGISTRY.items() if s.init_sec is not None},
+    }
+
+
+class ColdStartMiddleware:
+    """Records the time from process start to the first response sent, then stays out of the way."""
+
+    def __init__(self, app: Any):
+        self.app = app
+        self._done = False
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if self._done or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start" and not self._done:
+                self._done = True
+                _STARTUP["first_request_sec"] = time.time() - _PROCESS_START
+                print(
+                    f"[startup] first response ({scope.get('path')} {message.get('status')}) "
+                    f"{_STARTUP['first_request_sec']:.2f}s after process start"
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,263 @@
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request
+
+from helpers import metrics
+from helpers.admin import is_admin_request
+from helpers.call_ledger import CallLedger
+from helpers.deadline import RequestDeadline
+
+# Fraction of extract/lens runs recorded as replayable traces (0.01 = 1%).
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_HEADER = "X-Trace"
+TRACE_DIR = Path(os.getenv("TRACE_DIR", "traces"))
+# Uploaded images are kept so traces can be replayed; set to 0 to store hashes only.
+TRACE_STORE_IMAGES = os.getenv("TRACE_STORE_IMAGES", "1") == "1"
+TRACE_RETENTION_DAYS = float(os.getenv("TRACE_RETENTION_DAYS", "7"))
+TRACE_IMAGE_RETENTION_DAYS = float(os.getenv("TRACE_IMAGE_RETENTION_DAYS", "3"))
+TRACE_MAX_TEXT_CHARS = 200
+TRACE_QUEUE_MAX = 64
+PRUNE_EVERY_SEC = 3600.0
+
+TRACE_VERSION = 1
+# Column order of each entry in a trace's "calls" list; trailing nulls are trimmed.
+CALL_FIELDS = ("at_ms", "service", "stage", "latency_ms", "outcome", "cache", "key", "blob", "tokens_in", "tokens_out")
+
+TRACES_WRITTEN = metrics.Counter(
+    "thriftbuddy_traces_written_total",
+    "Request traces written, by flow.",
+    ("flow",),
+)
+TRACES_DROPPED = metrics.Counter(
+    "thriftbuddy_traces_dropped_total",
+    "Request traces dropped because the writer fell behind or failed.",
+)
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_URL_RE = re.compile(r"https?://\S+")
+_PHONE_RE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+
+
+def sanitize_text(text: Optional[str]) -> Optional[str]:
+    """User text with emails, URLs and phone numbers masked, truncated."""
+    if not text or not text.strip():
+        return None
+    out = _EMAIL_RE.sub("<email>", text.strip())
+    out = _URL_RE.sub("<url>", out)
+    out = _PHONE_RE.sub("<phone>", out)
+    return out[:TRACE_MAX_TEXT_CHARS]
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(root: Path, sha: str) -> Path:
+    return root / "blobs" / sha[:2] / sha
+
+
+def image_path(root: Path, sha: str) -> Path:
+    return root / "images" / sha[:2] / sha
+
+
+class RequestTrace:
+    """
+    One recorded run: sanitized inputs, every external call from the run's call
+    ledger (with response bodies stored by content hash), stage timings and
+    outcome. Written as one line of a gzipped JSONL file by a background thread.
+    """
+
+    def __init__(self, *, flow: str, reason: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.flow = flow
+        self.reason = reason
+        self.ts = time.time()
+        self.started = time.perf_counter()
+        self.inputs: Dict[str, Any] = {}
+        self._images: Dict[str, bytes] = {}
+
+    def set_inputs(
+        self,
+        *,
+        images: List[bytes],
+        content_types: List[str],
+        mode: Optional[str] = None,
+        text: Optional[str] = None,
+        itemName: Optional[str] = None,
+        budget_sec: Optional[float] = None,
+    ) -> None:
+        shas = [_sha256(b) for b in images]
+        if TRACE_STORE_IMAGES:
+            self._images = dict(zip(shas, images))
+        self.inputs = {
+            "mode": mode,
+            "img": shas,
+            "ct": content_types,
+            "text": sanitize_text(text),
+            "item": sanitize_text(itemName),
+            "budget": budget_sec,
+        }
+
+    def finish(self, *, ledger: CallLedger, deadline: Optional[RequestDeadline], outcome: str) -> None:
+        calls = []
+        for c in ledger.calls:
+            row = [
+                int(c.get("at_sec", 0.0) * 1000),
+                c["service"],
+                c.get("stage"),
+                round(c["latency_sec"] * 1000, 1) if "latency_sec" in c else None,
+                c.get("outcome", "ok"),
+                c.get("cache"),
+                c.get("key"),
+                c.get("blob"),
+                c.get("tokens_in"),
+                c.get("tokens_out"),
+            ]
+            while row and row[-1] is None:
+                row.pop()
+            calls.append(row)
+        record = {
+            "v": TRACE_VERSION,
+            "id": self.trace_id,
+            "ts": round(self.ts, 3),
+            "flow": self.flow,
+            "reason": self.reason,
+            "in": self.inputs,
+            "calls": calls,
+            "stages": dict(deadline.stage_timings) if deadline else {},
+            "degraded": [d["stage"] for d in deadline.degraded] if deadline else [],
+            "outcome": outcome,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+        try:
+            _WRITER.submit(record, dict(ledger.blobs), self._images)
+        except queue.Full:
+            TRACES_DROPPED.inc()
+            print(f"[trace] dropped id={self.trace_id}: writer queue full")
+
+
+class _TraceWriter:
+    """Single background thread, so request handlers never wait on disk."""
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def submit(self, record: Dict[str, Any], blobs: Dict[str, bytes], images: Dict[str, bytes]) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                self._thread.start()
+        self._queue.put_nowait((record, blobs, images))
+
+    def _run(self) -> None:
+        while True:
+            record, blobs, images = self._queue.get()
+            try:
+                self._write(record, blobs, images)
+                TRACES_WRITTEN.inc(flow=record["flow"])
+            except Exception as e:
+                TRACES_DROPPED.inc()
+                print(f"[trace] write failed id={record.get('id')}: {e}")
+            if time.time() - self._last_prune > PRUNE_EVERY_SEC:
+                self._last_prune = time.time()
+                prune(TRACE_DIR)
+
+    def _write(self, record: Dict[str, Any], blobs: Dict[str, bytes], images: Dict[str, bytes]) -> None:
+        for sha, data in blobs.items():
+            _store(blob_path(TRACE_DIR, sha), data, compress=True)
+        for sha, data in images.items():
+            _store(image_path(TRACE_DIR, sha), data, compress=False)
+        day = time.strftime("%Y%m%d", time.gmtime(record["ts"]))
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        # Each append is its own gzip member; gzip.open reads the concatenation.
+        with gzip.open(TRACE_DIR / f"traces-{day}.jsonl.gz", "at", encoding="utf-8") as f:
+            f.write(line)
+        print(f"[trace] wrote id={record['id']} flow={record['flow']} calls={len(record['calls'])} blobs={len(blobs)}")
+
+
+def _store(path: Path, data: bytes, *, compress: bool) -> None:
+    # Content-addressed: a blob already on disk only has its retention clock reset.
+    if compress:
+        path = path.with_suffix(".gz")
+    if path.exists():
+        os.utime(path)
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(gzip.compress(data, compresslevel=6) if compress else data)
+    tmp.replace(path)
+
+
+def read_blob(root: Path, sha: str) -> Optional[bytes]:
+    path = blob_path(root, sha)
+    if path.with_suffix(".gz").exists():
+        return gzip.decompress(path.with_suffix(".gz").read_bytes())
+    return path.read_bytes() if path.exists() else None
+
+
+def read_image(root: Path, sha: str) -> Optional[bytes]:
+    path = image_path(root, sha)
+    return path.read_bytes() if path.exists() else None
+
+
+def read_traces(root: Path) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    for path in sorted(Path(root).glob("traces-*.jsonl.gz")):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def call_rows(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Expands a trace's compact call rows back into dicts."""
+    return [dict(zip(CALL_FIELDS, row)) for row in record.get("calls", [])]
+
+
+def prune(root: Path) -> None:
+    now = time.time()
+    removed = 0
+    for path in root.glob("traces-*.jsonl.gz"):
+        if now - path.stat().st_mtime > TRACE_RETENTION_DAYS * 86400:
+            path.unlink(missing_ok=True)
+            removed += 1
+    for sub, days in (("blobs", TRACE_RETENTION_DAYS), ("images", TRACE_IMAGE_RETENTION_DAYS)):
+        for path in (root / sub).glob("*/*"):
+            if now - path.stat().st_mtime > days * 86400:
+                path.unlink(missing_ok=True)
+                removed += 1
+    if removed:
+        print(f"[trace] retention removed {removed} files")
+
+
+_WRITER = _TraceWriter()
+
+
+def maybe_start_trace(request: Optional[Request], *, flow: str) -> Optional[RequestTrace]:
+    """
+    Starts a trace when the request carries `X-Trace: 1` with a valid admin token,
+    or when it is picked by TRACE_SAMPLE_RATE.
+    """
+    if request is not None and request.headers.get(TRACE_HEADER) == "1" and is_admin_request(request):
+        reason = "admin"
+    elif TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE:
+        reason = "sampled"
+    else:
+        return None
+    return RequestTrace(flow=flow, reason=reason)
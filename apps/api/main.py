@@ -1,22 +1,38 @@
 import asyncio
-import importlib.util
 import os
-from pathlib import Path
 from typing import List, Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, Form, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from openai import OpenAI
 
 from auth.routes import router as auth_router
-from helpers import image_processing
+from helpers import (
+    http_pool,
+    image_processing,
+    job_service,
+    loop_monitor,
+    marketplace_client,
+    memory,
+    metrics,
+    result_cache,
+    stream_compression,
+    subsystems,
+)
+from helpers.admin import require_admin
+from helpers.admission import EXTRACT_ADMISSION, LENS_ADMISSION
+from helpers.batch_service import build_extract_batch_stream_response
+from helpers.cancellation import cancellation_stats
+from helpers.embed_batcher import batcher_stats
 from helpers.extract_stream_service import build_extract_file_stream_response
 from helpers.lens_service import build_extract_file_stream_lens_guided_response
 
 
 app = FastAPI()
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
+app.add_middleware(subsystems.ColdStartMiddleware)
 
 load_dotenv()
 
@@ -35,54 +51,166 @@ app.add_middleware(
 )
 
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-_CLIP_SERVICE = None
-
+# Raises without OPENAI_API_KEY; built lazily so that only the LLM-backed routes fail.
+OPENAI = subsystems.Subsystem("openai", lambda: OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
 
-def _load_clip_service_module():
-    clip_path = Path(__file__).resolve().parent / "clip-service" / "clip_service.py"
-    spec = importlib.util.spec_from_file_location("api_clip_service", str(clip_path))
-    if spec is None or spec.loader is None:
-        raise RuntimeError(f"Unable to load clip service module at {clip_path}")
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
+metrics.register_stats("thriftbuddy_cancellation", cancellation_stats)
+metrics.register_stats("thriftbuddy_embed_batcher", batcher_stats)
+metrics.register_stats("thriftbuddy_admission", EXTRACT_ADMISSION.snapshot, endpoint="extract")
+metrics.register_stats("thriftbuddy_admission", LENS_ADMISSION.snapshot, endpoint="lens")
+metrics.register_stats("thriftbuddy_process", memory.process_memory_stats)
+metrics.register_stats("thriftbuddy_cache", image_processing.thumb_cache_stats, cache="thumb_embed")
+metrics.register_stats("thriftbuddy_cache", marketplace_client.serp_cache_stats, cache="serp")
+metrics.register_stats("thriftbuddy_cache", marketplace_client.lens_cache_stats, cache="lens")
+metrics.register_stats("thriftbuddy_cache", result_cache.result_cache_stats, cache="result")
+metrics.register_stats("thriftbuddy_startup", subsystems.startup_stats)
+metrics.register_stats("thriftbuddy_ndjson_compression", stream_compression.compression_stats)
 
 
 @app.on_event("startup")
-async def startup_clip_service() -> None:
-    global _CLIP_SERVICE
-    _CLIP_SERVICE = _load_clip_service_module()
-    image_processing.set_clip_service(_CLIP_SERVICE)
-    await asyncio.to_thread(_CLIP_SERVICE.warm_model)
+async def startup_subsystems() -> None:
+    # CLIP, R2 and the DB warm up in the background; requests that need one wait for it.
+    loop_monitor.start_loop_monitor()
+    subsystems.start_warmup()
+    try:
+        job_service.start_workers(openai_client=OPENAI.get())
+    except HTTPException as e:
+        print(f"[startup] job workers not started: {e.detail}")
+
+
+@app.on_event("shutdown")
+async def shutdown_http_clients() -> None:
+    await job_service.stop_workers()
+    await http_pool.close_clients()
+    await loop_monitor.stop_loop_monitor()
+
+
+@app.get("/ready")
+async def ready():
+    status = subsystems.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/debug/heap")
+async def debug_heap(request: Request, limit: int = 25):
+    # Read-only: diffs against the current baseline without moving it.
+    require_admin(request)
+    return await asyncio.to_thread(memory.heap_diff, rebase=False, limit=limit)
+
+
+@app.post("/debug/heap")
+async def debug_heap_action(request: Request, action: str, limit: int = 25):
+    """start: begin tracing and take the baseline; rebase: diff, then move the baseline; stop: end tracing."""
+    require_admin(request)
+    if action not in ("start", "stop", "rebase"):
+        raise HTTPException(status_code=400, detail="action must be start|stop|rebase")
+    return await asyncio.to_thread(
+        memory.heap_diff, start=action == "start", stop=action == "stop", rebase=True, limit=limit
+    )
+
+
+@app.get("/debug/loop-stalls")
+async def debug_loop_stalls(request: Request, limit: int = 20):
+    require_admin(request)
+    return {
+        "enabled": loop_monitor.LOOP_MONITOR_ENABLED,
+        "threshold_sec": loop_monitor.LOOP_STALL_THRESHOLD_SEC,
+        "stalls": loop_monitor.recent_stalls(limit),
+    }
 
 
 @app.post("/extract-file-stream")
 async def extract_from_files_stream(
+    request: Request,
     main_image: UploadFile = File(...),
     files: List[UploadFile] = File([]),
     itemName: Optional[str] = Form(None),
     text: Optional[str] = Form(None),
     mode: str = Form("active"),
+    budget_sec: Optional[float] = Form(None),
+    fields: Optional[str] = Form(None),
+    listing_limit: Optional[int] = Form(None),
+    listing_format: Optional[str] = Form(None),
 ):
     return await build_extract_file_stream_response(
-        openai_client=openai_client,
+        openai_client=await OPENAI.aget(),
+        main_image=main_image,
+        files=files,
+        itemName=itemName,
+        text=text,
+        mode=mode,
+        budget_sec=budget_sec,
+        request=request,
+        fields=fields,
+        listing_limit=listing_limit,
+        listing_format=listing_format,
+    )
+
+
+@app.post("/extract-batch-stream")
+async def extract_batch_stream(request: Request):
+    # Multipart with a JSON `manifest` field; see batch_service.parse_batch_manifest.
+    return await build_extract_batch_stream_response(
+        openai_client=await OPENAI.aget(),
+        request=request,
+    )
+
+
+@app.post("/jobs")
+async def submit_extract_job(
+    main_image: UploadFile = File(...),
+    files: List[UploadFile] = File([]),
+    itemName: Optional[str] = Form(None),
+    text: Optional[str] = Form(None),
+    mode: str = Form("active"),
+    budget_sec: Optional[float] = Form(None),
+    fields: Optional[str] = Form(None),
+    listing_limit: Optional[int] = Form(None),
+    listing_format: Optional[str] = Form(None),
+):
+    return await job_service.submit_job(
         main_image=main_image,
         files=files,
         itemName=itemName,
         text=text,
         mode=mode,
+        budget_sec=budget_sec,
+        fields=fields,
+        listing_limit=listing_limit,
+        listing_format=listing_format,
     )
 
 
+@app.get("/jobs/{job_id}")
+async def get_extract_job(job_id: str):
+    return await job_service.get_job_status(job_id)
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_extract_job_events(job_id: str, request: Request, after: int = -1):
+    return await job_service.stream_job_events(job_id, request=request, after_seq=after)
+
+
 @app.post("/extract-file-stream-lens")
 async def extract_file_stream_lens_guided(
+    request: Request,
     main_image: UploadFile = File(...),
     files: List[UploadFile] = File([]),
     text: Optional[str] = Form(None),
+    stream: bool = Form(False),
 ):
     return await build_extract_file_stream_lens_guided_response(
         main_image=main_image,
         files=files,
         text=text,
+        request=request,
+        stream=stream,
     )
+
+
+subsystems.mark_app_imported()
@@ -0,0 +1,139 @@
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, Optional
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("PORT", "8000"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "2"))
+# 1 loads CLIP once in this process and forks workers that share its pages copy-on-write.
+SERVE_PRELOAD = os.getenv("SERVE_PRELOAD", "1") == "1"
+# Torch intra-op threads per worker; default splits the cores evenly across workers.
+SERVE_TORCH_THREADS = int(os.getenv("SERVE_TORCH_THREADS", "0"))
+# A worker dying sooner than this after start counts as a crash loop.
+MIN_WORKER_UPTIME_SEC = 10.0
+MAX_QUICK_RESTARTS = 5
+
+
+def _preload() -> Any:
+    """
+    Imports the app and loads CLIP before forking. Torch runs single-threaded here so
+    no OpenMP pool exists at fork time; each worker sets its own thread count after.
+    Only CLIP is preloaded: R2, DB and OpenAI clients hold sockets and are built per worker.
+    """
+    os.environ["TORCH_NUM_THREADS"] = "1"
+    import main
+    from fastapi import HTTPException
+
+    from helpers import image_processing
+
+    start = time.perf_counter()
+    try:
+        image_processing.CLIP.get()
+        print(f"[serve] preloaded clip in {time.perf_counter() - start:.1f}s")
+    except HTTPException as e:
+        image_processing.CLIP.reset()
+        print(f"[serve] preload failed, workers will load clip themselves: {e.detail}")
+    # Moves everything allocated so far out of the collector's reach, so gc passes in
+    # the workers do not write to (and un-share) the preloaded objects' pages.
+    gc.collect()
+    gc.freeze()
+    return main.app
+
+
+def _run_worker(sock: socket.socket, app: Any, index: int, threads: int) -> None:
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    random.seed()  # Forked workers would otherwise share sampling decisions.
+    os.environ["TORCH_NUM_THREADS"] = str(threads)
+    if app is not None:
+        from helpers import image_processing
+
+        if image_processing.CLIP.ready:
+            image_processing.CLIP.get().configure_threads(threads)
+    print(f"[serve] worker {index} pid={os.getpid()} torch_threads={threads}")
+    config = uvicorn.Config(app if app is not None else "main:app", lifespan="on", proxy_headers=True)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main() -> None:
+    """
+    Runs the API as a master process plus forked uvicorn workers on one shared socket.
+    With preload, CLIP weights are loaded once and shared copy-on-write, so each extra
+    worker costs its private memory only; compare pss_bytes/rss_bytes on /metrics.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=SERVE_PRELOAD)
+    parser.add_argument("--torch-threads", type=int, default=SERVE_TORCH_THREADS)
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    threads = args.torch_threads or max(1, (os.cpu_count() or 1) // workers)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    print(f"[serve] listening on {args.host}:{args.port} workers={workers} preload={args.preload} torch_threads={threads}")
+
+    app = _preload() if args.preload else None
+    children: Dict[int, tuple] = {}
+    stopping = False
+    quick_restarts = 0
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(sock, app, index, threads)
+            finally:
+                os._exit(0)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum: int, _frame: Optional[Any]) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(workers):
+        spawn(i)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid)
+        if stopping:
+            continue
+        uptime = time.monotonic() - started
+        print(f"[serve] worker {index} pid={pid} exited status={status} after {uptime:.0f}s; restarting")
+        quick_restarts = quick_restarts + 1 if uptime < MIN_WORKER_UPTIME_SEC else 0
+        if quick_restarts > MAX_QUICK_RESTARTS:
+            print("[serve] workers keep crashing on start; shutting down")
+            stop(signal.SIGTERM, None)
+            continue
+        spawn(index)
+    sock.close()
+    sys.exit(1 if quick_restarts > MAX_QUICK_RESTARTS else 0)
+
+
+if __name__ == "__main__":
+    main()
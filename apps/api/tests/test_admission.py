@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from helpers import admission, batch_service
+
+
+def test_waiters_are_admitted_in_fifo_order():
+    async def main():
+        ctl = admission.AdmissionController("t", limit=1, max_queue=5)
+        order = []
+        first = ctl.enqueue()
+        assert first.admitted
+
+        async def request(name):
+            async with ctl.slot():
+                order.append(name)
+                await asyncio.sleep(0)
+
+        tasks = [asyncio.create_task(request(n)) for n in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        assert ctl.snapshot()["queued"] == 3
+        first.release()
+        await asyncio.gather(*tasks)
+        return order, ctl.snapshot()
+
+    order, snap = asyncio.run(main())
+    assert order == ["a", "b", "c"]
+    assert snap["active"] == 0 and snap["queued"] == 0 and snap["admitted"] == 4
+
+
+def test_full_queue_rejects_with_retry_after():
+    async def main():
+        ctl = admission.AdmissionController("t", limit=2, max_queue=1)
+        ctl._avg_hold_sec = 4.0
+        held = [ctl.enqueue(), ctl.enqueue()]
+        queued = ctl.enqueue()
+        with pytest.raises(HTTPException) as exc:
+            ctl.enqueue()
+        for t in (*held, queued):
+            t.release()
+        return exc.value, ctl.snapshot()
+
+    err, snap = asyncio.run(main())
+    assert err.status_code == 429
+    # One waiter ahead plus this request, through two slots of ~4s each.
+    assert err.headers["Retry-After"] == "4"
+    assert err.detail["retry_after_sec"] == 4
+    assert snap["rejected"] == 1
+
+
+def test_abandoned_waiter_is_skipped():
+    async def main():
+        ctl = admission.AdmissionController("t", limit=1, max_queue=5)
+        holder = ctl.enqueue()
+        gone = ctl.enqueue()
+        waiting = ctl.enqueue()
+        gone.release()
+        holder.release()
+        holder.release()  # Idempotent: must not free a second slot.
+        await asyncio.wait_for(waiting.wait(), 1.0)
+        return gone, waiting, ctl.snapshot()
+
+    gone, waiting, snap = asyncio.run(main())
+    assert not gone.admitted and waiting.admitted
+    assert snap["active"] == 1 and snap["abandoned"] == 1
+
+
+def test_batch_item_rejected_by_admission_reports_an_error_event(monkeypatch):
+    async def main():
+        ctl = admission.AdmissionController("extract", limit=1, max_queue=0)
+        monkeypatch.setattr(batch_service, "EXTRACT_ADMISSION", ctl)
+        busy = ctl.enqueue()
+        queue: asyncio.Queue = asyncio.Queue()
+        stats = {}
+        await batch_service._run_item(
+            {"item_id": "a1"},
+            openai_client=None,
+            budget_sec=None,
+            sem=asyncio.Semaphore(1),
+            queue=queue,
+            item_deadlines=[],
+            stats=stats,
+        )
+        busy.release()
+        return [queue.get_nowait() for _ in range(queue.qsize())], stats
+
+    events, stats = asyncio.run(main())
+    assert stats == {"error": 1}
+    assert events[-1] is batch_service._ITEM_DONE
+    events = events[:-1]
+    assert [(e["item_id"], e["type"]) for e in events] == [("a1", "error")]
+    assert events[0]["error"]["error"] == "Server is busy, please retry"
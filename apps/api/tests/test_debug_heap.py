@@ -0,0 +1,47 @@
+import asyncio
+import tracemalloc
+
+import httpx
+import pytest
+
+from helpers import admin
+
+HEADERS = {admin.ADMIN_HEADER: "secret"}
+
+
+@pytest.fixture
+def call(monkeypatch):
+    import main
+
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+
+    def request(method, **params):
+        async def send():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+                return await client.request(method, "/debug/heap", params=params, headers=HEADERS)
+
+        return asyncio.run(send())
+
+    yield request
+    request("POST", action="stop")
+
+
+def test_get_never_changes_tracing_state(call):
+    assert call("GET", start=1).json()["tracing"] is False
+    assert not tracemalloc.is_tracing()
+
+
+def test_post_actions_drive_tracing_and_get_keeps_the_baseline(call):
+    assert call("POST", action="start").json()["tracing"] is True
+    kept = [bytearray(64 * 1024) for _ in range(16)]
+    first = call("GET").json()["top_growth"]
+    second = call("GET").json()["top_growth"]
+    # Same baseline both times, so the retained allocations show up in each diff.
+    assert sum(t["size_diff_bytes"] for t in first) >= 1_000_000
+    assert sum(t["size_diff_bytes"] for t in second) >= 1_000_000
+    call("POST", action="rebase")
+    assert sum(t["size_diff_bytes"] for t in call("GET").json()["top_growth"]) < 1_000_000
+    assert call("POST", action="stop").json() == {"tracing": False}
+    assert call("POST", action="bogus").status_code == 400
+    del kept
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+from helpers import embed_batcher
+
+
+class FakeModel:
+    def __init__(self, block: bool = False):
+        self.block = block
+        self.batches = []
+        self.cancel_events = []
+        self.started = threading.Event()
+
+    def __call__(self, images, crops, cancel_event):
+        self.batches.append(list(images))
+        self.cancel_events.append(cancel_event)
+        self.started.set()
+        if self.block:
+            # Like the CLIP service: stop at the next crop boundary once nobody waits.
+            cancel_event.wait(2.0)
+        return [[[float(len(b))] * 2] for b in images]
+
+
+def test_concurrent_requests_share_one_model_batch():
+    model = FakeModel()
+
+    async def main():
+        batcher = embed_batcher.EmbedBatcher(model)
+        return await asyncio.gather(batcher.embed([b"a", b"bb"], [1.0]), batcher.embed([b"ccc"], [1.0]))
+
+    first, second = asyncio.run(main())
+    assert first == [[[1.0, 1.0]], [[2.0, 2.0]]]
+    assert second == [[[3.0, 3.0]]]
+    assert model.batches == [[b"a", b"bb", b"ccc"]]
+
+
+def test_jobs_cancelled_before_the_batch_runs_are_released():
+    model = FakeModel()
+
+    async def main():
+        batcher = embed_batcher.EmbedBatcher(model)
+        dropped = asyncio.create_task(batcher.embed([b"gone"], [1.0]))
+        await asyncio.sleep(0)
+        dropped.cancel()
+        kept = await batcher.embed([b"kept"], [1.0])
+        return kept
+
+    released = embed_batcher.batcher_stats()["jobs_released"]
+    assert asyncio.run(main()) == [[[4.0, 4.0]]]
+    assert model.batches == [[b"kept"]]
+    assert embed_batcher.batcher_stats()["jobs_released"] == released + 1
+
+
+def test_running_batch_is_signalled_once_every_waiter_is_cancelled():
+    model = FakeModel(block=True)
+
+    async def main():
+        batcher = embed_batcher.EmbedBatcher(model)
+        waiters = [asyncio.create_task(batcher.embed([b"x"], [1.0])) for _ in range(2)]
+        await asyncio.to_thread(model.started.wait, 2.0)
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        half_cancelled = model.cancel_events[0].is_set()
+        waiters[1].cancel()
+        await asyncio.sleep(0.01)
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return half_cancelled
+
+    assert asyncio.run(main()) is False
+    assert model.cancel_events[0].is_set()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import pytest
+
+from helpers import job_queue, job_service
+
+
+@pytest.fixture(autouse=True)
+def job_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_DB_PATH", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(job_queue, "JOB_STALE_SEC", 60.0)
+    clock = {"now": 1_000.0}
+    monkeypatch.setattr(job_queue.time, "time", lambda: clock["now"])
+    return clock
+
+
+def _enqueue():
+    return job_queue.enqueue_job(
+        main_bytes=b"img",
+        main_content_type="image/jpeg",
+        extra_bytes=[b"extra"],
+        extra_content_types=["image/png"],
+        params={"mode": "active"},
+    )
+
+
+def _lines(rows):
+    return [json.loads(line) for _, line in rows]
+
+
+def test_claim_is_fifo_and_exclusive(job_db):
+    first = _enqueue()
+    job_db["now"] += 1
+    second = _enqueue()
+    job = job_queue.claim_next_job("w1")
+    assert job["id"] == first
+    assert job["extra_bytes"] == [b"extra"] and job["next_seq"] == 0
+    assert job_queue.claim_next_job("w2")["id"] == second
+    assert job_queue.claim_next_job("w3") is None
+
+
+def test_heartbeat_keeps_a_long_stage_from_being_reclaimed(job_db):
+    job_id = _enqueue()
+    job_queue.claim_next_job("w1")
+    for _ in range(3):
+        job_db["now"] += 45
+        assert job_queue.heartbeat(job_id, "w1")
+    assert job_queue.claim_next_job("w2") is None
+
+
+def test_stale_job_is_retried_and_followers_keep_their_place(job_db):
+    job_id = _enqueue()
+    job_queue.claim_next_job("w1")
+    for seq in range(3):
+        assert job_queue.append_event(job_id, "w1", seq, json.dumps({"type": "step", "n": seq}))
+    rows, status = job_queue.get_events(job_id)
+    last_seq = rows[-1][0]
+
+    job_db["now"] += 61
+    retry = job_queue.claim_next_job("w2")
+    assert retry["id"] == job_id and retry["attempts"] == 2 and retry["next_seq"] == 3
+
+    # The old worker is fenced off.
+    assert not job_queue.append_event(job_id, "w1", 3, json.dumps({"type": "step"}))
+    assert not job_queue.finish_job(job_id, "w1", status="done", result={"stale": True})
+
+    for seq, event in enumerate(({"type": "retry", "attempt": 2}, {"type": "step", "n": 0}), start=retry["next_seq"]):
+        assert job_queue.append_event(job_id, "w2", seq, json.dumps(event))
+    rows, status = job_queue.get_events(job_id, after_seq=last_seq)
+    assert status == "running"
+    assert _lines(rows) == [{"type": "retry", "attempt": 2}, {"type": "step", "n": 0}]
+
+    assert job_queue.finish_job(job_id, "w2", status="done", result={"ok": True})
+    job = job_queue.get_job(job_id)
+    assert job["status"] == "done" and job["result"] == {"ok": True} and job["events"] == 5
+
+
+def test_job_abandoned_past_max_attempts_fails(job_db, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 1)
+    job_id = _enqueue()
+    job_queue.claim_next_job("w1")
+    job_db["now"] += 61
+    assert job_queue.claim_next_job("w2") is None
+    job = job_queue.get_job(job_id)
+    assert job["status"] == "error" and job["result"] == {"error": "Job abandoned by its worker"}
+
+
+def test_retried_run_job_emits_retry_and_continues_numbering(job_db, monkeypatch):
+    async def fake_events(**kwargs):
+        yield {"type": "step", "step_id": "gen_query"}
+        yield {"type": "result", "data": {"mode": kwargs["mode"]}}
+
+    monkeypatch.setattr(job_service, "run_extract_events", fake_events)
+    job_id = _enqueue()
+    job_queue.claim_next_job("w1")
+    job_queue.append_event(job_id, "w1", 0, json.dumps({"type": "step", "step_id": "gen_query"}))
+    job_db["now"] += 61
+    job = job_queue.claim_next_job("w2")
+
+    asyncio.run(job_service._run_job(job, openai_client=None, worker_id="w2"))
+
+    rows, status = job_queue.get_events(job_id, after_seq=0)
+    assert status == "done"
+    assert [seq for seq, _ in rows] == [1, 2, 3]
+    assert [e["type"] for e in _lines(rows)] == ["retry", "step", "result"]
+    assert job_queue.get_job(job_id)["result"] == {"mode": "active"}
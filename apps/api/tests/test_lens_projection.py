@@ -0,0 +1,48 @@
+import pytest
+
+from helpers import lens_projection
+
+VARIANT_PAIRS = [
+    ("Sony WH-1000XM4 Headphones", "Sony WH-1000XM5 Headphones"),
+    ("Apple iPhone 13 - 128GB", "Apple iPhone 13 - 256GB"),
+    ("Nike Air Force 1 Low White - Size 10", "Nike Air Force 1 Low White - Size 12"),
+    (
+        "Apple iPhone 13 Pro Max Unlocked Graphite Excellent Condition Original Box Charger Case Screen Protector 128GB",
+        "Apple iPhone 13 Pro Max Unlocked Graphite Excellent Condition Original Box Charger Case Screen Protector 256GB",
+    ),
+]
+
+
+@pytest.mark.parametrize("a,b", VARIANT_PAIRS)
+def test_model_variants_are_not_duplicates(a, b):
+    words = lens_projection.title_words(a)
+    assert lens_projection.find_duplicate(words, [lens_projection.title_words(b)]) is None
+
+
+@pytest.mark.parametrize(
+    "title,expected",
+    [
+        ("Sony WH-1000XM4 Headphones", "sony wh 1000xm4 headphones"),
+        ("Apple iPhone 13 - 128GB", "apple iphone 13 128gb"),
+        ("Sony Walkman WM-10 Cassette - eBay", "sony walkman wm 10 cassette"),
+        ("Sony Walkman WM-10 Cassette | Mercari", "sony walkman wm 10 cassette"),
+        ("Sony Walkman WM-10 Cassette at Goodwill Finds", "sony walkman wm 10 cassette"),
+    ],
+)
+def test_title_words_strips_only_store_suffixes(title, expected):
+    assert lens_projection.title_words(title) == frozenset(expected.split())
+
+
+def test_store_suffix_variants_collapse_in_projection():
+    lens_json = {
+        "visual_matches": [
+            {"title": "Sony WH-1000XM4 Headphones - eBay", "source": "eBay"},
+            {"title": "Sony WH-1000XM4 Headphones | Mercari", "source": "Mercari"},
+            {"title": "Sony WH-1000XM5 Headphones - eBay", "source": "eBay"},
+        ]
+    }
+    projected, stats = lens_projection.project_lens_json(lens_json)
+    titles = [e["title"] for e in projected["visual_matches"]]
+    assert titles == ["Sony WH-1000XM4 Headphones - eBay", "Sony WH-1000XM5 Headphones - eBay"]
+    assert projected["visual_matches"][0]["dups"] == 2
+    assert stats["duplicates_merged"] == 1
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from helpers import lens_service
+from helpers.deadline import RequestDeadline
+
+
+class BlockingOpenAI:
+    """Sync client like the OpenAI SDK: create() blocks the calling thread."""
+
+    def __init__(self):
+        self.calls = []
+        self.responses = SimpleNamespace(create=self._create)
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        time.sleep(0.2)
+        return SimpleNamespace(output_text=json.dumps({"item": "Sony Walkman WM-10"}), usage=None)
+
+
+def test_discern_runs_off_the_loop_with_a_deadline_timeout():
+    client = BlockingOpenAI()
+    lens_json = {"visual_matches": [{"title": "Sony Walkman WM-10 - eBay", "thumbnail": "https://x/t.jpg"}]}
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        t = asyncio.create_task(ticker())
+        out = await lens_service.gpt_discern_item_from_lens(
+            openai_client=client, lens_json=lens_json, deadline=RequestDeadline(5.0)
+        )
+        t.cancel()
+        return out, ticks
+
+    out, ticks = asyncio.run(main())
+    assert ticks >= 5  # The loop kept running while the model call was in flight.
+    assert out["item"] == "Sony Walkman WM-10"
+    assert out["lens_projection"]["entries_after"] == 1
+    assert 0 < client.calls[0]["timeout"] <= 5.0
+    assert '"thumbnail"' not in client.calls[0]["input"]
+
+
+def test_view_searches_share_the_pooled_serp_client(monkeypatch):
+    seen = []
+
+    async def fake_search(http, *, image_url, q=None, image_sha=None, timeout=None):
+        seen.append((http, timeout))
+        return {"visual_matches": []}
+
+    monkeypatch.setattr(lens_service, "serp_lens_search", fake_search)
+
+    async def main():
+        await asyncio.gather(
+            *(lens_service.fetch_google_lens_results(image_url=f"https://r2/{i}.jpg") for i in range(4))
+        )
+        return lens_service.http_pool.get_client("serp")
+
+    pooled = asyncio.run(main())
+    assert len(seen) == 4
+    assert all(http is pooled for http, _ in seen)
+    assert all(timeout is not None for _, timeout in seen)
+
+
+def test_merge_matches_image_then_link_then_strict_title():
+    views = [
+        {
+            "view": 0,
+            "candidates": [
+                {"title": "Sony WH-1000XM4 Headphones", "image": "a", "link": "L1"},
+                {"title": "Sony WH-1000XM5 Headphones", "image": "b", "link": "L2"},
+            ],
+        },
+        {
+            "view": 1,
+            "candidates": [
+                {"title": "Unrelated caption", "image": "z", "link": "L1"},
+                {"title": "Sony WH-1000XM5 Headphones - eBay", "image": "y", "link": None},
+                {"title": "Sony WH-1000XM5 Headphones", "image": "x", "link": None},
+                {"title": "Sony WH-1000XM3 Headphones", "image": "w", "link": None},
+            ],
+        },
+    ]
+    merged = lens_service.merge_view_candidates(views)
+    by_image = {c["image"]: c for c in merged}
+    assert by_image["a"]["views"] == [0, 1]  # Same link.
+    assert by_image["b"]["views"] == [0, 1]  # Same title once the store suffix is gone.
+    assert by_image["x"]["views"] == [1]  # One view's own list is never folded together.
+    assert by_image["w"]["views"] == [1]  # Different model number.
+    assert [c["id"] for c in merged] == [f"lens_{i}" for i in range(len(merged))]
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import httpx
+
+from helpers import admin, loop_monitor
+
+
+def _blocking_ranker():
+    time.sleep(0.4)
+
+
+def test_stall_is_recorded_with_its_call_site(monkeypatch):
+    async def main():
+        monitor = loop_monitor.LoopMonitor(interval_sec=0.02, threshold_sec=0.15)
+        monkeypatch.setattr(loop_monitor, "_MONITOR", monitor)
+        monitor.start()
+        await asyncio.sleep(0.1)
+        _blocking_ranker()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+        return loop_monitor.recent_stalls()
+
+    stalls = asyncio.run(main())
+    assert stalls
+    assert stalls[0]["site"] == "test_loop_monitor.py:_blocking_ranker"
+    assert stalls[0]["duration_sec"] >= 0.15
+    assert any("_blocking_ranker" in line for line in stalls[0]["stack"])
+
+
+def test_stalls_endpoint_is_admin_only_and_newest_first(monkeypatch):
+    import main
+
+    monitor = loop_monitor.LoopMonitor(interval_sec=0.1, threshold_sec=0.25)
+    for i in range(3):
+        monitor.stalls.append({"at": i, "duration_sec": 0.3, "site": f"s{i}", "stack": []})
+    monkeypatch.setattr(loop_monitor, "_MONITOR", monitor)
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+
+    async def get(headers):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            return await client.get("/debug/loop-stalls", params={"limit": 2}, headers=headers)
+
+    assert asyncio.run(get({})).status_code == 404
+    resp = asyncio.run(get({admin.ADMIN_HEADER: "secret"}))
+    assert resp.status_code == 200
+    assert [s["site"] for s in resp.json()["stalls"]] == ["s2", "s1"]
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from helpers import marketplace_client
+
+
+@pytest.fixture(autouse=True)
+def serp_env(monkeypatch):
+    monkeypatch.setenv("SERPAPI_API_KEY", "test")
+    marketplace_client._SERP_CACHE.clear()
+    marketplace_client._SERP_INFLIGHT.clear()
+    fetches = []
+
+    async def fake_fetch(http, params, timeout):
+        fetches.append(params["_nkw"])
+        await asyncio.sleep(0.05)
+        return json.dumps({"organic_results": [{"title": params["_nkw"]}]}).encode()
+
+    monkeypatch.setattr(marketplace_client, "_fetch_serp_bytes", fake_fetch)
+    yield fetches
+    marketplace_client._SERP_CACHE.clear()
+    marketplace_client._SERP_INFLIGHT.clear()
+
+
+def test_concurrent_identical_searches_share_one_call(serp_env):
+    async def main():
+        return await asyncio.gather(*(marketplace_client.serp_search(None, q="walkman", sold=False) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert serp_env == ["walkman"]
+    assert all(r == {"organic_results": [{"title": "walkman"}]} for r in results)
+
+
+def test_search_joining_after_last_waiter_cancelled_starts_a_fresh_call(serp_env):
+    async def main():
+        first = asyncio.create_task(marketplace_client.serp_search(None, q="walkman", sold=False))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        # Let `first` handle its cancellation, but not the shared task's done callback.
+        await asyncio.sleep(0)
+        result = await marketplace_client.serp_search(None, q="walkman", sold=False)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return result
+
+    assert asyncio.run(main()) == {"organic_results": [{"title": "walkman"}]}
+    assert serp_env == ["walkman", "walkman"]
+    assert not marketplace_client._SERP_INFLIGHT
+
+
+def test_completed_search_is_served_from_cache(serp_env):
+    async def main():
+        await marketplace_client.serp_search(None, q="walkman", sold=True)
+        return await marketplace_client.serp_search(None, q="Walkman ", sold=True)
+
+    assert asyncio.run(main())["organic_results"][0]["title"] == "walkman"
+    assert serp_env == ["walkman"]
@@ -0,0 +1,32 @@
+import pytest
+from starlette.requests import Request
+
+from helpers import admin, profiler, trace_recorder
+from helpers.deadline import RequestDeadline
+
+
+def _request(headers):
+    raw = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": raw})
+
+
+@pytest.fixture(autouse=True)
+def admin_token(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(trace_recorder, "TRACE_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(profiler, "PROFILE_SAMPLE_RATE", 0.0)
+
+
+@pytest.mark.parametrize("value", ["0", "false", "no", "yes", " 1"])
+def test_only_exactly_1_opts_in(value):
+    headers = {admin.ADMIN_HEADER: "secret", trace_recorder.TRACE_HEADER: value, profiler.PROFILE_HEADER: value}
+    assert trace_recorder.maybe_start_trace(_request(headers), flow="extract") is None
+    assert profiler.maybe_start_profile(_request(headers), RequestDeadline(5.0)) is None
+
+
+def test_trace_needs_header_and_admin_token():
+    assert trace_recorder.maybe_start_trace(_request({trace_recorder.TRACE_HEADER: "1"}), flow="extract") is None
+    trace = trace_recorder.maybe_start_trace(
+        _request({trace_recorder.TRACE_HEADER: "1", admin.ADMIN_HEADER: "secret"}), flow="extract"
+    )
+    assert trace is not None and trace.reason == "admin"
@@ -0,0 +1,67 @@
+import pytest
+
+from helpers import result_cache
+
+
+@pytest.fixture(autouse=True)
+def clean_cache(monkeypatch):
+    result_cache._RESULT_CACHE.clear()
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_ACTIVE_TTL_SEC", 100)
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_SOLD_TTL_SEC", 1000)
+    clock = {"now": 10_000.0}
+    monkeypatch.setattr(result_cache.time, "time", lambda: clock["now"])
+    yield clock
+    result_cache._RESULT_CACHE.clear()
+
+
+def _store(mode, *, active=True, sold=True):
+    ranked = {"filtered_items": [{"title": "walkman", "_thumb_embedding": [0.1]}], "n": 1}
+    result_cache.store(
+        "k",
+        mode=mode,
+        events=[{"type": "step", "step_id": "s"}, {"type": "result", "data": {"mode": mode}}],
+        outcome={
+            "initial_query": "q",
+            "refined_query": "q2",
+            "active_ranked": ranked if active else None,
+            "sold_ranked": ranked if sold else None,
+        },
+    )
+
+
+def test_exact_mode_hit_until_its_ttl(clean_cache):
+    _store("active")
+    assert result_cache.lookup("k", mode="active")["mode"] == "active"
+    assert result_cache.lookup("k", mode="sold") is None
+    clean_cache["now"] += 100
+    assert result_cache.lookup("k", mode="active") is None
+    assert not result_cache._RESULT_CACHE
+
+
+def test_both_entry_answers_each_side_under_its_own_ttl(clean_cache):
+    _store("both")
+    assert result_cache.lookup("k", mode="active")["mode"] == "both"
+    assert result_cache.lookup("k", mode="sold")["mode"] == "both"
+    clean_cache["now"] += 150
+    assert result_cache.lookup("k", mode="active") is None
+    assert result_cache.lookup("k", mode="sold")["mode"] == "both"
+    assert result_cache.lookup("k", mode="both") is None
+
+
+def test_both_entry_without_a_side_does_not_answer_it():
+    _store("both", sold=False)
+    assert result_cache.lookup("k", mode="active") is not None
+    assert result_cache.lookup("k", mode="sold") is None
+
+
+def test_stored_ranked_lists_drop_embeddings():
+    _store("active")
+    entry = result_cache.lookup("k", mode="active")
+    assert entry["active_ranked"]["filtered_items"] == [{"title": "walkman"}]
+
+
+def test_lru_bound(monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_MAX_ENTRIES", 2)
+    for mode in ("active", "sold", "both"):
+        _store(mode)
+    assert list(result_cache._RESULT_CACHE) == ["k:sold", "k:both"]
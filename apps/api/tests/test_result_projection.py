@@ -0,0 +1,110 @@
+import copy
+
+import pytest
+from fastapi import HTTPException
+
+from helpers import output_builder
+from helpers.extract_stream_service import parse_result_view
+
+
+def _listing(i):
+    image = f"https://i.ebayimg.com/images/g/x{i}/s-l800.jpg"
+    return {
+        "product_id": f"p{i}",
+        "title": f"Sony Walkman WM-{i}",
+        "link": f"https://www.ebay.com/itm/{i}" if i % 3 else f"https://example.com/{i}",
+        "thumbnail": image if i % 2 else f"https://i.ebayimg.com/thumbs/images/g/x{i}/s-l225.jpg",
+        "image": image,
+        "condition": "Pre-Owned",
+        "price": {"extracted": 10 + i},
+        "shipping": None,
+        "location": "US",
+        "image_similarity": 0.9,
+    }
+
+
+def _result():
+    return {
+        "mode": "both",
+        "active_listings": [_listing(i) for i in range(6)],
+        "sold_listings": [_listing(i) for i in range(6, 9)],
+        "market_analysis": {"active": {"similar_count": 6}},
+    }
+
+
+def _rows_from_columns(block, prefixes):
+    columns = block["columns"]
+    rows = []
+    for n in range(block["n"]):
+        row = {}
+        for field, values in columns.items():
+            if field.endswith("_prefix"):
+                continue
+            value = values[n]
+            prefix = columns.get(f"{field}_prefix", [None] * block["n"])[n]
+            row[field] = prefixes[prefix] + value if prefix is not None else value
+        if "thumbnail" in row and row["thumbnail"] is None:
+            row["thumbnail"] = row.get("image")
+        rows.append(row)
+    return rows
+
+
+def test_rows_projection_keeps_fields_and_limit_without_touching_the_input():
+    data = _result()
+    original = copy.deepcopy(data)
+    out = output_builder.project_result(data, fields=("title", "price"), limit=2)
+    assert out["active_listings"] == [{"title": l["title"], "price": l["price"]} for l in data["active_listings"][:2]]
+    assert len(out["sold_listings"]) == 2
+    assert out["market_analysis"] == data["market_analysis"]
+    assert data == original
+
+
+def test_no_fields_keeps_the_count_only():
+    out = output_builder.project_result(_result(), fields=(), limit=None)
+    assert out["active_listings"] == [{}] * 6
+
+
+def test_columnar_round_trips_to_the_rows():
+    data = _result()
+    out = output_builder.project_result(data, listing_format="columnar")
+    assert out["listing_format"] == "columnar"
+    for key in ("active_listings", "sold_listings"):
+        assert _rows_from_columns(out[key], out["url_prefixes"]) == data[key]
+    links = out["active_listings"]["columns"]
+    assert links["link_prefix"][:3] == [None, 2, 2]
+    # A thumbnail equal to the image is sent once.
+    assert links["thumbnail"][1] is None and links["thumbnail"][0] is not None
+
+
+def test_columnar_with_a_field_subset_and_limit():
+    out = output_builder.project_result(_result(), fields=("title", "link"), limit=1, listing_format="columnar")
+    assert out["sold_listings"] == {
+        "n": 1,
+        "columns": {"title": ["Sony Walkman WM-6"], "link_prefix": [None], "link": ["https://example.com/6"]},
+    }
+
+
+@pytest.mark.parametrize("fields", [None, "", " ", ","])
+def test_missing_or_empty_fields_keep_every_field(fields):
+    assert parse_result_view(fields, None, None) is None
+    assert parse_result_view(fields, 3, None) == {"fields": None, "limit": 3, "listing_format": "rows"}
+
+
+def test_fields_none_sentinel_and_field_lists():
+    assert parse_result_view("none", None, None)["fields"] == ()
+    assert parse_result_view("NONE", None, None)["fields"] == ()
+    assert parse_result_view("title, price,title", None, "COLUMNAR") == {
+        "fields": ("title", "price"),
+        "limit": None,
+        "listing_format": "columnar",
+    }
+
+
+@pytest.mark.parametrize(
+    "args",
+    [("title,nope", None, None), (None, -1, None), (None, output_builder.LISTING_LIMIT_MAX + 1, None), (None, None, "csv")],
+)
+def test_bad_views_are_400(args):
+    with pytest.raises(HTTPException) as exc:
+        parse_result_view(*args)
+    assert exc.value.status_code == 400
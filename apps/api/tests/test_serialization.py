@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pytest
+
+from bench.micro import make_listings
+from helpers import output_builder, serialization
+
+orjson = pytest.importorskip("orjson")
+
+
+def _payload():
+    priced = make_listings(30, seed=0, embeddings=False)
+    data = output_builder.build_frontend_payload(
+        mode="both",
+        initial_query="sony walkman",
+        refined_query="sony walkman wm-10",
+        active_ranked={"filtered_items": priced},
+        sold_ranked={"filtered_items": priced},
+    )
+    data["market_analysis"]["segments"] = output_builder.compute_segmented_summaries(priced)
+    return {"type": "result", "data": data}
+
+
+class Opaque:
+    def __str__(self):
+        return "opaque!"
+
+
+PAYLOADS = [
+    _payload(),
+    {"type": "step", "step_id": "gen_query", "label": "Génération – requête", "pct": 0.02},
+    {"ints": {1: "a", 2: "b"}, "np": np.float32(2.5), "arr": np.arange(3), "set": {1}, "tuple": (1, 2)},
+    {"nan": float("nan"), "inf": [float("-inf")], "np_nan": np.array([1.0, np.nan])},
+    {(1, 2): "tuple key", "obj": Opaque()},
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_stdlib_fallback_writes_the_same_bytes_as_orjson(payload, monkeypatch):
+    fast = serialization.ndjson_line(payload)
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert serialization.ndjson_line(payload) == fast
+    assert fast.endswith(b"\n") and fast.count(b"\n") == 1
+
+
+def test_non_finite_floats_become_null():
+    assert json.loads(serialization.dumps({"a": float("nan"), "b": [float("inf")]})) == {"a": None, "b": [None]}
+
+
+def test_output_matches_the_sanitized_encoding():
+    payload = _payload()
+    assert json.loads(serialization.ndjson_line(payload)) == json.loads(json.dumps(output_builder.json_sanitize(payload)))
+
+
+def test_precomputed_event_reuses_its_line():
+    step = {"type": "step", "step_id": "s", "status": "start"}
+    event = serialization.precomputed(step)
+    assert event == step
+    assert serialization.ndjson_line(event) is event.line
+    assert json.loads(event.line) == step
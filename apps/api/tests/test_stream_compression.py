@@ -0,0 +1,80 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from starlette.requests import Request
+
+from helpers import stream_compression
+
+EVENTS = [
+    b'{"type":"step","step_id":"gen_query","status":"start"}\n',
+    b'{"type":"step","step_id":"gen_query","status":"done"}\n',
+    b'{"type":"result","data":{"active_listings":[' + b'{"link":"https://www.ebay.com/itm/1"},' * 40 + b"{}]}}\n",
+]
+
+
+async def _events():
+    for e in EVENTS:
+        yield e
+
+
+async def _collect(chunks):
+    return [c async for c in chunks]
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (None, None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("gzip;q=0", None),
+        ("deflate, gzip;q=0.5", "gzip"),
+        ("*", "br" if stream_compression.brotli is not None else "gzip"),
+        ("br", "br" if stream_compression.brotli is not None else None),
+    ],
+)
+def test_negotiate_encoding(header, expected):
+    assert stream_compression.negotiate_encoding(header) == expected
+
+
+def test_compression_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(stream_compression, "NDJSON_COMPRESSION", False)
+    assert stream_compression.negotiate_encoding("gzip") is None
+
+
+def test_gzip_flushes_every_event_so_it_decodes_on_arrival():
+    chunks = asyncio.run(_collect(stream_compression._compressed(_events(), "gzip", "test")))
+    assert len(chunks) == len(EVENTS) + 1  # One chunk per event, then the gzip trailer.
+
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for event, chunk in zip(EVENTS, chunks):
+        assert decoder.decompress(chunk) == event
+    assert gzip.decompress(b"".join(chunks)) == b"".join(EVENTS)
+    assert sum(map(len, chunks)) < sum(map(len, EVENTS))
+
+
+def test_stats_count_raw_and_sent_bytes():
+    before = stream_compression.compression_stats()
+    chunks = asyncio.run(_collect(stream_compression._compressed(_events(), "gzip", "test")))
+    after = stream_compression.compression_stats()
+    assert after["streams"]["gzip"] == before["streams"]["gzip"] + 1
+    assert after["raw_bytes"]["gzip"] - before["raw_bytes"]["gzip"] == sum(map(len, EVENTS))
+    assert after["sent_bytes"]["gzip"] - before["sent_bytes"]["gzip"] == sum(map(len, chunks))
+
+
+def test_response_headers_follow_the_negotiated_encoding():
+    async def build(accept):
+        scope = {"type": "http", "headers": [(b"accept-encoding", accept.encode())]}
+        resp = stream_compression.ndjson_response(_events(), request=Request(scope), label="test")
+        body = b"".join([c async for c in resp.body_iterator])
+        return resp, body
+
+    resp, body = asyncio.run(build("gzip"))
+    assert resp.headers["content-encoding"] == "gzip" and resp.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(body) == b"".join(EVENTS)
+
+    resp, body = asyncio.run(build("identity"))
+    assert "content-encoding" not in resp.headers
+    assert body == b"".join(EVENTS)
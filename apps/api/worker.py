@@ -0,0 +1,32 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from helpers import image_processing, job_service, loop_monitor
+
+load_dotenv()
+
+
+async def main() -> None:
+    """
+    Runs extract job workers without the web tier.
+    Point JOB_DB_PATH at the same SQLite file the API uses and set JOB_WORKERS=0 on the API
+    if all jobs should run here.
+    """
+    loop_monitor.start_loop_monitor()
+    await image_processing.CLIP.aget()
+
+    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    count = int(os.getenv("JOB_WORKER_PROCESS_WORKERS", "2"))
+    job_service.start_workers(openai_client=openai_client, count=count)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_service.stop_workers()
+        await loop_monitor.stop_loop_monitor()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())